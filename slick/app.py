@@ -8,6 +8,13 @@ from slick.tor import Tor
 from slick.certificate import Certificate
 from slick.identity import Identity
 from slick.friend_list import FriendList
+from slick.chunk_store import ChunkStore
+from slick.client_pool import ClientPool
+from slick.health import HealthChecker, idle_timeout
+from slick.scheduler import TransferScheduler
+from slick.metadata import MetadataCache
+from slick.swarm import Swarm
+from slick.writer import default_writer
 from slick.discovery import Discovery
 from slick.server import CertServer, TalkServer
 from slick.logger import logger
@@ -22,15 +29,28 @@ class ServiceStatus(Enum):
 
 
 class App:
-    def __init__(self, *, base, loop, message_handler, friend_handler):
+    def __init__(
+        self,
+        *,
+        base,
+        loop,
+        message_handler,
+        friend_handler,
+        writer=default_writer,
+        idle_timeout=idle_timeout,
+    ):
         self.delete_at_exit = False
 
         self.base = base
+        self.writer = writer
         self.service_states = {}
 
         self.tor = Tor(self)
         self.certificate = Certificate(self)
         self.friend_list = FriendList(self)
+        self.chunk_store = ChunkStore(self)
+        self.client_pool = ClientPool(self)
+        self.health = HealthChecker(self, idle=idle_timeout)
         self.identity = Identity(self)
         self.cert_server = CertServer(self)
         self.discovery = Discovery(self, loop)
@@ -43,12 +63,18 @@ class App:
             self.tor,
             self.certificate,
             self.friend_list,
+            self.chunk_store,
+            self.client_pool,
+            self.health,
             self.identity,
             self.cert_server,
             self.discovery,
             self.talk_server,
         ]
         self.service_tasks = []
+        self.scheduler = TransferScheduler(self)
+        self.metadata = MetadataCache()
+        self.swarm = Swarm(self)
 
     def initialize(self):
         if self.base is None:
@@ -101,8 +127,8 @@ class App:
     def get_nearby(self):
         return self.discovery.nearby
 
-    def offer_file(self, friend, path):
-        return self.talk_server.offer_file(friend, path)
+    def offer_file(self, friend, path, metadata):
+        return self.talk_server.offer_file(friend, path, metadata)
 
     async def _start_service(self, service):
         try:
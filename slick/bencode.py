@@ -1,4 +1,30 @@
 import typed_bencode
 
 Request = typed_bencode.for_dict(cert=bytes, name=str, public_key=bytes)
-File = typed_bencode.for_dict(url=str, size=int, type=str, name=str)
+# version 1 offers carried only url, size, type and name, and version 1 peers
+# fail to decode an offer with any other key, so they cannot read offers from
+# later versions. An offer without a version is a version 1 offer
+file_version = 2
+File = typed_bencode.for_dict(
+    version=int,
+    url=str,
+    size=int,
+    type=str,
+    name=str,
+    root=bytes,
+    chunk_size=int,
+    inline=int,
+    content=bytes,
+).default(version=1, root=b"", chunk_size=0, inline=0, content=b"")
+DeltaSignature = typed_bencode.for_dict(block_size=int, checksums=bytes)
+Delta = typed_bencode.for_dict(copies=bytes)
+BundleEntry = typed_bencode.for_dict(path=bytes, size=int, mode=int)
+BundleListing = typed_bencode.for_dict(
+    entries=typed_bencode.for_list(subtype=BundleEntry),
+    directories=typed_bencode.for_list(subtype=bytes),
+)
+HeldContent = typed_bencode.for_dict(size=int, chunk_size=int, leaves=bytes)
+ChannelMessage = typed_bencode.for_dict(seq=int, content_type=bytes, data=bytes)
+ChannelFrame = typed_bencode.for_dict(
+    ack=int, messages=typed_bencode.for_list(subtype=ChannelMessage)
+)
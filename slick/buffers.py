@@ -0,0 +1,57 @@
+import asyncio
+import collections
+
+piece_size = 65536
+pool_pieces = 256
+
+
+class BufferPool:
+    def __init__(self, size=piece_size, count=pool_pieces):
+        self.size = size
+        self.count = count
+        self.allocated = 0
+        self.free = []
+        self.waiters = collections.deque()
+
+    def exhausted(self):
+        return not self.free and self.allocated >= self.count
+
+    async def acquire(self):
+        if self.free:
+            return self.free.pop()
+        if self.allocated < self.count:
+            self.allocated += 1
+            return bytearray(self.size)
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append(future)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(future.result())
+            raise
+
+    def release(self, buffer):
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(buffer)
+                return
+        self.free.append(buffer)
+
+    def stats(self):
+        return {
+            "buffers": self.allocated,
+            "free": len(self.free),
+            "bytes": self.allocated * self.size,
+        }
+
+
+async def read_into(stream, view):
+    filled = 0
+    while filled < len(view):
+        data = await stream.read(len(view) - filled)
+        if not data:
+            raise IOError(f"stream ended {len(view) - filled} bytes short")
+        view[filled : filled + len(data)] = data
+        filled += len(data)
@@ -0,0 +1,283 @@
+import os
+import bisect
+import asyncio
+import hashlib
+import posixpath
+from stat import S_ISREG
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from slick.bencode import BundleListing
+
+bundle_type = "application/x-slick-bundle"
+max_open_files = 64
+# past this many files touched since the last fsync, a single sync is
+# cheaper than syncing them one by one
+sync_threshold = 256
+
+
+class Entry:
+    def __init__(self, path, *, size, mode, offset, mtime=0):
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.offset = offset
+        self.mtime = mtime
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+
+class Bundle:
+    @classmethod
+    def scan(cls, root):
+        entries = []
+        directories = []
+        offset = 0
+        # a sorted walk gives the same layout, and so the same manifest,
+        # every time the tree is scanned unchanged
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            relative = os.path.relpath(dirpath, root)
+            if relative == ".":
+                relative = ""
+            else:
+                directories.append(to_wire(relative))
+            for name in sorted(filenames):
+                stat = os.lstat(os.path.join(dirpath, name))
+                # links are left out rather than followed out of the tree
+                if not S_ISREG(stat.st_mode):
+                    continue
+                entries.append(
+                    Entry(
+                        to_wire(os.path.join(relative, name)),
+                        size=stat.st_size,
+                        mode=stat.st_mode & 0o777,
+                        offset=offset,
+                        mtime=stat.st_mtime_ns,
+                    )
+                )
+                offset += stat.st_size
+        return Bundle(entries, directories)
+
+    @classmethod
+    def decode(cls, data):
+        listing = BundleListing.decode(data)
+        entries = []
+        offset = 0
+        for entry in listing["entries"]:
+            path = check_path(entry["path"])
+            # only permission bits are taken from a peer, never setuid,
+            # setgid or sticky ones
+            mode = entry["mode"] & 0o777
+            entries.append(Entry(path, size=entry["size"], mode=mode, offset=offset))
+            offset += entry["size"]
+        directories = [check_path(path) for path in listing["directories"]]
+        return Bundle(entries, directories)
+
+    def __init__(self, entries, directories):
+        self.entries = entries
+        self.directories = directories
+        self.offsets = [entry.offset for entry in entries]
+        self.size = entries[-1].end if entries else 0
+
+    @property
+    def mtime(self):
+        return max((entry.mtime for entry in self.entries), default=0) / 1e9
+
+    def encode(self):
+        return BundleListing.encode(
+            {
+                "entries": [
+                    {"path": entry.path, "size": entry.size, "mode": entry.mode}
+                    for entry in self.entries
+                ],
+                "directories": self.directories,
+            }
+        )
+
+    def fingerprint(self):
+        digest = hashlib.sha256(self.encode())
+        for entry in self.entries:
+            digest.update(entry.mtime.to_bytes(8, "big"))
+        return digest.digest()
+
+    def spans(self, start, end):
+        # yields the pieces of each file that a bundle byte range covers
+        index = max(0, bisect.bisect_right(self.offsets, start) - 1)
+        while start < end and index < len(self.entries):
+            entry = self.entries[index]
+            if entry.end > start:
+                stop = min(end, entry.end)
+                yield entry, start - entry.offset, stop - start
+                start = stop
+            index += 1
+
+    def create(self, root):
+        os.makedirs(root, exist_ok=True)
+        for directory in self.directories:
+            os.makedirs(local_path(root, directory), exist_ok=True)
+        for entry in self.entries:
+            path = local_path(root, entry.path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # files stay writable while they are filled in, their modes are
+            # applied once the bundle is complete
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, entry.size)
+            finally:
+                os.close(fd)
+
+    def apply_modes(self, root):
+        for entry in self.entries:
+            os.chmod(local_path(root, entry.path), entry.mode & 0o777 or 0o644)
+
+
+def to_wire(path):
+    return os.fsencode(path).replace(os.sep.encode(), b"/")
+
+
+def check_path(path):
+    # the listing comes from a peer, so nothing in it may leave the target
+    normalized = posixpath.normpath(path.decode("utf-8", "surrogateescape"))
+    if normalized.startswith(("/", "../")) or normalized in ("..", "."):
+        raise ValueError(f"bundle path {path!r} escapes the bundle")
+    return normalized.encode("utf-8", "surrogateescape")
+
+
+def local_path(root, path):
+    return os.path.join(root, *os.fsdecode(path).split("/"))
+
+
+class FileCache:
+    def __init__(self, root, flags):
+        self.root = root
+        self.flags = flags
+        self.fds = OrderedDict()
+
+    def get(self, entry):
+        fd = self.fds.get(entry.path)
+        if fd is not None:
+            self.fds.move_to_end(entry.path)
+            return fd
+        fd = os.open(local_path(self.root, entry.path), self.flags)
+        self.fds[entry.path] = fd
+        while len(self.fds) > max_open_files:
+            _, old_fd = self.fds.popitem(last=False)
+            os.close(old_fd)
+        return fd
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds.clear()
+
+
+class BundleReader:
+    def __init__(self, root, bundle):
+        self.bundle = bundle
+        self.files = FileCache(root, os.O_RDONLY)
+        self.position = 0
+
+    def seek(self, offset):
+        self.position = offset
+
+    def read(self, count):
+        end = min(self.bundle.size, self.position + count)
+        pieces = []
+        for entry, offset, length in self.bundle.spans(self.position, end):
+            data = os.pread(self.files.get(entry), length, offset)
+            if len(data) != length:
+                raise IOError(f"{os.fsdecode(entry.path)} changed while offered")
+            pieces.append(data)
+        self.position = end
+        return b"".join(pieces)
+
+    def close(self):
+        self.files.close()
+
+
+class AsyncBundleReader:
+    def __init__(self, root, bundle):
+        self.reader = BundleReader(root, bundle)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.reader.close()
+
+    async def seek(self, offset):
+        self.reader.seek(offset)
+
+    async def read(self, count):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.reader.read, count)
+
+
+class BundleWriter:
+    def __init__(self, root, bundle):
+        self.root = root
+        self.bundle = bundle
+        self.files = None
+        self.pool = None
+        self.dirty = set()
+
+    async def open(self):
+        self.files = FileCache(self.root, os.O_RDWR)
+        # one thread at a time touches the descriptor cache
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    async def write(self, data, offset, release=None):
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self.pool, self._write, data, offset)
+        finally:
+            if release:
+                release()
+
+    def _write(self, data, offset):
+        view = memoryview(data)
+        for entry, file_offset, length in self.bundle.spans(offset, offset + len(data)):
+            fd = self.files.get(entry)
+            piece = view[entry.offset + file_offset - offset :][:length]
+            while piece:
+                written = os.pwrite(fd, piece, file_offset)
+                file_offset += written
+                piece = piece[written:]
+            self.dirty.add(entry.path)
+
+    async def flush(self):
+        pass
+
+    async def fsync(self):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.pool, self._fsync)
+
+    def _fsync(self):
+        dirty, self.dirty = self.dirty, set()
+        if len(dirty) > sync_threshold and hasattr(os, "sync"):
+            os.sync()
+            return
+        for path in dirty:
+            fd = os.open(local_path(self.root, path), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    async def close(self):
+        try:
+            await self.fsync()
+        finally:
+            self.files.close()
+            self.pool.shutdown(wait=True)
+
+
+async def open_bundle_writer(root, bundle, create):
+    loop = asyncio.get_event_loop()
+    if create:
+        await loop.run_in_executor(None, bundle.create, root)
+    writer = BundleWriter(root, bundle)
+    await writer.open()
+    return writer
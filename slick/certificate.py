@@ -1,4 +1,5 @@
 import os
+import ssl
 import datetime
 import asyncio
 import hashlib
@@ -11,12 +12,52 @@ from cryptography.hazmat.primitives import hashes
 from slick.logger import logger
 
 
+# aiohttp speaks HTTP/1.1 only, on both ends, so that is all either side
+# offers; a peer that could do more still settles on it in the handshake
+alpn_protocols = ["http/1.1"]
+
+
+class SessionObject(ssl.SSLObject):
+    def do_handshake(self):
+        super().do_handshake()
+        self.context.handshake_done(self)
+
+
+class SessionContext(ssl.SSLContext):
+    sslobject_class = SessionObject
+
+    def __init__(self, protocol):
+        super().__init__()
+        self.last = None
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, **kwargs):
+        # a client offers the session of its last connection to the same
+        # peer, so a reconnect resumes instead of redoing the full handshake
+        if not server_side and kwargs.get("session") is None and self.last:
+            kwargs["session"] = self.last.session
+        return super().wrap_bio(incoming, outgoing, server_side, **kwargs)
+
+    def handshake_done(self, sslobj):
+        self.handshakes += 1
+        if sslobj.session_reused:
+            self.resumed += 1
+        if not sslobj.server_side:
+            # tickets may only arrive after the handshake, so the session is
+            # read from the connection when the next one is opened
+            self.last = sslobj
+
+
 class Certificate:
     def __init__(self, app):
         self.app = app
         self.server_key_path = os.path.join(self.app.base, "server.key")
         self.server_cert_path = os.path.join(self.app.base, "server.crt")
         self.public_cert_bytes_result = asyncio.Future()
+        self.client_contexts = {}
+        self.server_context_cache = None
+        self.trusted = set()
 
     @property
     def _name(self):
@@ -88,6 +129,57 @@ class Certificate:
         await self.public_cert_bytes_result
         return self.public_cert_bytes_result.result()
 
+    def client_context(self, friend):
+        # one context per friend certificate, shared by all of that friend's
+        # connections and kept across reconnects
+        context = self.client_contexts.get(friend.digest)
+        if context is None:
+            context = self.new_context(ssl.PROTOCOL_TLS_CLIENT)
+            context.load_verify_locations(cadata=friend.cert)
+            self.client_contexts[friend.digest] = context
+        return context
+
+    def server_context(self, friends):
+        # a restart only loads the certificates of friends added since the
+        # last one
+        if self.server_context_cache is None:
+            self.server_context_cache = self.new_context(ssl.PROTOCOL_TLS_SERVER)
+            self.trusted = set()
+        for friend in friends:
+            if friend.digest not in self.trusted:
+                self.server_context_cache.load_verify_locations(cadata=friend.cert)
+                self.trusted.add(friend.digest)
+        return self.server_context_cache
+
+    def forget(self, friend):
+        self.client_contexts.pop(friend.digest, None)
+        if friend.digest in self.trusted:
+            self.server_context_cache = None
+
+    def session_stats(self):
+        client = list(self.client_contexts.values())
+        server = [self.server_context_cache] if self.server_context_cache else []
+        return {
+            side: {
+                "handshakes": sum(c.handshakes for c in contexts),
+                "resumed": sum(c.resumed for c in contexts),
+            }
+            for side, contexts in (("client", client), ("server", server))
+        }
+
+    def new_context(self, protocol):
+        # peers are only ever checked against their own certificate, so the
+        # system CA store, by far the slowest part of building a context, is
+        # never loaded
+        context = SessionContext(protocol)
+        context.load_cert_chain(
+            certfile=self.server_cert_path, keyfile=self.server_key_path
+        )
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_REQUIRED
+        context.set_alpn_protocols(alpn_protocols)
+        return context
+
     async def digest(self) -> bytes:
         m = hashlib.sha256()
         m.update(await self.public_cert_bytes())
@@ -0,0 +1,187 @@
+import os
+import asyncio
+from collections import OrderedDict
+import aiohttp
+from slick.bencode import ChannelFrame
+from slick.logger import logger
+
+channel_path = "/channel"
+text_type = "text/plain"
+file_type = "x-slick/file"
+# messages queued within this window go out together in one frame
+batch_window = 0.005
+max_batch = 64
+ack_timeout = 120
+heartbeat = 30
+max_backoff = 30
+# the receiving side remembers how far this many senders have got
+max_sessions = 1024
+
+
+class Outgoing:
+    def __init__(self, seq, content_type, data):
+        self.seq = seq
+        self.content_type = content_type
+        self.data = data
+        self.sent = False
+        self.future = asyncio.get_event_loop().create_future()
+
+
+class Channel:
+    def __init__(self, friend):
+        self.friend = friend
+        # a new session id per run of the app, so the receiver never takes
+        # a restarted sender's numbering for messages it has already seen
+        self.session = os.urandom(8).hex()
+        self.next_seq = 1
+        self.unacked = OrderedDict()
+        self.queued = asyncio.Event()
+        self.task = None
+        self.supported = True
+        self.frames = 0
+        self.messages = 0
+
+    async def send(self, content_type, data):
+        outgoing = Outgoing(self.next_seq, content_type, data)
+        self.next_seq += 1
+        self.unacked[outgoing.seq] = outgoing
+        self.queued.set()
+        if not self.task or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        try:
+            return await asyncio.wait_for(asyncio.shield(outgoing.future), ack_timeout)
+        except asyncio.TimeoutError:
+            # a message that never went out is dropped, one that did may
+            # still be acknowledged by a later frame. Messages carry their
+            # own seq, so the receiver just sees a gap in the numbering
+            if not outgoing.sent:
+                self.unacked.pop(outgoing.seq, None)
+            return False
+
+    async def run(self):
+        failures = 0
+        while self.unacked:
+            connection = self.friend.connection()
+            if connection.active:
+                try:
+                    if self.supported:
+                        await self.stream(connection)
+                    else:
+                        await self.post(connection)
+                    failures = 0
+                    continue
+                except aiohttp.WSServerHandshakeError as e:
+                    if e.status == 404:
+                        logger.debug(f"{connection} has no channel, posting instead")
+                        self.supported = False
+                        continue
+                    logger.debug(f"could not open a channel over {connection}: {e}")
+                except Exception as e:
+                    logger.debug(f"channel over {connection} broke: {e!r}")
+            failures += 1
+            await asyncio.sleep(min(max_backoff, 0.5 * 2 ** failures))
+
+    async def stream(self, connection):
+        ws = await connection.open_channel(self.session)
+        logger.debug(f"opened a channel to {self.friend.name} over {connection}")
+        # whatever the last channel left unacknowledged goes out again, the
+        # receiver drops the ones it already has
+        for outgoing in self.unacked.values():
+            outgoing.sent = False
+        receiver = asyncio.ensure_future(self.receive(ws, connection))
+        try:
+            while True:
+                if not self.pending():
+                    self.queued.clear()
+                    waiter = asyncio.ensure_future(self.queued.wait())
+                    done, _ = await asyncio.wait(
+                        [waiter, receiver],
+                        timeout=connection.app.health.idle,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    waiter.cancel()
+                    if receiver.done():
+                        receiver.result()
+                    # after a while with nothing to say or hear back, the
+                    # channel is let go until the next message
+                    if not done and not self.unacked:
+                        return
+                    continue
+                await asyncio.sleep(batch_window)
+                await ws.send_bytes(self.frame())
+        finally:
+            receiver.cancel()
+            await ws.close()
+
+    def pending(self):
+        return any(not outgoing.sent for outgoing in self.unacked.values())
+
+    def frame(self):
+        batch = [o for o in self.unacked.values() if not o.sent][:max_batch]
+        for outgoing in batch:
+            outgoing.sent = True
+        self.frames += 1
+        self.messages += len(batch)
+        return ChannelFrame.encode(
+            {
+                "ack": 0,
+                "messages": [
+                    {
+                        "seq": o.seq,
+                        "content_type": o.content_type.encode(),
+                        "data": o.data,
+                    }
+                    for o in batch
+                ],
+            }
+        )
+
+    async def receive(self, ws, connection):
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.BINARY:
+                continue
+            connection.seen()
+            self.acked(ChannelFrame.decode(msg.data)["ack"])
+        raise IOError("channel closed")
+
+    def acked(self, ack):
+        # acknowledgements are cumulative, one covers every message up to it
+        while self.unacked:
+            seq, outgoing = next(iter(self.unacked.items()))
+            if seq > ack:
+                break
+            del self.unacked[seq]
+            if not outgoing.future.done():
+                outgoing.future.set_result(True)
+
+    async def post(self, connection):
+        seq, outgoing = next(iter(self.unacked.items()))
+        outgoing.sent = True
+        ok = await connection.post(outgoing.data, outgoing.content_type)
+        self.unacked.pop(seq, None)
+        if not outgoing.future.done():
+            outgoing.future.set_result(ok)
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "messages": self.messages,
+            "unacked": len(self.unacked),
+        }
+
+
+class Deliveries:
+    def __init__(self):
+        self.sessions = OrderedDict()
+
+    def get(self, key):
+        delivered = self.sessions.get(key, 0)
+        if key in self.sessions:
+            self.sessions.move_to_end(key)
+        return delivered
+
+    def set(self, key, delivered):
+        self.sessions[key] = delivered
+        self.sessions.move_to_end(key)
+        while len(self.sessions) > max_sessions:
+            self.sessions.popitem(last=False)
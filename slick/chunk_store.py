@@ -0,0 +1,158 @@
+import os
+import asyncio
+import threading
+from collections import OrderedDict
+from slick.manifest import hash_chunk
+from slick.logger import logger
+
+default_max_size = 4 * 1024 ** 3
+
+
+class ChunkStore:
+    def __init__(self, app, max_size=default_max_size):
+        self.app = app
+        self.max_size = max_size
+        self.size = 0
+        # chunk paths and sizes, least recently used first
+        self.index = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.app.base, "chunks")
+
+    @property
+    def _name(self):
+        return "chunk store"
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._start)
+
+    def _start(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            self.index.clear()
+            for path, size, _ in sorted(self._entries(), key=lambda e: e[2]):
+                self.index[path] = size
+            self.size = sum(self.index.values())
+
+    async def stop(self):
+        pass
+
+    def chunk_path(self, digest):
+        name = digest.hex()
+        return os.path.join(self.path, name[0:2], name)
+
+    def has(self, digest):
+        return self.chunk_path(digest) in self.index
+
+    def get(self, digest):
+        path = self.chunk_path(digest)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        except FileNotFoundError:
+            with self.lock:
+                self._remove(path)
+            return None
+        if hash_chunk(data) != digest:
+            logger.warning(f"dropping corrupt chunk {digest.hex()}")
+            with self.lock:
+                self._remove(path)
+            return None
+        self.touch(path)
+        return data
+
+    def put(self, digest, data):
+        chunk = self.open(digest)
+        if chunk:
+            chunk.write(data)
+            chunk.commit()
+
+    def open(self, digest):
+        path = self.chunk_path(digest)
+        if path in self.index:
+            self.touch(path)
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return PendingChunk(self, path)
+
+    def touch(self, path):
+        with self.lock:
+            if path not in self.index:
+                return
+            self.index.move_to_end(path)
+        # the mtime carries the order over to the next start
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def add(self, chunk):
+        with self.lock:
+            # two downloads may have fetched the same chunk at once, only the
+            # first one to land is kept and counted
+            if chunk.path in self.index:
+                return False
+            os.replace(chunk.tmp_path, chunk.path)
+            self.index[chunk.path] = chunk.size
+            self.size += chunk.size
+            if self.size > self.max_size:
+                self.evict()
+        return True
+
+    def evict(self):
+        # least recently used chunks go first, down to 90% of the budget so
+        # that eviction does not run again on every put
+        target = self.max_size * 0.9
+        while self.index and self.size > target:
+            self._remove(next(iter(self.index)))
+
+    def _remove(self, path):
+        size = self.index.pop(path, None)
+        if size is None:
+            return
+        self.size -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                yield entry.path, stat.st_size, stat.st_mtime
+
+
+class PendingChunk:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.tmp_path = f"{path}.{id(self)}.tmp"
+        self.fh = open(self.tmp_path, "wb")
+        self.size = 0
+
+    def write(self, data):
+        self.fh.write(data)
+        self.size += len(data)
+
+    def commit(self):
+        self.fh.close()
+        if not self.store.add(self):
+            self.discard()
+
+    def abort(self):
+        self.fh.close()
+        self.discard()
+
+    def discard(self):
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
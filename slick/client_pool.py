@@ -0,0 +1,130 @@
+import asyncio
+import aiohttp
+from aiohttp_socks import SocksConnector
+from slick.logger import logger
+
+max_connections = 128
+max_per_host = 8
+# idle sockets are closed after this long, so friends that went quiet do
+# not keep holding one open
+keepalive_timeout = 30
+# messages, probes and the channel get sockets of their own, so they never
+# wait behind a friend's range fetches for one of the bulk sockets
+interactive_per_host = 2
+
+direct_transport = "direct"
+tor_transport = "tor"
+
+
+class ClientPool:
+    def __init__(
+        self,
+        app,
+        *,
+        limit=max_connections,
+        limit_per_host=max_per_host,
+        keepalive=keepalive_timeout,
+    ):
+        self.app = app
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive = keepalive
+        self.sessions = {}
+        # the SOCKS port each Tor session was built for
+        self.socks_ports = {}
+        self.lock = asyncio.Lock()
+
+    @property
+    def _name(self):
+        return "client pool"
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        sessions, self.sessions = self.sessions, {}
+        self.socks_ports = {}
+        for session in sessions.values():
+            await session.close()
+
+    async def session(self, transport, interactive=False):
+        # every friend's connections share one session per transport, and
+        # pooled sockets stay apart per friend because aiohttp keys them by
+        # host and ssl context
+        name = f"{transport} interactive" if interactive else transport
+        socks_port = None
+        if transport == tor_transport:
+            socks_port = await self.app.tor.socks_port()
+        session = self.sessions.get(name)
+        if session and self.socks_ports.get(name) == socks_port:
+            return session
+        async with self.lock:
+            session = self.sessions.get(name)
+            if session and self.socks_ports.get(name) != socks_port:
+                # Tor came back on another port, the old sockets lead nowhere
+                logger.debug(f"tor moved to port {socks_port}, reopening {name}")
+                del self.sessions[name]
+                await session.close()
+                session = None
+            if not session:
+                logger.debug(f"opening the {name} client pool")
+                connector = self.connector(transport, interactive, socks_port)
+                session = aiohttp.ClientSession(
+                    connector=connector, trace_configs=[connection_trace()]
+                )
+                self.sessions[name] = session
+                self.socks_ports[name] = socks_port
+        return session
+
+    def connector(self, transport, interactive=False, socks_port=None):
+        per_host = interactive_per_host if interactive else self.limit_per_host
+        limits = {
+            "limit": self.limit,
+            "limit_per_host": per_host,
+            "keepalive_timeout": self.keepalive,
+        }
+        if transport == tor_transport:
+            return SocksConnector.from_url(
+                f"socks5://127.0.0.1:{socks_port}", rdns=True, **limits
+            )
+        return aiohttp.TCPConnector(**limits)
+
+    def stats(self):
+        stats = {}
+        for transport, session in self.sessions.items():
+            connector = session.connector
+            if connector is None:
+                continue
+            stats[transport] = {
+                **occupancy(connector),
+                "limit": connector.limit,
+                "limit_per_host": connector.limit_per_host,
+            }
+        return stats
+
+
+def occupancy(connector):
+    # aiohttp has no public view of its pool, so its private fields are read
+    # defensively and the counts left as None where a release changed them
+    try:
+        active = len(connector._acquired)
+    except (AttributeError, TypeError):
+        active = None
+    try:
+        idle = sum(len(conns) for conns in connector._conns.values())
+    except (AttributeError, TypeError):
+        idle = None
+    return {"active": active, "idle": idle}
+
+
+def connection_trace():
+    # a request can pass a callback as its trace_request_ctx to hear when it
+    # has a socket, whether a pooled one or a new one
+    async def connected(session, context, params):
+        if callable(context.trace_request_ctx):
+            context.trace_request_ctx()
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_end.append(connected)
+    trace.on_connection_reuseconn.append(connected)
+    return trace
@@ -0,0 +1,118 @@
+import zlib
+import struct
+
+compression_header = "X-Slick-Compression"
+codec = "deflate"
+frame_size = 262_144
+compress_level = 6
+# a frame has to save at least this much to be sent deflated
+min_saving = 0.05
+# after this many frames in a row that did not shrink, only every
+# probe_every-th frame is still tried
+give_up_after = 4
+probe_every = 16
+
+frame_header = struct.Struct(">BI")
+raw_frame = 0
+deflated_frame = 1
+
+compressed_types = {
+    "application/zip",
+    "application/gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/x-lzip",
+    "application/x-compress",
+    "application/zstd",
+    "application/epub+zip",
+    "application/pdf",
+    "application/x-shockwave-flash",
+    "application/font-woff",
+    "application/font-sfnt",
+}
+uncompressed_types = {"image/bmp", "image/x-icon", "audio/x-wav", "image/tiff"}
+
+
+def compressible(mimetype):
+    if mimetype in uncompressed_types:
+        return True
+    if mimetype in compressed_types:
+        return False
+    return mimetype.split("/")[0] not in ("image", "video", "audio")
+
+
+def worth_trying(raw_run):
+    return raw_run < give_up_after or raw_run % probe_every == 0
+
+
+def encode_frame(data, deflate=True):
+    if deflate:
+        compressed = zlib.compress(data, compress_level)
+        if len(compressed) <= len(data) * (1 - min_saving):
+            return frame_header.pack(deflated_frame, len(compressed)) + compressed
+    return frame_header.pack(raw_frame, len(data)) + data
+
+
+def is_deflated(frame):
+    return frame[0] == deflated_frame
+
+
+class FrameReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.remaining = 0
+        self.decompressor = None
+        self.input = b""
+        self.output = b""
+
+    async def read(self, n):
+        # frames decode piece by piece, so a deflated frame never has to be
+        # held in memory whole on this side either
+        while True:
+            if self.output:
+                data, self.output = self.output[:n], self.output[n:]
+                return data
+            if self.decompressor:
+                if self.input:
+                    data = self.decompressor.decompress(self.input, n)
+                    self.input = self.decompressor.unconsumed_tail
+                    if data:
+                        return data
+                    continue
+                if self.remaining:
+                    self.input = await self.stream.read(min(self.remaining, n))
+                    if not self.input:
+                        raise IOError("stream ended inside a frame")
+                    self.remaining -= len(self.input)
+                    continue
+                self.output = self.decompressor.flush()
+                if not self.decompressor.eof:
+                    raise IOError("deflated frame is truncated")
+                self.decompressor = None
+                continue
+            if self.remaining:
+                data = await self.stream.read(min(self.remaining, n))
+                if not data:
+                    raise IOError("stream ended inside a frame")
+                self.remaining -= len(data)
+                return data
+            if not await self.next_frame():
+                return b""
+
+    async def next_frame(self):
+        header = b""
+        while len(header) < frame_header.size:
+            data = await self.stream.read(frame_header.size - len(header))
+            if not data:
+                if header:
+                    raise IOError("stream ended inside a frame header")
+                return False
+            header += data
+        kind, self.remaining = frame_header.unpack(header)
+        if kind == deflated_frame:
+            self.decompressor = zlib.decompressobj()
+        elif kind != raw_frame:
+            raise IOError(f"unknown frame kind {kind}")
+        return True
@@ -1,14 +1,40 @@
 import os
-import ssl
 import json
-import aiohttp
-import asyncio
-import filetype
+import time
 import aiofiles
-from datetime import datetime
-from aiohttp_socks import SocksConnector
+from contextlib import asynccontextmanager
 from slick.logger import logger
-from slick.bencode import File
+from slick.client_pool import direct_transport, tor_transport
+from slick.bencode import File, file_version
+from slick.manifest import Manifest
+from slick.swarm import content_url
+from slick.channel import channel_path, heartbeat
+from slick.compression import compression_header, codec, FrameReader
+
+inline_size = 65536
+
+
+def read_offer(data):
+    try:
+        file = File.decode(data)
+    except (KeyError, IndexError, AssertionError, ValueError) as e:
+        raise ValueError(f"unreadable file offer: {e!r}")
+    version = file.get("version", 1)
+    if version > file_version:
+        raise ValueError(f"file offer is from protocol version {version}")
+    return file
+
+
+def inline_content(file):
+    # content carried in an offer is only written out if it is what the
+    # offer describes
+    content = file["content"]
+    if len(content) != file["size"]:
+        return None
+    root = file.get("root")
+    if root and Manifest.for_content(content, file.get("chunk_size")).root != root:
+        return None
+    return content
 
 
 class BaseConnection:
@@ -17,63 +43,59 @@ class BaseConnection:
         self.friend = friend
         self.active = False
         self.running = True
-        self.connect_task = None
-        self.ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
-        self.ssl_context.load_cert_chain(
-            certfile=os.path.join(self.app.base, "server.crt"),
-            keyfile=os.path.join(self.app.base, "server.key"),
-        )
-        self.ssl_context.load_verify_locations(cadata=self.friend.cert)
-        self.ssl_context.check_hostname = False
-        self.ssl_context.verify_mode = ssl.CERT_REQUIRED
-        self.pause_time = 0
-
-    async def connect(self):
+        self.session = None
+        self.interactive_session = None
+        self.last_seen = 0
+        self.last_used = 0
+        self.in_use = False
+        self.failures = 0
+
+    @property
+    def ssl_context(self):
+        return self.app.certificate.client_context(self.friend)
+
+    async def probe(self, timeout):
         try:
-            while True:
-                logger.debug(f"starting connect for {self}")
-                self.active = False
-                self.connect_task = asyncio.ensure_future(self._connect())
-                await self.connect_task
-        except asyncio.CancelledError as e:
-            logger.debug("re-connecting...")
+            pool = self.app.client_pool
+            self.session = await pool.session(self.transport)
+            self.interactive_session = await pool.session(
+                self.transport, interactive=True
+            )
+            logger.debug(f"pinging {self}")
+            async with self.interactive_session.head(
+                f"https://{self.host}/", ssl=self.ssl_context, timeout=timeout
+            ) as resp:
+                logger.debug(f"ping response from {self} {resp}")
+                # a probe shows the connection is up but does not keep it
+                # in use
+                self.active = True
+                self.last_seen = time.monotonic()
         except Exception as e:
-            logger.exception(e)
-            await asyncio.sleep(self.pause_time)
-        finally:
-            asyncio.create_task(self.connect())
-
-    def restart_connection(self):
-        if not self.connect_task:
-            return
-        logger.debug(f"restarting {self}")
-        self.connect_task.cancel()
-
-    async def ping(self):
-        while self.running:
-            start_time = datetime.now()
-            try:
-                logger.debug(f"pinging {self}")
-                async with self.session.head(
-                    f"https://{self.host}/", ssl=self.ssl_context, timeout=60
-                ) as resp:
-                    logger.debug(f"ping response from {self} {resp}")
-                    self.active = True
-            except Exception as e:
-                logger.debug("error while pinging %s", e)
-                self.active = False
-            finally:
-                end_time = datetime.now()
-                sleep_time = max(
-                    [self.pause_time - (end_time - start_time).total_seconds(), 0]
-                )
-                logger.debug("sleeping for %s", sleep_time)
-                await asyncio.sleep(sleep_time)
-
-    async def send(self, message):
-        async with self.session.post(
-            f"https://{self.host}/", ssl=self.ssl_context, data=message.encode()
+            logger.debug(f"error while pinging {self}: {e}")
+            self.active = False
+        return self.active
+
+    def seen(self):
+        self.active = True
+        self.last_seen = self.last_used = time.monotonic()
+
+    async def open_channel(self, session):
+        ws = await self.interactive_session.ws_connect(
+            f"https://{self.host}{channel_path}?session={session}",
+            ssl=self.ssl_context,
+            heartbeat=heartbeat,
+        )
+        self.seen()
+        return ws
+
+    async def post(self, data, content_type):
+        async with self.interactive_session.post(
+            f"https://{self.host}/",
+            ssl=self.ssl_context,
+            data=data,
+            headers={"Content-Type": content_type},
         ) as resp:
+            self.seen()
             logger.debug("send response %s", resp)
             if resp.status == 201:
                 return True
@@ -81,83 +103,116 @@ class BaseConnection:
                 logger.warning("got an unusual status response %s", resp)
                 return False
 
-    async def offer_file(self, path):
+    async def offer_data(self, path):
         abspath = os.path.abspath(path)
-        name = os.path.basename(path)
-        url = self.app.offer_file(self.friend, abspath)
-        async with aiofiles.open(abspath, "rb") as fh:
-            ft = filetype.match(await fh.read(261))
-            mimetype = ft.mime if ft else "application/octet-stream"
-            stat = os.stat(abspath)
-            data = File.encode(
-                {"url": url, "size": stat.st_size, "type": ft.mime, "name": name}
-            )
-            async with self.session.post(
-                f"https://{self.host}/",
-                ssl=self.ssl_context,
-                data=data,
-                headers={"Content-Type": "x-slick/file"},
-            ) as resp:
-                logger.debug("send response %s", resp)
+        name = os.path.basename(abspath)
+        metadata = await self.app.metadata.get(abspath, manifest=True)
+        offered_file = self.app.offer_file(self.friend, abspath, metadata)
+        # small files ride along in the offer, saving the receiver every
+        # round trip of a ranged download
+        inline = metadata.size <= inline_size and not metadata.bundle
+        content = b""
+        if inline:
+            async with aiofiles.open(abspath, "rb") as fh:
+                content = await fh.read()
+        return File.encode(
+            {
+                "version": file_version,
+                "url": offered_file.url,
+                "size": metadata.size,
+                "type": metadata.mimetype,
+                "name": name,
+                "root": metadata.manifest.root,
+                "chunk_size": metadata.manifest.chunk_size,
+                "inline": int(inline),
+                "content": content,
+            }
+        )
 
-    async def get_file(self, path, range=None):
+    @asynccontextmanager
+    async def open_file(self, path, range=None, connected=None):
         url = f"https://{self.host}{path}"
         logger.debug("send response %s", url)
-        headers = {}
+        headers = {compression_header: codec}
         if range:
-            headers["Range"] = f"bytes={range[0]}-{range[1]}"
+            headers["Range"] = f"bytes={range[0]}-{range[1] - 1}"
 
-        async with self.session.get(url, ssl=self.ssl_context, headers=headers) as resp:
-            return await resp.content.read()
+        async with self.session.get(
+            url, ssl=self.ssl_context, headers=headers, trace_request_ctx=connected
+        ) as resp:
+            self.seen()
+            if resp.status not in (200, 206):
+                raise IOError(f"could not get {path}: {resp.status}")
+            if resp.headers.get(compression_header) == codec:
+                yield FrameReader(resp.content)
+            else:
+                yield resp.content
+
+    async def get_delta(self, path, signature):
+        url = f"https://{self.host}{path}/delta"
+        async with self.session.post(url, ssl=self.ssl_context, data=signature) as resp:
+            self.seen()
+            if resp.status == 409:
+                return None
+            if resp.status != 200:
+                raise IOError(f"could not get delta for {path}: {resp.status}")
+            return await resp.read()
+
+    async def get_bundle(self, path):
+        url = f"https://{self.host}{path}/bundle"
+        async with self.session.get(url, ssl=self.ssl_context) as resp:
+            self.seen()
+            if resp.status != 200:
+                raise IOError(f"could not get bundle listing for {path}: {resp.status}")
+            return await resp.read()
+
+    async def get_have(self, root):
+        url = f"https://{self.host}{content_url(root)}/have"
+        async with self.session.get(url, ssl=self.ssl_context) as resp:
+            self.seen()
+            if resp.status == 404:
+                return None
+            if resp.status != 200:
+                raise IOError(f"could not ask about {root.hex()}: {resp.status}")
+            return await resp.read()
+
+    async def get_manifest(self, path):
+        url = f"https://{self.host}{path}/manifest"
+        async with self.session.get(url, ssl=self.ssl_context) as resp:
+            self.seen()
+            if resp.status != 200:
+                raise IOError(f"could not get manifest for {path}: {resp.status}")
+            return await resp.read()
 
 
 class TorConnection(BaseConnection):
+    transport = tor_transport
+    interval = 60
+
     def __init__(self, app, friend):
         super().__init__(app, friend)
         self.host = friend.onion
-        self.pause_time = 60
-
-    async def _connect(self):
-        try:
-            socks_port = await self.app.tor.socks_port()
-            conn = SocksConnector.from_url(
-                f"socks5://127.0.0.1:{socks_port}", rdns=True
-            )
-            async with aiohttp.ClientSession(connector=conn) as session:
-                self.session = session
-                await self.ping()
-        except Exception as e:
-            logger.exception(e)
-            raise e
 
     def __str__(self):
         return f"tor {self.host}"
 
 
 class DirectConnection(BaseConnection):
+    transport = direct_transport
+    interval = 5
+
     def __init__(self, app, friend):
         super().__init__(app, friend)
-        self.pause_time = 5
-        self.ping_task = None
-
-    async def _connect(self):
-        try:
-            logger.debug("trying direct connect")
-            if not self.friend.nearby:
-                logger.debug("no nearby, sleeping")
-                await asyncio.sleep(self.pause_time)
-                return
-            self.host = self.friend.nearby.direct_talk_ip_port
-            logger.debug("doing a direct connect to %s", self.host)
-            async with aiohttp.ClientSession() as session:
-                self.session = session
-                logger.debug("initiating ping for %s", self.host)
-                await self.ping()
-        except asyncio.CancelledError as e:
-            raise e
-        except Exception as e:
-            logger.exception(e)
-            raise e
+        self.host = None
+
+    async def probe(self, timeout):
+        # only friends seen on the local network are probed directly
+        nearby = self.friend.nearby
+        if not nearby:
+            self.active = False
+            return False
+        self.host = nearby.direct_talk_ip_port
+        return await super().probe(timeout)
 
     def __str__(self):
         return f"direct {self.friend.nearby}"
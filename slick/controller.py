@@ -0,0 +1,85 @@
+import time
+
+
+class TransferController:
+    def __init__(
+        self,
+        block_size,
+        *,
+        blocks=4,
+        concurrency=4,
+        max_blocks=256,
+        max_concurrency=32,
+        target_time=2.0,
+        congestion_factor=2.0,
+    ):
+        self.block_size = block_size
+        self.blocks = blocks
+        self.concurrency = concurrency
+        self.max_blocks = max_blocks
+        self.max_concurrency = max_concurrency
+        self.target_time = target_time
+        self.congestion_factor = congestion_factor
+        self.base_latency = None
+        self.latency = None
+        self.round_completions = 0
+        self.round_time = 0.0
+        self.transferred = 0
+        self.start_time = time.monotonic()
+        self.failures = 0
+
+    @property
+    def range_size(self):
+        return self.blocks * self.block_size
+
+    def record(self, size, elapsed):
+        self.transferred += size
+        # seconds per byte is comparable across range sizes, and its minimum
+        # approximates the uncongested path
+        latency = elapsed / max(size, 1)
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+
+        self.round_completions += 1
+        self.round_time = max(self.round_time, elapsed)
+        if self.round_completions < self.concurrency:
+            return
+
+        if self.latency > self.base_latency * self.congestion_factor:
+            self._decrease()
+        else:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            if self.round_time < self.target_time:
+                self.blocks = min(self.max_blocks, self.blocks + 1)
+        self._new_round()
+
+    def record_failure(self):
+        self.failures += 1
+        self._decrease()
+        self._new_round()
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.start_time
+        return self.transferred / elapsed if elapsed > 0 else 0
+
+    def stats(self):
+        return {
+            "range_size": self.range_size,
+            "concurrency": self.concurrency,
+            "throughput": self.throughput(),
+            "failures": self.failures,
+        }
+
+    def _decrease(self):
+        self.concurrency = max(1, self.concurrency // 2)
+        self.blocks = max(1, self.blocks // 2)
+        # forget the inflated samples so the next round is judged on its own
+        self.latency = None
+
+    def _new_round(self):
+        self.round_completions = 0
+        self.round_time = 0.0
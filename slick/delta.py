@@ -0,0 +1,167 @@
+import os
+import math
+import bisect
+import mmap
+import zlib
+import struct
+import hashlib
+from slick.bencode import DeltaSignature, Delta
+
+min_block_size = 4096
+max_block_size = 65536
+checksum_format = struct.Struct(">I16s")
+copy_format = struct.Struct(">QQQ")
+adler_mod = 65521
+# the rolling scan costs a Python step per unmatched byte, so it gives up
+# after this many and the file is fetched whole instead. This also bounds an
+# appended tail, which the scan could never match
+max_unmatched = 4 * max_block_size
+
+
+def block_size_for(size):
+    if size <= 0:
+        return min_block_size
+    # rsync's rule of thumb, rounded to a power of two
+    block_size = 2 ** round(math.log2(math.sqrt(size)))
+    return max(min_block_size, min(max_block_size, block_size))
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def signature(path, size):
+    block_size = block_size_for(size)
+    checksums = []
+    with open(path, "rb") as fh:
+        while True:
+            block = fh.read(block_size)
+            if len(block) < block_size:
+                break
+            checksums.append(
+                checksum_format.pack(zlib.adler32(block), strong_checksum(block))
+            )
+    return DeltaSignature.encode(
+        {"block_size": block_size, "checksums": b"".join(checksums)}
+    )
+
+
+def compute_delta(path, signature_data):
+    try:
+        sig = DeltaSignature.decode(signature_data)
+    except Exception as e:
+        raise ValueError(f"unreadable delta signature: {e!r}")
+    block_size = sig["block_size"]
+    # the signature comes from the peer, a block size it would never pick
+    # could make the scan below crawl or never end
+    if not min_block_size <= block_size <= max_block_size:
+        raise ValueError(f"delta block size {block_size} is out of range")
+    if len(sig["checksums"]) % checksum_format.size:
+        raise ValueError("delta checksums are not a whole number of records")
+    table = {}
+    for index, (weak, strong) in enumerate(
+        checksum_format.iter_unpack(sig["checksums"])
+    ):
+        table.setdefault(weak, []).append((strong, index))
+
+    size = os.path.getsize(path)
+    if size < block_size or not table:
+        return None
+
+    copies = []
+    with open(path, "rb") as fh, mmap.mmap(
+        fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        pos = 0
+        copied = 0
+        weak = None
+        while pos + block_size <= size:
+            if weak is None:
+                weak = zlib.adler32(data[pos : pos + block_size])
+            match = None
+            candidates = table.get(weak)
+            if candidates:
+                block_strong = strong_checksum(data[pos : pos + block_size])
+                for strong, index in candidates:
+                    if strong == block_strong:
+                        match = index
+                        break
+            if match is not None:
+                old_offset = match * block_size
+                last = copies[-1] if copies else None
+                if (
+                    last
+                    and last[0] + last[2] == pos
+                    and last[1] + last[2] == old_offset
+                ):
+                    last[2] += block_size
+                else:
+                    copies.append([pos, old_offset, block_size])
+                copied += block_size
+                pos += block_size
+                weak = None
+                continue
+
+            # unmatched bytes are the expensive case, so give up once most of
+            # the file would have to be sent anyway, or the budget is spent
+            if pos - copied > min(size // 2, max_unmatched):
+                return None
+            if pos + block_size >= size:
+                break
+            weak = roll(weak, data[pos], data[pos + block_size], block_size)
+            pos += 1
+
+    return Delta.encode(
+        {"copies": b"".join(copy_format.pack(*copy) for copy in copies)}
+    )
+
+
+def roll(weak, old, new, block_size):
+    a = weak & 0xFFFF
+    b = weak >> 16
+    a = (a - old + new) % adler_mod
+    b = (b - block_size * old + a - 1) % adler_mod
+    return (b << 16) | a
+
+
+def copies(delta_data):
+    return list(copy_format.iter_unpack(Delta.decode(delta_data)["copies"]))
+
+
+def covered_blocks(copies, chunk_size, size):
+    spans = []
+    for new_offset, _, length in copies:
+        if spans and spans[-1][1] == new_offset:
+            spans[-1][1] += length
+        else:
+            spans.append([new_offset, new_offset + length])
+
+    blocks = []
+    for start, end in spans:
+        index = math.ceil(start / chunk_size)
+        while index * chunk_size < size and min(size, (index + 1) * chunk_size) <= end:
+            blocks.append(index)
+            index += 1
+    return blocks
+
+
+class Patch:
+    def __init__(self, path, copies):
+        self.copies = copies
+        self.starts = [new_offset for new_offset, _, _ in copies]
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self, start, end):
+        parts = []
+        index = bisect.bisect_right(self.starts, start) - 1
+        pos = start
+        while pos < end:
+            new_offset, old_offset, length = self.copies[index]
+            count = min(end, new_offset + length) - pos
+            parts.append(os.pread(self.fd, count, old_offset + pos - new_offset))
+            pos += count
+            index += 1
+        return b"".join(parts)
+
+    def close(self):
+        os.close(self.fd)
@@ -218,6 +218,11 @@ class Discovery:
             if digest == n.digest:
                 return n
 
+    def wake(self, digest):
+        friend = self.app.friend_list.get_friend_for_digest(digest)
+        if friend:
+            self.app.health.wake(friend.direct_connection)
+
     async def process_service_state_change(
         self,
         zeroconf: Zeroconf,
@@ -252,11 +257,14 @@ class Discovery:
                     return
 
                 self.nearby.add(nearby)
+                self.wake(nearby.digest)
             else:
                 logger.warning("no properties for %s", name)
         elif state_change is ServiceStateChange.Removed:
             for i in range(len(self.nearby)):
                 if self.nearby[i].host == name:
+                    digest = self.nearby[i].digest
                     self.nearby.discard(self.nearby[i])
+                    self.wake(digest)
         else:
             logger.warning("strange state")
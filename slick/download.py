@@ -0,0 +1,830 @@
+import os
+import time
+import random
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from slick.controller import TransferController
+from slick.manifest import Manifest, chunk_hasher
+from slick.buffers import BufferPool, read_into
+from slick import delta
+from slick.writer import open_writer
+from slick.bundle import Bundle, BundleReader, bundle_type, open_bundle_writer
+from slick.swarm import content_url, swarm_interval
+from slick.client_pool import max_per_host
+from slick.logger import logger
+
+max_failures = 10
+# a path dropped for failing that often is tried again after this long, once
+# its connection has been heard from since
+revive_delay = 60.0
+verify_threads = 4
+# pieces of a block handed to the verifier that the reader may run ahead of
+hash_ahead = 4
+deadline_factor = 4.0
+min_deadline = 15.0
+max_deadline = 300.0
+retry_backoff = 0.5
+max_backoff = 30.0
+straggler_factor = 2.0
+min_speculate_age = 1.0
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Path:
+    def __init__(
+        self, connection, block_size, url, have=None, *, max_concurrency=max_per_host
+    ):
+        self.connection = connection
+        # workers beyond the pool's sockets per host would only queue for one
+        self.controller = TransferController(
+            block_size, max_concurrency=max_concurrency
+        )
+        self.url = url
+        # a bitmap of the blocks a swarm peer holds, None for the offerer
+        self.have = have
+        self.workers = {}
+        self.consecutive_failures = 0
+        self.alive = True
+        self.dropped_at = None
+
+    def __str__(self):
+        return str(self.connection)
+
+    def deadline(self, size):
+        # a range gets a few times what the path's recent latency predicts
+        # before it is abandoned, and the full allowance until one has landed
+        latency = self.controller.latency or self.controller.base_latency
+        if latency is None:
+            return max_deadline
+        return min(max_deadline, max(min_deadline, deadline_factor * latency * size))
+
+    def has(self, index):
+        if self.have is None:
+            return True
+        return bool(self.have[index // 8] & 1 << (index % 8))
+
+    def backoff(self):
+        delay = retry_backoff * 2 ** max(0, self.consecutive_failures - 1)
+        return min(max_backoff, delay) * random.uniform(0.5, 1.0)
+
+    def stats(self):
+        return {
+            "path": str(self),
+            "alive": self.alive,
+            "swarm": self.have is not None,
+            **self.controller.stats(),
+        }
+
+
+class Fetch:
+    def __init__(self, worker, blocks, *, speculative=False):
+        self.worker = worker
+        self.blocks = blocks
+        self.speculative = speculative
+        self.start_time = time.monotonic()
+        # when the request got its socket, time spent queued for one is not
+        # the path's latency
+        self.connected_at = None
+        self.task = None
+        self.superseded = False
+        self.contested = False
+
+    def age(self, now):
+        return now - self.start_time
+
+    def connected(self):
+        self.connected_at = time.monotonic()
+
+    def elapsed(self):
+        return time.monotonic() - (self.connected_at or self.start_time)
+
+
+class Worker:
+    def __init__(self, download, path):
+        self.download = download
+        self.path = path
+        self.connection = path.connection
+
+    async def run(self):
+        download = self.download
+        scheduler = download.scheduler
+        try:
+            while download.has_capacity(self):
+                if not download.pending and not await download.wait_for_straggler():
+                    break
+                # the slot is taken before the blocks so that a worker queued
+                # behind other transfers does not sit on ranges another path
+                # could be fetching
+                await scheduler.acquire(download, self.path.controller.range_size)
+                try:
+                    fetch = download.take_fetch(self)
+                    if not fetch:
+                        # a swarm peer with none of the pending blocks retires
+                        # until discovery finds it holding more
+                        if self.path.have is not None:
+                            break
+                        continue
+                    ok = await self.fetch(fetch)
+                finally:
+                    scheduler.release()
+                if not ok:
+                    if not self.path.alive:
+                        break
+                    await asyncio.sleep(self.path.backoff())
+        finally:
+            download.worker_done(self)
+
+    async def fetch(self, fetch):
+        download = self.download
+        journal = download.journal
+        blocks = fetch.blocks
+        byte_range = (
+            journal.byte_range(blocks[0])[0],
+            journal.byte_range(blocks[-1])[1],
+        )
+        size = byte_range[1] - byte_range[0]
+        logger.debug(f"worker getting byte range {byte_range} for {blocks}")
+        fetch.task = asyncio.ensure_future(self.receive(fetch, byte_range))
+        try:
+            good, bad = await asyncio.wait_for(fetch.task, self.path.deadline(size))
+        except asyncio.CancelledError:
+            if fetch.superseded and not download.closing:
+                logger.debug(f"byte range {byte_range} arrived first elsewhere")
+                return True
+            download.abandon(fetch, blocks)
+            raise
+        except Exception as e:
+            logger.debug(f"{self.path} failed on byte range {byte_range}: {e!r}")
+            await download.fail(fetch, blocks, e)
+            return False
+        finally:
+            download.fetch_done(fetch)
+        logger.debug(f"worker done writing byte range {byte_range} for {blocks}")
+        try:
+            bad = await download.complete(fetch, good, bad, size)
+        except Exception as e:
+            # the range arrived but could not be recorded, such as when the
+            # disk filled up, which no other path can do better at
+            logger.debug(f"could not record byte range {byte_range}: {e!r}")
+            download.abort(e)
+            return False
+        if bad:
+            await download.fail(fetch, bad, IOError(f"{self.path} sent corrupt blocks"))
+            return False
+        return True
+
+    async def receive(self, fetch, byte_range):
+        async with self.connection.open_file(
+            self.path.url, range=byte_range, connected=fetch.connected
+        ) as content:
+            return await self.download.receive(fetch.blocks, content)
+
+
+class BlockCheck:
+    def __init__(self, download, index):
+        self.manifest = download.manifest
+        self.index = index
+        self.hasher = chunk_hasher()
+        self.chunk = download.friend.app.chunk_store.open(self.manifest.leaves[index])
+
+    def update(self, data):
+        self.hasher.update(data)
+        if self.chunk:
+            self.chunk.write(data)
+
+    def finish(self):
+        ok = self.manifest.check(self.index, self.hasher.digest())
+        if self.chunk:
+            if ok:
+                self.chunk.commit()
+            else:
+                self.chunk.abort()
+        return ok
+
+    def abort(self):
+        if self.chunk:
+            self.chunk.abort()
+
+
+class Download:
+    def __init__(self, friend, journal, basis=None):
+        self.friend = friend
+        self.journal = journal
+        self.basis = basis
+        self.scheduler = friend.app.scheduler
+        self.priority = 0
+        self.paths = {}
+        self.manifest = None
+        self.bundle = None
+        self.verifier = None
+        self.corrupt = 0
+        self.reused = 0
+        self.patched = 0
+        self.pending = []
+        self.writer = None
+        self.pool = BufferPool()
+        self.bar = None
+        self.finished = None
+        self.closing = False
+        self.error = None
+        self.fetches = set()
+        self.progress = asyncio.Event()
+        self.latencies = []
+        self.retries = 0
+        self.speculated = 0
+        self.speculation_wins = 0
+        self.transferred = 0
+        self.swarmed = 0
+        self.discovery = None
+        self.start_time = time.monotonic()
+
+    @property
+    def name(self):
+        return self.journal.name
+
+    async def run(self):
+        self.start_time = time.monotonic()
+        journal = self.journal
+        create = not os.path.exists(journal.target)
+        if create:
+            journal.reset()
+
+        if journal.type == bundle_type:
+            self.bundle = await self.fetch_bundle()
+
+        if journal.root:
+            self.manifest = await self.fetch_manifest()
+            self.verifier = ThreadPoolExecutor(max_workers=verify_threads)
+            # verified chunks land in the chunk store, so other friends can
+            # fetch them from here while the download is still running
+            await self.friend.app.swarm.hold(self.manifest, journal.size)
+
+        self.pending = journal.missing()
+        self.finished = asyncio.Future()
+        with tqdm(
+            total=journal.size,
+            initial=journal.completed_bytes(),
+            unit="B",
+            unit_scale=True,
+        ) as bar:
+            self.bar = bar
+            if self.bundle:
+                # a bundle unpacks into its files as it streams in
+                self.writer = await open_bundle_writer(
+                    journal.target, self.bundle, create
+                )
+            else:
+                self.writer = await open_writer(
+                    self.friend.app.writer, journal.target, journal.size, create
+                )
+            try:
+                await journal.flush()
+                if self.manifest:
+                    await self.fill_from_store()
+                    self.pending = journal.missing()
+                if self.basis and self.pending:
+                    await self.apply_delta()
+                    self.pending = journal.missing()
+                self.spawn()
+                if self.pending:
+                    if self.manifest:
+                        self.discovery = asyncio.ensure_future(self.discover_peers())
+                    await self.finished
+            finally:
+                self.closing = True
+                if self.discovery:
+                    self.discovery.cancel()
+                for path in self.paths.values():
+                    for task in list(path.workers.values()):
+                        task.cancel()
+                if self.verifier:
+                    self.verifier.shutdown(wait=False)
+                await self.writer.close()
+                # the writer synced on close, so whatever completed since
+                # the last checkpoint can be recorded now
+                if not journal.done():
+                    await journal.flush()
+
+        if self.bundle:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.bundle.apply_modes, journal.target)
+        logger.debug(f"download of {journal.target} finished with {self.stats()}")
+        journal.remove()
+        return True
+
+    async def fetch_bundle(self):
+        error = None
+        for connection in self.friend.active_connections():
+            try:
+                bundle = Bundle.decode(await connection.get_bundle(self.journal.url))
+            except Exception as e:
+                logger.debug(f"could not get the bundle listing over {connection}: {e}")
+                error = e
+                continue
+            if bundle.size != self.journal.size:
+                raise IOError(
+                    f"bundle listing for {self.name} does not match its offer"
+                )
+            return bundle
+        raise error or IOError(f"no path to fetch the bundle listing for {self.name}")
+
+    async def fetch_manifest(self):
+        error = None
+        for connection in self.friend.active_connections():
+            try:
+                data = await connection.get_manifest(self.journal.url)
+                manifest = Manifest.decode(self.journal.chunk_size, data)
+            except Exception as e:
+                logger.debug(f"could not get manifest over {connection}: {e}")
+                error = e
+                continue
+            if manifest.root != self.journal.root:
+                raise IOError(f"manifest for {self.name} does not match its offer")
+            if len(manifest.leaves) != self.journal.chunk_count:
+                raise IOError(f"manifest for {self.name} has the wrong chunk count")
+            return manifest
+        raise error or IOError(f"no path to fetch the manifest for {self.name}")
+
+    async def fill_from_store(self):
+        store = self.friend.app.chunk_store
+        leaves = self.manifest.leaves
+        loop = asyncio.get_event_loop()
+        held = await loop.run_in_executor(
+            self.verifier,
+            lambda: [i for i in self.journal.missing() if store.has(leaves[i])],
+        )
+        for index in held:
+            data = await loop.run_in_executor(self.verifier, store.get, leaves[index])
+            if data is None:
+                continue
+            await self.writer.write(data, offset=self.journal.byte_range(index)[0])
+            self.journal.complete(index)
+            self.reused += len(data)
+            self.bar.update(len(data))
+        if held:
+            logger.debug(f"reused {self.reused} bytes of {self.name} from the store")
+            await self.journal.flush(self.writer)
+
+    async def apply_delta(self):
+        journal = self.journal
+        loop = asyncio.get_event_loop()
+        try:
+            signature = await loop.run_in_executor(
+                None, delta.signature, self.basis, os.path.getsize(self.basis)
+            )
+        except OSError as e:
+            logger.debug(f"cannot use {self.basis} as a delta basis: {e}")
+            return
+
+        result = None
+        for connection in self.friend.active_connections():
+            try:
+                result = await connection.get_delta(journal.url, signature)
+                break
+            except Exception as e:
+                logger.debug(f"could not get a delta over {connection}: {e}")
+        if not result:
+            return
+
+        copies = delta.copies(result)
+        pending = set(self.pending)
+        blocks = [
+            i
+            for i in delta.covered_blocks(copies, journal.chunk_size, journal.size)
+            if i in pending
+        ]
+        patch = delta.Patch(self.basis, copies)
+        try:
+            for index in blocks:
+                data = await loop.run_in_executor(
+                    self.verifier, self.read_patched, patch, index
+                )
+                if data is None:
+                    continue
+                await self.writer.write(data, offset=journal.byte_range(index)[0])
+                journal.complete(index)
+                self.patched += len(data)
+                self.bar.update(len(data))
+        finally:
+            patch.close()
+        logger.debug(f"patched {self.patched} bytes of {self.name} from {self.basis}")
+        await journal.flush(self.writer)
+
+    def read_patched(self, patch, index):
+        start, end = self.journal.byte_range(index)
+        data = patch.read(start, end)
+        if len(data) != end - start:
+            return None
+        if self.manifest and not self.check_block(index, data):
+            return None
+        return data
+
+    def refresh_paths(self):
+        for connection in self.friend.active_connections():
+            path = self.paths.get(connection)
+            if not path:
+                logger.debug(f"striping {self.name} over {connection}")
+                self.paths[connection] = self.new_path(connection, self.journal.url)
+            elif not path.alive and self.revivable(path):
+                logger.debug(f"{connection} is back, resuming it for {self.name}")
+                path.alive = True
+                path.consecutive_failures = 0
+
+    def new_path(self, connection, url, have=None):
+        pool = self.friend.app.client_pool
+        return Path(
+            connection,
+            self.journal.chunk_size,
+            url,
+            have,
+            max_concurrency=pool.limit_per_host,
+        )
+
+    def revivable(self, path):
+        if path.consecutive_failures < max_failures:
+            return True
+        return (
+            time.monotonic() - path.dropped_at >= revive_delay
+            and path.connection.last_seen > path.dropped_at
+        )
+
+    def spawn(self):
+        # every path pulls ranges from the same pending list, so each one ends
+        # up carrying work in proportion to the throughput it sustains
+        self.refresh_paths()
+        loop = asyncio.get_event_loop()
+        for path in self.paths.values():
+            while (
+                path.alive
+                and self.available(path)
+                and len(path.workers) < path.controller.concurrency
+            ):
+                worker = Worker(self, path)
+                path.workers[worker] = loop.create_task(worker.run())
+
+    def available(self, path):
+        return any(path.has(index) for index in self.pending)
+
+    async def discover_peers(self):
+        # other friends who were offered the same content may already hold
+        # some of its chunks, and are asked for them by its manifest root
+        root = self.manifest.root
+        url = content_url(root)
+        chunk_count = len(self.manifest.leaves)
+        while True:
+            for friend in self.friend.app.friend_list.friends():
+                if friend is self.friend:
+                    continue
+                for connection in friend.active_connections():
+                    try:
+                        have = await connection.get_have(root)
+                    except Exception as e:
+                        logger.debug(
+                            f"could not ask {connection} for {root.hex()}: {e}"
+                        )
+                        continue
+                    if have and len(have) * 8 < chunk_count:
+                        continue
+                    path = self.paths.get(connection)
+                    if path:
+                        path.have = have or bytes(len(path.have))
+                    elif have:
+                        logger.debug(f"swarming {self.name} over {connection}")
+                        self.paths[connection] = self.new_path(connection, url, have)
+            self.spawn()
+            await asyncio.sleep(swarm_interval)
+
+    def has_capacity(self, worker):
+        path = worker.path
+        # workers beyond the controller's current concurrency retire after
+        # their in-flight range
+        if not path.alive or len(path.workers) > path.controller.concurrency:
+            path.workers.pop(worker, None)
+            return False
+        return True
+
+    def take_fetch(self, worker):
+        if self.pending:
+            blocks = self.take_range(worker.path)
+            if not blocks:
+                return None
+            fetch = Fetch(worker, blocks)
+        else:
+            straggler = self.straggler(worker.path)
+            if not straggler:
+                return None
+            logger.debug(f"racing {straggler.blocks} of {self.name} over {worker.path}")
+            fetch = Fetch(worker, straggler.blocks, speculative=True)
+            self.speculated += 1
+        self.fetches.add(fetch)
+        return fetch
+
+    def fetch_done(self, fetch):
+        self.fetches.discard(fetch)
+        self.signal()
+
+    def signal(self):
+        self.progress.set()
+        self.progress = asyncio.Event()
+
+    def rivals(self, fetch):
+        return [
+            other
+            for other in self.fetches
+            if other is not fetch
+            and not other.superseded
+            and other.blocks == fetch.blocks
+        ]
+
+    def candidates(self):
+        # only verified downloads race ranges, since the loser may have
+        # written over the winner and the blocks are checked on disk after
+        if not self.manifest:
+            return []
+        # a fetch that lost its race may linger here for a moment after the
+        # winner has recorded its blocks, and is not worth racing again
+        return [
+            fetch
+            for fetch in self.fetches
+            if not fetch.speculative
+            and not fetch.superseded
+            and not self.rivals(fetch)
+            and not all(self.journal.is_complete(i) for i in fetch.blocks)
+        ]
+
+    def speculate_after(self):
+        return max(
+            min_speculate_age, straggler_factor * percentile(self.latencies, 0.5)
+        )
+
+    def straggler(self, path):
+        now = time.monotonic()
+        threshold = self.speculate_after()
+        stragglers = [
+            f
+            for f in self.candidates()
+            if f.age(now) >= threshold and all(path.has(i) for i in f.blocks)
+        ]
+        if not stragglers:
+            return None
+        # another path is the better bet against a stuck one, the oldest
+        # range the most likely to hold up the end of the download
+        return min(stragglers, key=lambda f: (f.worker.path is path, f.start_time))
+
+    async def wait_for_straggler(self):
+        while not self.pending:
+            candidates = self.candidates()
+            if not candidates:
+                return False
+            oldest = min(fetch.start_time for fetch in candidates)
+            delay = oldest + self.speculate_after() - time.monotonic()
+            if delay <= 0:
+                return True
+            try:
+                await asyncio.wait_for(self.progress.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    def take_range(self, path):
+        pending = self.pending
+        position = next((i for i, index in enumerate(pending) if path.has(index)), None)
+        if position is None:
+            return []
+        blocks = [pending.pop(position)]
+        while (
+            position < len(pending)
+            and len(blocks) < path.controller.blocks
+            and pending[position] == blocks[-1] + 1
+            and path.has(pending[position])
+        ):
+            blocks.append(pending.pop(position))
+        return blocks
+
+    async def receive(self, blocks, content):
+        # the range is read in pool sized pieces that go to disk as they
+        # arrive and each block is hashed incrementally, so memory stays
+        # bounded by the pool whatever the chunk size
+        loop = asyncio.get_event_loop()
+        good, bad = [], []
+        for index in blocks:
+            start, end = self.journal.byte_range(index)
+            check = await self.open_check(index)
+            # a block's pieces are hashed in order off the loop while the
+            # next ones are read, with at most hash_ahead of them waiting
+            hashing = []
+            try:
+                for offset in range(start, end, self.pool.size):
+                    buffer = await self.acquire_buffer()
+                    view = memoryview(buffer)[: min(self.pool.size, end - offset)]
+                    release = partial(self.pool.release, buffer)
+                    try:
+                        await read_into(content, view)
+                    except BaseException:
+                        release()
+                        raise
+                    if check:
+                        previous = hashing[-1] if hashing else None
+                        hashed = asyncio.ensure_future(
+                            self.hash_piece(check, view, previous)
+                        )
+                        hashing.append(hashed)
+                        # the buffer goes back once it is both hashed and
+                        # written
+                        release = partial(self.release_after, hashed, release)
+                    await self.writer.write(view, offset, release=release)
+                    if len(hashing) > hash_ahead:
+                        await hashing.pop(0)
+                if hashing:
+                    await hashing[-1]
+            except BaseException:
+                if hashing:
+                    await asyncio.wait(hashing)
+                if check:
+                    await loop.run_in_executor(self.verifier, check.abort)
+                raise
+            if not check or await loop.run_in_executor(self.verifier, check.finish):
+                good.append(index)
+            else:
+                bad.append(index)
+        if bad:
+            logger.warning(f"blocks {bad} of {self.name} failed verification")
+            self.corrupt += len(bad)
+        return good, bad
+
+    async def hash_piece(self, check, view, previous):
+        if previous:
+            await previous
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.verifier, check.update, view)
+
+    def release_after(self, hashed, release):
+        if hashed.done():
+            release()
+        else:
+            hashed.add_done_callback(lambda _: release())
+
+    async def open_check(self, index):
+        if not self.manifest:
+            return None
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.verifier, BlockCheck, self, index)
+
+    async def acquire_buffer(self):
+        # buffers parked in the writer's coalescing runs only come back once
+        # they are written, so an empty pool pushes those runs out first
+        if self.pool.exhausted():
+            await self.writer.flush()
+        return await self.pool.acquire()
+
+    def check_block(self, index, data):
+        if not self.manifest.verify(index, data):
+            return False
+        self.friend.app.chunk_store.put(self.manifest.leaves[index], data)
+        return True
+
+    def release(self, blocks):
+        blocks = [i for i in blocks if not self.journal.is_complete(i)]
+        self.pending = sorted(self.pending + blocks)
+        self.signal()
+
+    def abandon(self, fetch, blocks):
+        rivals = self.rivals(fetch)
+        if rivals:
+            # the rival carries on with these blocks but has to check them
+            # on disk, since this fetch may have written over them
+            for rival in rivals:
+                rival.contested = True
+        else:
+            self.release(blocks)
+
+    async def complete(self, fetch, good, bad, size):
+        path = fetch.worker.path
+        elapsed = fetch.elapsed()
+        rivals = self.rivals(fetch)
+        for rival in rivals:
+            rival.superseded = True
+            rival.task.cancel()
+        if rivals:
+            await asyncio.wait([rival.task for rival in rivals])
+            if fetch.speculative:
+                self.speculation_wins += 1
+        if good and (rivals or fetch.contested):
+            good, overwritten = await self.recheck(good)
+            bad = bad + overwritten
+
+        path.consecutive_failures = 0
+        path.controller.record(size, elapsed)
+        self.latencies.append(elapsed)
+        self.transferred += size
+        if path.have is not None:
+            self.swarmed += size
+        stored = 0
+        for index in good:
+            if self.journal.is_complete(index):
+                continue
+            start, end = self.journal.byte_range(index)
+            stored += end - start
+            self.journal.complete(index)
+        # ranges are only recorded in batches, so the writer can keep
+        # coalescing instead of being synced after every range
+        await self.journal.checkpoint(self.writer)
+        self.bar.update(stored)
+        self.spawn()
+        return bad
+
+    async def recheck(self, blocks):
+        await self.writer.flush()
+        loop = asyncio.get_event_loop()
+        results = await loop.run_in_executor(self.verifier, self.verify_on_disk, blocks)
+        good = [index for index, ok in zip(blocks, results) if ok]
+        bad = [index for index, ok in zip(blocks, results) if not ok]
+        if bad:
+            logger.warning(f"blocks {bad} of {self.name} were overwritten by a rival")
+        return good, bad
+
+    def verify_on_disk(self, blocks):
+        if self.bundle:
+            fh = BundleReader(self.journal.target, self.bundle)
+        else:
+            fh = open(self.journal.target, "rb")
+        results = []
+        try:
+            for index in blocks:
+                start, end = self.journal.byte_range(index)
+                fh.seek(start)
+                results.append(self.manifest.verify(index, fh.read(end - start)))
+        finally:
+            fh.close()
+        return results
+
+    async def fail(self, fetch, blocks, error):
+        path = fetch.worker.path
+        # whatever was streamed for these blocks has to be on disk before they
+        # are fetched again, or a stale run could land over the good data
+        try:
+            await self.writer.flush()
+        except OSError as e:
+            self.abort(e)
+        self.abandon(fetch, blocks)
+        self.retries += 1
+        path.controller.record_failure()
+        path.consecutive_failures += 1
+        if path.consecutive_failures >= max_failures or not path.connection.active:
+            logger.debug(f"dropping {path} from {self.name}")
+            path.alive = False
+            path.dropped_at = time.monotonic()
+            self.error = error
+
+    def abort(self, error):
+        if not self.finished.done():
+            self.finished.set_exception(error)
+
+    def worker_done(self, worker):
+        worker.path.workers.pop(worker, None)
+        if self.closing or self.finished.done():
+            return
+        if not self.pending and not self.active_workers():
+            self.finished.set_result(True)
+            return
+        self.spawn()
+        if not self.active_workers():
+            self.finished.set_exception(
+                self.error or IOError(f"no path left to {self.friend}")
+            )
+
+    def active_workers(self):
+        return sum(len(path.workers) for path in self.paths.values())
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.start_time
+        return self.transferred / elapsed if elapsed > 0 else 0
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "size": self.journal.size,
+            "completed": self.journal.completed_bytes(),
+            "throughput": self.throughput(),
+            "corrupt": self.corrupt,
+            "reused": self.reused,
+            "patched": self.patched,
+            "swarmed": self.swarmed,
+            "latency": {
+                "p50": percentile(self.latencies, 0.5),
+                "p99": percentile(self.latencies, 0.99),
+            },
+            "retries": self.retries,
+            "speculated": self.speculated,
+            "speculation_wins": self.speculation_wins,
+            "buffers": self.pool.stats(),
+            "paths": [path.stats() for path in self.paths.values()],
+        }
@@ -1,44 +1,14 @@
 import os
 import json
-import math
 import asyncio
 import hashlib
-import aiofiles
 import base64
-from tqdm import tqdm
 from datetime import datetime
-from aiofile import AIOFile
 from slick.connection import TorConnection, DirectConnection
+from slick.download import Download
+from slick.channel import Channel, text_type, file_type
 from slick.logger import logger
 
-file_chunk_size = 1_048_576
-concurrency = 10
-
-
-class Worker:
-    def __init__(self, queue, fh, connection, size, path, bar):
-        self.queue = queue
-        self.fh = fh
-        self.connection = connection
-        self.size = size
-        self.path = path
-        self.bar = bar
-
-    async def run(self):
-        while self.queue.qsize() != 0:
-            index = self.queue.get_nowait()
-            logger.debug(f"worker got index {index} for {self.fh}")
-            byte_range = (
-                index * file_chunk_size,
-                min(self.size, (index + 1) * file_chunk_size),
-            )
-            logger.debug(f"worker getting byte range {byte_range} for {index}")
-            content = await self.connection.get_file(self.path, range=byte_range)
-            await self.fh.write(content, offset=byte_range[0])
-            logger.debug(f"worker done writing byte range {byte_range} for {index}")
-            self.queue.task_done()
-            self.bar.update(byte_range[1] - byte_range[0])
-
 
 class Friend:
     @classmethod
@@ -60,12 +30,12 @@ class Friend:
         self.public_key = public_key
         self.direct_connection = DirectConnection(self.app, self)
         self.tor_connection = TorConnection(self.app, self)
+        self.channel = Channel(self)
         m = hashlib.sha256()
         m.update(self.cert.encode())
         self.digest = m.digest()
-        loop = asyncio.get_event_loop()
-        self.tor_connect_task = loop.create_task(self.tor_connection.connect())
-        self.direct_connect_task = loop.create_task(self.direct_connection.connect())
+        self.app.health.watch(self.tor_connection)
+        self.app.health.watch(self.direct_connection)
 
     def write(self, fh):
         data = {
@@ -91,46 +61,53 @@ class Friend:
         else:
             return self.tor_connection
 
+    def active_connections(self):
+        return [c for c in (self.direct_connection, self.tor_connection) if c.active]
+
     @property
     def nearby(self):
         return self.app.discovery.nearby_for_digest(self.digest)
 
+    async def open(self):
+        # connections are only kept up for friends someone is talking to or
+        # transferring with, the rest just have their presence checked
+        health = self.app.health
+        pending = {
+            asyncio.ensure_future(health.open(connection))
+            for connection in (self.direct_connection, self.tor_connection)
+        }
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            if any(task.result() for task in done):
+                break
+        return self.active()
+
     async def send(self, message):
-        connection = self.connection()
-        if not connection or not connection.active:
-            logger.debug(f"can't send {connection}")
-            return False
-        else:
-            return await connection.send(message)
+        return await self.deliver(text_type, message.encode())
 
     async def offer_file(self, path):
+        await self.open()
         connection = self.connection()
         if not connection or not connection.active:
             return False
-        else:
-            return await connection.offer_file(path)
+        data = await connection.offer_data(path)
+        return await self.deliver(file_type, data)
 
-    async def get_file(self, *, path, size, target):
-        connection = self.connection()
-        if not connection or not connection.active:
-            logger.debug(f"cannot get connection {connection}")
+    async def deliver(self, content_type, data):
+        await self.open()
+        if not self.active():
+            logger.debug(f"can't reach {self}")
             return False
-        else:
-            loop = asyncio.get_event_loop()
-            queue = asyncio.Queue()
-            chunk_count = math.ceil(size / file_chunk_size)
+        async with self.app.scheduler.interactive():
+            return await self.channel.send(content_type, data)
 
-            for i in range(chunk_count):
-                await queue.put(i)
-
-            async with aiofiles.open(target, "wb") as fh:
-                await fh.truncate(size)
-
-            with tqdm(total=size, unit="B", unit_scale=True) as bar:
-                async with AIOFile(target, "wb") as fh:
-                    for i in range(concurrency):
-                        worker = Worker(queue, fh, connection, size, path, bar)
-                        loop.create_task(worker.run())
-
-                    await queue.join()
-                    await fh.fsync()
+    async def get_file(self, *, journal, basis=None, priority=0):
+        if not await self.open():
+            logger.debug(f"cannot get connection for {self}")
+            return False
+        else:
+            download = Download(self, journal, basis)
+            await self.app.scheduler.run(download, priority)
+            return download
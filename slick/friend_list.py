@@ -1,4 +1,5 @@
 import os
+import asyncio
 from os.path import expanduser
 from slick.friend import Friend
 from slick.logger import logger
@@ -9,6 +10,7 @@ class FriendList:
         self.app = app
         self.friend_dir = os.path.join(self.app.base, "friends")
         self._friends = []
+        self.loaded_result = asyncio.Future()
 
     async def start(self):
         os.makedirs(self.friend_dir, exist_ok=True)
@@ -17,6 +19,11 @@ class FriendList:
             with open(os.path.join(self.friend_dir, f), "r") as fh:
                 friend = Friend.read(self.app, fh)
                 self._friends.append(friend)
+        self.loaded_result.set_result(True)
+
+    async def loaded(self):
+        await self.loaded_result
+        return self.loaded_result.result()
 
     def has_digest(self, digest):
         for f in self._friends:
@@ -45,6 +52,9 @@ class FriendList:
     async def remove(self, friend):
         self._friends.remove(friend)
         os.remove(self.friend_path(friend))
+        self.app.certificate.forget(friend)
+        for connection in (friend.tor_connection, friend.direct_connection):
+            connection.running = False
 
     def friend_path(self, friend):
         return os.path.join(self.friend_dir, f"{friend.name}-{friend.digest.hex()}")
@@ -53,4 +63,8 @@ class FriendList:
         for f in self._friends:
             if f.onion == onion:
                 return f
-        raise Exception(f"could not find friend for {onion}")
+
+    def get_friend_for_digest(self, digest):
+        for f in self._friends:
+            if f.digest == digest:
+                return f
@@ -0,0 +1,188 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from slick.logger import logger
+
+max_probes = 16
+probe_timeout = 60
+# a caller waiting on a connection gives up after this long and goes on with
+# whatever the connection's state is then, the probe carries on regardless
+open_timeout = 15
+# probes of a failing connection back off up to this many times its interval
+max_backoff = 16
+max_delay = 3600
+jitter = 0.2
+# connections are first probed spread over this many seconds, so a large
+# friend list does not probe all at once on startup
+startup_spread = 30
+# friends nobody is talking to are only probed for presence, this often
+presence_interval = 300
+# a connection opened for a conversation or transfer goes back to presence
+# probes after this long without traffic
+idle_timeout = 300
+
+
+class HealthChecker:
+    def __init__(self, app, *, probes=max_probes, idle=idle_timeout):
+        self.app = app
+        self.idle = idle
+        self.connections = set()
+        self.heap = []
+        self.due = {}
+        self.counter = itertools.count()
+        self.slots = asyncio.Semaphore(probes)
+        self.changed = asyncio.Event()
+        self.checks = set()
+        self.busy = set()
+        self.waiters = {}
+        self.probed = {}
+        self.task = None
+        self.probes = 0
+        self.skipped = 0
+        self.failures = 0
+
+    @property
+    def _name(self):
+        return "health"
+
+    async def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        for check in list(self.checks):
+            check.cancel()
+        for connection in list(self.waiters):
+            self.resolve(connection)
+
+    def watch(self, connection):
+        self.connections.add(connection)
+        self.schedule(connection, random.uniform(0, startup_spread))
+
+    def wake(self, connection):
+        # something changed for the connection, such as its friend showing
+        # up on the local network, so it is probed now
+        connection.failures = 0
+        if connection not in self.busy:
+            self.schedule(connection, 0)
+
+    async def open(self, connection):
+        connection.last_used = time.monotonic()
+        was_in_use, connection.in_use = connection.in_use, True
+        if connection.active:
+            if not was_in_use:
+                self.schedule(connection, self.jittered(connection.interval))
+            return True
+        # nothing would ever probe the connection, so there is no point waiting
+        if not self.task or not connection.running:
+            return False
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.setdefault(connection, []).append(waiter)
+        self.wake(connection)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), open_timeout)
+        except asyncio.TimeoutError:
+            waiters = self.waiters.get(connection, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            return connection.active
+
+    def resolve(self, connection):
+        for waiter in self.waiters.pop(connection, []):
+            if not waiter.done():
+                waiter.set_result(connection.active)
+
+    def schedule(self, connection, delay):
+        due = time.monotonic() + delay
+        self.due[connection] = due
+        heapq.heappush(self.heap, (due, next(self.counter), connection))
+        self.changed.set()
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                due, _, connection = heapq.heappop(self.heap)
+                # a connection rescheduled since this entry was pushed is
+                # left to its newer entry
+                if self.due.get(connection) != due:
+                    continue
+                del self.due[connection]
+                check = asyncio.ensure_future(self.check(connection))
+                self.checks.add(check)
+                check.add_done_callback(self.checks.discard)
+            self.changed.clear()
+            delay = self.heap[0][0] - now if self.heap else None
+            try:
+                await asyncio.wait_for(self.changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def check(self, connection):
+        self.busy.add(connection)
+        try:
+            await self._check(connection)
+        finally:
+            self.busy.discard(connection)
+            self.resolve(connection)
+
+    async def _check(self, connection):
+        if not connection.running:
+            self.forget(connection)
+            return
+        if connection.in_use and time.monotonic() - connection.last_used > self.idle:
+            logger.debug(f"{connection} is idle, only checking presence")
+            connection.in_use = False
+        # traffic since the last probe already shows the connection is up
+        idle = time.monotonic() - connection.last_seen
+        traffic = connection.last_seen > self.probed.get(connection, 0)
+        interval = self.interval(connection)
+        if connection.active and traffic and idle < interval:
+            self.skipped += 1
+            self.schedule(connection, self.jittered(interval - idle))
+            return
+        async with self.slots:
+            ok = await connection.probe(probe_timeout)
+        self.probes += 1
+        self.probed[connection] = time.monotonic()
+        if ok:
+            connection.failures = 0
+        else:
+            self.failures += 1
+            connection.failures += 1
+        logger.debug(f"probed {connection}: {'up' if ok else 'down'}")
+        if connection.running:
+            self.schedule(connection, self.next_delay(connection))
+        else:
+            self.forget(connection)
+
+    def forget(self, connection):
+        self.connections.discard(connection)
+        self.probed.pop(connection, None)
+        self.resolve(connection)
+
+    def interval(self, connection):
+        if connection.in_use:
+            return connection.interval
+        return max(connection.interval, presence_interval)
+
+    def next_delay(self, connection):
+        backoff = min(max_backoff, 2 ** connection.failures)
+        return self.jittered(min(self.interval(connection) * backoff, max_delay))
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
+    def stats(self):
+        return {
+            "watched": len(self.connections),
+            "in_use": sum(1 for c in self.connections if c.in_use),
+            "probing": len(self.busy),
+            "probes": self.probes,
+            "skipped": self.skipped,
+            "failures": self.failures,
+        }
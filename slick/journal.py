@@ -0,0 +1,188 @@
+import os
+import glob
+import json
+import math
+import time
+import base64
+import asyncio
+import aiofiles
+from slick.logger import logger
+
+journal_suffix = ".slick-journal"
+# completed chunks are recorded in batches, whichever of these comes first
+flush_interval = 1.0
+flush_bytes = 64 * 1024 ** 2
+
+
+class Journal:
+    @classmethod
+    def path_for(cls, target):
+        return f"{target}{journal_suffix}"
+
+    @classmethod
+    def load(cls, target):
+        path = cls.path_for(target)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r") as fh:
+                data = json.load(fh)
+            return Journal(
+                target,
+                url=data["url"],
+                size=data["size"],
+                type=data["type"],
+                name=data["name"],
+                friend=bytes.fromhex(data["friend"]),
+                chunk_size=data["chunk_size"],
+                root=bytes.fromhex(data.get("root", "")),
+                completed=bytearray(base64.b64decode(data["completed"])),
+            )
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug("ignoring unreadable journal %s: %s", path, e)
+            return None
+
+    @classmethod
+    def pick_target(cls, name, resumes=None):
+        # the first free name in the current directory, or one whose journal
+        # resumes can pick up, skipping anything in the way, a directory or
+        # another download's leftover journal included
+        base = os.path.basename(name)
+        target = base
+        x = 0
+        while os.path.exists(target) or os.path.isfile(cls.path_for(target)):
+            existing = cls.load(target)
+            if existing and resumes and resumes(existing):
+                return target, existing
+            x = x + 1
+            target = f"{base}.{x}"
+        return target, None
+
+    @classmethod
+    def scan(cls, directory):
+        for path in glob.glob(
+            os.path.join(glob.escape(directory), f"*{journal_suffix}")
+        ):
+            journal = cls.load(path[: -len(journal_suffix)])
+            if journal:
+                yield journal
+
+    def __init__(
+        self,
+        target,
+        *,
+        url,
+        size,
+        type,
+        name,
+        friend,
+        chunk_size,
+        root=b"",
+        completed=None,
+    ):
+        self.target = target
+        self.url = url
+        self.size = size
+        self.type = type
+        self.name = name
+        self.friend = friend
+        self.chunk_size = chunk_size
+        self.root = root
+        self.chunk_count = math.ceil(size / chunk_size)
+        self.version = 0
+        if completed is None:
+            self.completed = bytearray(math.ceil(self.chunk_count / 8))
+            self.flushed_version = -1
+        else:
+            self.completed = completed
+            self.flushed_version = 0
+        self.flushed_at = time.monotonic()
+        self.flushes = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def path(self):
+        return self.path_for(self.target)
+
+    def matches(self, *, url, size, type, root=b""):
+        return (
+            self.url == url
+            and self.size == size
+            and self.type == type
+            and self.root == root
+        )
+
+    def byte_range(self, index):
+        return (index * self.chunk_size, min(self.size, (index + 1) * self.chunk_size))
+
+    def is_complete(self, index):
+        return bool(self.completed[index // 8] & (1 << (index % 8)))
+
+    def complete(self, index):
+        self.completed[index // 8] |= 1 << (index % 8)
+        self.version += 1
+
+    def reset(self):
+        self.completed = bytearray(len(self.completed))
+        self.version += 1
+
+    def missing(self):
+        return [i for i in range(self.chunk_count) if not self.is_complete(i)]
+
+    def done(self):
+        return all(self.is_complete(i) for i in range(self.chunk_count))
+
+    def completed_bytes(self):
+        total = 0
+        for i in range(self.chunk_count):
+            if self.is_complete(i):
+                start, end = self.byte_range(i)
+                total += end - start
+        return total
+
+    def unflushed_bytes(self):
+        return max(0, self.version - self.flushed_version) * self.chunk_size
+
+    async def checkpoint(self, fh=None):
+        # every flush fsyncs the data file, so completions only trigger one
+        # now and then, and never queue up behind a flush already running
+        if self.lock.locked() or self.version == self.flushed_version:
+            return
+        due = time.monotonic() - self.flushed_at >= flush_interval
+        if due or self.unflushed_bytes() >= flush_bytes:
+            await self.flush(fh)
+
+    async def flush(self, fh=None):
+        # chunks are only recorded once their bytes are on disk, so a crash
+        # can lose progress but never mark a hole as complete
+        async with self.lock:
+            if self.version == self.flushed_version:
+                return
+            version = self.version
+            data = json.dumps(
+                {
+                    "url": self.url,
+                    "size": self.size,
+                    "type": self.type,
+                    "name": self.name,
+                    "friend": self.friend.hex(),
+                    "chunk_size": self.chunk_size,
+                    "root": self.root.hex(),
+                    "completed": base64.b64encode(bytes(self.completed)).decode(),
+                }
+            )
+            if fh:
+                await fh.fsync()
+            tmp_path = f"{self.path}.tmp"
+            async with aiofiles.open(tmp_path, "w") as out:
+                await out.write(data)
+            os.replace(tmp_path, self.path)
+            self.flushed_version = version
+            self.flushed_at = time.monotonic()
+            self.flushes += 1
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,81 @@
+import hashlib
+
+chunk_size = 262_144
+digest_size = 32
+
+
+# leaves and interior nodes are hashed with different prefixes, as in
+# RFC 6962, so a leaf can never pose as a subtree or the other way round
+leaf_prefix = b"\x00"
+node_prefix = b"\x01"
+
+
+def hash_chunk(data):
+    return hashlib.sha256(leaf_prefix + data).digest()
+
+
+def chunk_hasher():
+    return hashlib.sha256(leaf_prefix)
+
+
+def merkle_root(leaves):
+    if not leaves:
+        return hash_chunk(b"")
+    level = list(leaves)
+    while len(level) > 1:
+        next_level = [
+            hashlib.sha256(node_prefix + level[i] + level[i + 1]).digest()
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+class Manifest:
+    @classmethod
+    def compute(cls, path, chunk_size=chunk_size):
+        with open(path, "rb") as fh:
+            return cls.read_from(fh, chunk_size)
+
+    @classmethod
+    def read_from(cls, fh, chunk_size=chunk_size):
+        leaves = []
+        while True:
+            data = fh.read(chunk_size)
+            if not data:
+                break
+            leaves.append(hash_chunk(data))
+        return Manifest(chunk_size, leaves)
+
+    @classmethod
+    def for_content(cls, content, chunk_size=chunk_size):
+        leaves = [
+            hash_chunk(content[i : i + chunk_size])
+            for i in range(0, len(content), chunk_size)
+        ]
+        return Manifest(chunk_size, leaves)
+
+    @classmethod
+    def decode(cls, chunk_size, data):
+        if len(data) % digest_size:
+            raise ValueError(
+                f"manifest length {len(data)} is not a multiple of {digest_size}"
+            )
+        leaves = [data[i : i + digest_size] for i in range(0, len(data), digest_size)]
+        return Manifest(chunk_size, leaves)
+
+    def __init__(self, chunk_size, leaves):
+        self.chunk_size = chunk_size
+        self.leaves = leaves
+        self.root = merkle_root(leaves)
+
+    def encode(self):
+        return b"".join(self.leaves)
+
+    def verify(self, index, data):
+        return self.check(index, hash_chunk(data))
+
+    def check(self, index, digest):
+        return index < len(self.leaves) and digest == self.leaves[index]
@@ -0,0 +1,103 @@
+import os
+import time
+import asyncio
+import filetype
+from stat import S_ISDIR
+from collections import OrderedDict
+from slick.manifest import Manifest
+from slick.bundle import Bundle, BundleReader, bundle_type
+
+max_entries = 512
+bundle_ttl = 10
+
+
+class FileMetadata:
+    def __init__(self, *, size, mtime, mimetype, bundle=None):
+        self.size = size
+        self.mtime = mtime
+        self.mimetype = mimetype
+        self.bundle = bundle
+        self.manifest = None
+        self.manifest_result = None
+
+
+class MetadataCache:
+    def __init__(self, max_entries=max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.scans = {}
+
+    async def get(self, path, *, manifest=False):
+        loop = asyncio.get_event_loop()
+        stat = os.stat(path)
+        if S_ISDIR(stat.st_mode):
+            key = await self.bundle_key(path, stat)
+        else:
+            # a rewrite in place changes size or mtime, a replacement the inode
+            key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        metadata = self.entries.get(key)
+        if metadata:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            self.misses += 1
+            if S_ISDIR(stat.st_mode):
+                bundle = self.scans[path][2]
+                metadata = FileMetadata(
+                    size=bundle.size,
+                    mtime=bundle.mtime,
+                    mimetype=bundle_type,
+                    bundle=bundle,
+                )
+            else:
+                mimetype = await loop.run_in_executor(None, sniff, path)
+                metadata = FileMetadata(
+                    size=stat.st_size, mtime=stat.st_mtime, mimetype=mimetype
+                )
+            metadata = self.entries.setdefault(key, metadata)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if manifest and not metadata.manifest:
+            # concurrent offers of the same file share one hashing pass
+            if not metadata.manifest_result:
+                metadata.manifest_result = loop.run_in_executor(
+                    None, compute_manifest, path, metadata.bundle
+                )
+            try:
+                metadata.manifest = await metadata.manifest_result
+            finally:
+                metadata.manifest_result = None
+        return metadata
+
+    async def bundle_key(self, path, stat):
+        # a directory's own stat misses changes deeper in the tree, so it is
+        # walked again, though at most once per bundle_ttl
+        scanned_at, key, bundle = self.scans.get(path, (0, None, None))
+        if time.monotonic() - scanned_at > bundle_ttl:
+            loop = asyncio.get_event_loop()
+            bundle = await loop.run_in_executor(None, Bundle.scan, path)
+            key = (stat.st_dev, stat.st_ino, bundle.fingerprint())
+            self.scans[path] = (time.monotonic(), key, bundle)
+        return key
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def compute_manifest(path, bundle=None):
+    if not bundle:
+        return Manifest.compute(path)
+    reader = BundleReader(path, bundle)
+    try:
+        return Manifest.read_from(reader)
+    finally:
+        reader.close()
+
+
+def sniff(path):
+    with open(path, "rb") as fh:
+        ft = filetype.match(fh.read(261))
+    return ft.mime if ft else "application/octet-stream"
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from slick.logger import logger
+
+offer_lifetime = 7 * 24 * 60 * 60
+evict_interval = 60
+# offers tend to go out in bursts, the index is written once they settle
+save_delay = 1.0
+
+
+class OfferedFile:
+    @classmethod
+    def from_json(cls, file_id, data):
+        return OfferedFile(
+            data["path"],
+            file_id=file_id,
+            size=data["size"],
+            mtime=data["mtime"],
+            friends={bytes.fromhex(d) for d in data["friends"]},
+            expires=data["expires"],
+            bundle=data.get("bundle", False),
+        )
+
+    def __init__(
+        self, path, *, file_id=None, size, mtime, friends=None, expires, bundle=False
+    ):
+        self.path = path
+        self.uuid = file_id or str(uuid.uuid4())
+        self.size = size
+        self.mtime = mtime
+        self.friends = friends or set()
+        self.expires = expires
+        self.bundle = bundle
+
+    @property
+    def url(self):
+        return f"/f/{self.uuid}"
+
+    def to_json(self):
+        return {
+            "path": self.path,
+            "size": self.size,
+            "mtime": self.mtime,
+            "friends": sorted(d.hex() for d in self.friends),
+            "expires": self.expires,
+            "bundle": self.bundle,
+        }
+
+    def add(self, friend):
+        self.friends.add(friend.digest)
+
+    def has_permission(self, friend):
+        return friend.digest in self.friends
+
+    def expired(self, now):
+        return self.expires < now
+
+    def changed(self):
+        # a bundle is checked against its manifest when it is served, a
+        # directory's own stat says nothing about the files in it
+        if self.bundle:
+            return not os.path.isdir(self.path)
+        # an offer only stays valid for the exact bytes it was made for
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return not self.matches(stat.st_size, stat.st_mtime)
+
+    def matches(self, size, mtime):
+        return self.size == size and self.mtime == mtime
+
+
+class OfferRegistry:
+    def __init__(self, app, lifetime=offer_lifetime):
+        self.app = app
+        self.lifetime = lifetime
+        self.offers = None
+        self.paths = {}
+        self.dirty = False
+        self.save_handle = None
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    @property
+    def path(self):
+        return os.path.join(self.app.base, "offers.json")
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._load)
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def get(self, file_id):
+        self._load()
+        offered_file = self.offers.get(file_id)
+        if offered_file and not offered_file.expired(time.time()):
+            return offered_file
+
+    def offer(self, friend, path, metadata):
+        self._load()
+        offered_file = self.paths.get(path)
+        if offered_file and not offered_file.matches(metadata.size, metadata.mtime):
+            self._remove(offered_file)
+            offered_file = None
+        if not offered_file:
+            offered_file = OfferedFile(
+                path,
+                size=metadata.size,
+                mtime=metadata.mtime,
+                expires=0,
+                bundle=bool(metadata.bundle),
+            )
+            self.offers[offered_file.uuid] = offered_file
+            self.paths[path] = offered_file
+        offered_file.add(friend)
+        offered_file.expires = time.time() + self.lifetime
+        self._changed()
+        return offered_file
+
+    async def run(self):
+        # stale offers are swept on a timer, requests only check expiry
+        while True:
+            await asyncio.sleep(evict_interval)
+            try:
+                await self.evict()
+            except Exception as e:
+                logger.warning(f"could not evict stale offers: {e!r}")
+
+    async def evict(self):
+        self._load()
+        offers = list(self.offers.values())
+        loop = asyncio.get_event_loop()
+        changed = await loop.run_in_executor(
+            None, lambda: [f.changed() for f in offers]
+        )
+        now = time.time()
+        stale = [f for f, c in zip(offers, changed) if c or f.expired(now)]
+        for offered_file in stale:
+            logger.debug(f"evicting offer {offered_file.uuid} for {offered_file.path}")
+            self._remove(offered_file)
+        if stale:
+            self._changed()
+
+    def _load(self):
+        if self.offers is not None:
+            return
+        self.offers = {}
+        try:
+            with open(self.path, "r") as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.warning("ignoring unreadable offer index %s: %s", self.path, e)
+            return
+        for file_id, offer in data.items():
+            offered_file = OfferedFile.from_json(file_id, offer)
+            self.offers[file_id] = offered_file
+            self.paths[offered_file.path] = offered_file
+
+    def _remove(self, offered_file):
+        self.offers.pop(offered_file.uuid, None)
+        if self.paths.get(offered_file.path) is offered_file:
+            del self.paths[offered_file.path]
+
+    def _changed(self):
+        self.dirty = True
+        if not self.save_handle:
+            loop = asyncio.get_event_loop()
+            self.save_handle = loop.call_later(
+                save_delay, lambda: asyncio.ensure_future(self.flush())
+            )
+
+    async def flush(self):
+        if self.save_handle:
+            self.save_handle.cancel()
+            self.save_handle = None
+        async with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            data = {file_id: f.to_json() for file_id, f in self.offers.items()}
+            loop = asyncio.get_event_loop()
+            try:
+                await loop.run_in_executor(None, self._save, data)
+            except OSError as e:
+                self.dirty = True
+                logger.warning(f"could not save the offer index: {e}")
+
+    def _save(self, data):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,104 @@
+import asyncio
+from functools import partial
+from collections import OrderedDict
+from slick.manifest import chunk_size
+from slick.bundle import BundleReader
+
+default_max_size = 64 * 1024 ** 2
+
+
+class ReadCache:
+    def __init__(self, max_size=default_max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, load, executor=None):
+        data = self.entries.get(key)
+        if data is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return data
+        # requests that miss on the same bytes at the same time wait on one
+        # read instead of each going to disk
+        future = self.loading.get(key)
+        if future:
+            self.hits += 1
+            return await asyncio.shield(future)
+        self.misses += 1
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(executor, load)
+        self.loading[key] = future
+        try:
+            data = await asyncio.shield(future)
+        finally:
+            del self.loading[key]
+        self.put(key, data)
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_size or key in self.entries:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_size:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class CachedReader:
+    def __init__(self, cache, path, metadata, chunk_size=chunk_size):
+        self.cache = cache
+        self.path = path
+        self.metadata = metadata
+        self.chunk_size = chunk_size
+        self.key = (path, metadata.size, metadata.mtime)
+        self.position = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def seek(self, offset):
+        self.position = offset
+
+    async def read(self, count):
+        # reads stop at chunk boundaries, so every request for the same
+        # bytes lands on the same cache entries whatever range it asked for
+        index = self.position // self.chunk_size
+        start = index * self.chunk_size
+        end = min(self.metadata.size, start + self.chunk_size)
+        if start >= end:
+            return b""
+        chunk = await self.cache.get(
+            self.key + (index,),
+            partial(read_chunk, self.path, self.metadata.bundle, start, end),
+        )
+        data = memoryview(chunk)[self.position - start :][:count]
+        self.position += len(data)
+        return data
+
+
+def read_chunk(path, bundle, start, end):
+    if bundle:
+        fh = BundleReader(path, bundle)
+    else:
+        fh = open(path, "rb")
+    try:
+        fh.seek(start)
+        return fh.read(end - start)
+    finally:
+        fh.close()
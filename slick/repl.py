@@ -3,7 +3,9 @@ import os
 import glob
 import click
 import asyncio
+import aiofiles
 import humanize
+from functools import partial
 from slick.app import App, ServiceStatus
 from os.path import expanduser
 from prompt_toolkit import PromptSession
@@ -14,9 +16,14 @@ from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.formatted_text import HTML
 from prompt_toolkit import print_formatted_text
 from slick.logger import logger
+from slick.util import parse_size
+from slick.writer import writers, default_writer
+from slick.health import idle_timeout
 from slick.server import FriendRequest
 from slick.discovery import Nearby
-from slick.bencode import File
+from slick.connection import inline_content, read_offer
+from slick.journal import Journal
+from slick.manifest import chunk_size
 
 potential_commands = [
     "/send ",
@@ -29,6 +36,7 @@ potential_commands = [
     "/remove ",
     "/help ",
     "/info ",
+    "/limit ",
 ]
 
 bindings = KeyBindings()
@@ -50,17 +58,11 @@ class CommandValidator(Validator):
         text = document.text
         if text.startswith("/send "):
             path = text[5:].strip()
-            if not os.path.isfile(path):
-                if os.path.isdir(path):
-                    raise ValidationError(
-                        message="Cannot be a directory",
-                        cursor_position=document.cursor_position,
-                    )
-                else:
-                    raise ValidationError(
-                        message="Must be a file",
-                        cursor_position=document.cursor_position,
-                    )
+            if not os.path.isfile(path) and not os.path.isdir(path):
+                raise ValidationError(
+                    message="Must be a file or directory",
+                    cursor_position=document.cursor_position,
+                )
 
 
 class CommandCompleter(Completer):
@@ -94,7 +96,7 @@ class CommandCompleter(Completer):
 
 
 class Repl:
-    def __init__(self, *, base, loop):
+    def __init__(self, *, base, loop, writer=default_writer, idle_timeout=idle_timeout):
         use_asyncio_event_loop(loop)
 
         self.app = App(
@@ -102,8 +104,11 @@ class Repl:
             loop=loop,
             message_handler=self.handle_incoming_message,
             friend_handler=self.handle_friend_request,
+            writer=writer,
+            idle_timeout=idle_timeout,
         )
         self.files = []
+        self.downloads = {}
         self.active_friend = None
         self.prompt_session = PromptSession()
         self.online_friends = []
@@ -122,8 +127,9 @@ class Repl:
 <b>/talk   [subject]</b>  talk to someone
 <b>/end</b>               stop talking to someone
 <b>/quit</b>              quit the program
-<b>/send</b>              send a file
-<b>/get</b>               get a file
+<b>/send</b>              send a file or directory
+<b>/get    [#]</b>        get a file, optionally with a priority
+<b>/limit  [rate]</b>     limit bandwidth, /limit up|down [subject] [rate]
 <b>/info</b>              print status information
 
 """
@@ -137,6 +143,7 @@ class Repl:
             self.app.identity.set_name(name)
 
         async with self.app.run():
+            asyncio.ensure_future(self.restore_downloads())
             await self.update()
             try:
                 self.continue_running = True
@@ -173,13 +180,16 @@ class Repl:
                             await self.talk(answer[5:].strip())
                         elif answer.startswith("/info"):
                             await self.info()
+                        elif answer.startswith("/limit"):
+                            await self.limit(answer[6:].strip())
                         else:
                             print_formatted_text(self.help_text)
                             self.prompt_session.app.invalidate()
                     else:
                         if self.active_friend:
-                            if not await self.active_friend.send(answer):
-                                print(f"cannot reach {self.active_friend.name}")
+                            # lines go out in order over the friend's channel,
+                            # so the prompt does not wait on each round trip
+                            asyncio.ensure_future(self.say(self.active_friend, answer))
                         else:
                             print_formatted_text(
                                 HTML(
@@ -190,10 +200,29 @@ class Repl:
 
             except KeyboardInterrupt:
                 print("stopping...")
+            finally:
+                # unfinished downloads record their progress before the app
+                # stops under them
+                downloads = list(self.downloads.values())
+                for download in downloads:
+                    download.cancel()
+                if downloads:
+                    await asyncio.wait(downloads)
 
     async def handle_incoming_message(self, message):
         if message.content_type == "x-slick/file":
-            file = File.decode(message.data)
+            try:
+                file = read_offer(message.data)
+            except ValueError as e:
+                logger.debug(f"dropping a file offer from {message.sender.name}: {e}")
+                print_formatted_text(
+                    HTML(
+                        f"<gray>{message.sender.name} offered a file this version"
+                        " of slick cannot read</gray>"
+                    )
+                )
+                self.prompt_session.app.invalidate()
+                return
             file["friend"] = message.sender
             self.files.append(file)
             print_formatted_text(
@@ -203,16 +232,44 @@ class Repl:
             )
             print_formatted_text(HTML(f"  from: <b>{file['friend'].name}</b>"))
             print_formatted_text(HTML(f"  {file['size']} bytes ({file['type']})"))
+            if file.get("inline"):
+                print_formatted_text(HTML("  <gray>already received</gray>"))
         else:
             print_formatted_text(
                 HTML(f"<gray>{message.sender.name}</gray> {message.text()}")
             )
         self.prompt_session.app.invalidate()
 
+    async def restore_downloads(self):
+        await self.app.friend_list.loaded()
+        for journal in Journal.scan("."):
+            friend = self.app.friend_list.get_friend_for_digest(journal.friend)
+            if not friend:
+                continue
+            file = {
+                "url": journal.url,
+                "size": journal.size,
+                "type": journal.type,
+                "name": journal.name,
+                "root": journal.root,
+                "chunk_size": journal.chunk_size,
+                "friend": friend,
+            }
+            self.files.append(file)
+            print_formatted_text(
+                HTML(
+                    f"resumable file available #{len(self.files) - 1}\n<b>{file['name']}</b>"
+                )
+            )
+
     def handle_friend_request(self, friend_request):
         self.addable_entities[friend_request.key] = friend_request
         self.friend_request_count += 1
 
+    async def say(self, friend, text):
+        if not await friend.send(text):
+            print(f"cannot reach {friend.name}")
+
     async def end_conversation(self):
         self.active_friend = None
 
@@ -230,6 +287,7 @@ class Repl:
                 print("too many match that name")
             else:
                 self.active_friend = matches[0]
+                asyncio.ensure_future(self.active_friend.open())
 
     async def list(self):
         await self.update()
@@ -354,28 +412,228 @@ class Repl:
         else:
             await self.active_friend.offer_file(path)
 
-    async def get_file(self, index_str):
+    async def get_file(self, args):
+        index_str, _, priority_str = args.partition(" ")
         try:
             index = int(index_str)
+            priority = int(priority_str) if priority_str.strip() else 0
             file = self.files[index]
-            x = 0
-            target = os.path.basename(file["name"])
-            while os.path.isfile(target):
-                x = x + 1
-                target = f"{os.path.basename(file['name'])}.{x}"
-            print(
-                f"Writing {file['name']} ({humanize.naturalsize(file['size'])}) to {target}"
-            )
             sender = file["friend"]
-            await sender.get_file(path=file["url"], size=file["size"], target=target)
+            if file.get("inline"):
+                await self.write_inline(file)
+                return
+            target, journal = Journal.pick_target(
+                file["name"],
+                lambda existing: existing.friend == sender.digest
+                and existing.matches(
+                    url=file["url"],
+                    size=file["size"],
+                    type=file["type"],
+                    root=file.get("root", b""),
+                ),
+            )
+            if target in self.downloads:
+                print(f"Already getting {file['name']} into {target}")
+                return
+            if journal:
+                print(
+                    f"Resuming {file['name']} ({humanize.naturalsize(file['size'])}) in {target}"
+                )
+            else:
+                print(
+                    f"Writing {file['name']} ({humanize.naturalsize(file['size'])}) to {target}"
+                )
+                journal = Journal(
+                    target,
+                    url=file["url"],
+                    size=file["size"],
+                    type=file["type"],
+                    name=file["name"],
+                    friend=sender.digest,
+                    chunk_size=file.get("chunk_size") or chunk_size,
+                    root=file.get("root", b""),
+                )
+            # an earlier copy under the same name lets us fetch only the changes
+            basis = os.path.basename(file["name"])
+            if basis == target or not os.path.isfile(basis) or Journal.load(basis):
+                basis = None
+            # the download runs in the background, so the prompt stays usable
+            # while it does
+            download = asyncio.ensure_future(
+                sender.get_file(journal=journal, basis=basis, priority=priority)
+            )
+            self.downloads[target] = download
+            download.add_done_callback(partial(self.download_done, file, target))
         except ValueError:
-            print(f"Can't parse `{index_str}' as an integer")
+            print(f"Can't parse `{args}' as an index and priority")
         except IndexError:
             print(f"Can't get a file for `{index_str}'")
 
+    def download_done(self, file, target, future):
+        self.downloads.pop(target, None)
+        if future.cancelled():
+            return
+        try:
+            download = future.result()
+        except Exception as e:
+            logger.debug(f"download of {file['name']} failed: {e!r}")
+            print(f"Could not get {file['name']}: {e}")
+            return
+        if download:
+            self.print_download_stats(download.stats())
+
+    async def write_inline(self, file):
+        content = inline_content(file)
+        if content is None:
+            print(f"The content sent for {file['name']} is corrupt")
+            return
+        target, _ = Journal.pick_target(file["name"])
+        try:
+            async with aiofiles.open(target, "wb") as fh:
+                await fh.write(content)
+        except OSError as e:
+            print(f"Could not write {file['name']} to {target}: {e}")
+            return
+        print(
+            f"Wrote {file['name']} ({humanize.naturalsize(file['size'])}) to {target}"
+        )
+
     async def info(self):
         for k, v in self.app.service_states.items():
             print(f"{k}: {v}")
+        stats = self.app.scheduler.stats()
+        rate = stats["rate"]
+        print(
+            f"transfers: {stats['downloads']} ({stats['queued']} queued),"
+            f" {stats['requests']} requests in flight ({stats['waiting_requests']} waiting),"
+            f" limit {humanize.naturalsize(rate) + '/s' if rate else 'none'}"
+        )
+        for download in self.app.scheduler.downloads:
+            self.print_download_stats(download.stats())
+
+        health = self.app.health.stats()
+        print(
+            f"health checks: {health['watched']} connections ({health['in_use']} in use), {health['probes']} probes"
+            f" ({health['failures']} failed), {health['skipped']} skipped for recent traffic"
+        )
+        sessions = self.app.certificate.session_stats()
+        print(
+            "tls sessions resumed: "
+            + ", ".join(
+                f"{side} {side_stats['resumed']} of {side_stats['handshakes']}"
+                for side, side_stats in sessions.items()
+            )
+        )
+        for transport, pool in self.app.client_pool.stats().items():
+            active = "?" if pool["active"] is None else pool["active"]
+            idle = "?" if pool["idle"] is None else pool["idle"]
+            print(
+                f"{transport} client pool: {active} active, {idle} idle,"
+                f" limit {pool['limit']} ({pool['limit_per_host']} per host)"
+            )
+
+        metadata = self.app.metadata.stats()
+        print(
+            f"file metadata cache: {metadata['entries']} entries,"
+            f" {metadata['hits']} hits, {metadata['misses']} misses"
+        )
+
+        uploads = self.app.talk_server.shaper.stats()
+        limit = uploads["limit"]
+        print(
+            f"uploads: {humanize.naturalsize(uploads['rate'])}/s,"
+            f" limit {humanize.naturalsize(limit) + '/s' if limit else 'none'}"
+        )
+        cache = self.app.talk_server.read_cache.stats()
+        print(
+            f"  read cache: {humanize.naturalsize(cache['size'])} in {cache['entries']} entries,"
+            f" {cache['hits']} hits, {cache['misses']} misses"
+        )
+        compression = self.app.talk_server.compression
+        if compression["bytes"]:
+            print(
+                f"  compressed {humanize.naturalsize(compression['bytes'])}"
+                f" to {humanize.naturalsize(compression['sent'])}"
+            )
+        for digest, friend_stats in uploads["friends"].items():
+            friend = self.app.friend_list.get_friend_for_digest(digest)
+            limit = friend_stats["limit"]
+            print(
+                f"  {friend.name if friend else digest.hex()[0:6]}:"
+                f" {humanize.naturalsize(friend_stats['rate'])}/s,"
+                f" limit {humanize.naturalsize(limit) + '/s' if limit else 'none'}"
+            )
+
+    async def limit(self, args):
+        words = args.split()
+        direction = words.pop(0) if words and words[0] in ("up", "down") else "down"
+        rate = None
+        if words:
+            try:
+                rate = parse_size(words[-1])
+                words.pop()
+            except ValueError:
+                pass
+
+        if len(words) > 1 or (words and direction == "down"):
+            print(f"Can't parse `{args}' as a limit")
+            return
+
+        if words:
+            matches = list(
+                filter(
+                    lambda f: f.name.startswith(words[0]),
+                    self.app.friend_list.friends(),
+                )
+            )
+            if len(matches) == 0:
+                print("no one matches that name")
+            elif len(matches) > 1:
+                print("too many match that name")
+            else:
+                self.app.talk_server.shaper.set_friend_rate(matches[0], rate)
+                self.print_limit(f"Uploads to {matches[0].name}", rate)
+        elif direction == "up":
+            self.app.talk_server.shaper.set_rate(rate)
+            self.print_limit("Uploads", rate)
+        else:
+            self.app.scheduler.set_rate(rate)
+            self.print_limit("Downloads", rate)
+
+    def print_limit(self, subject, rate):
+        if rate:
+            print(f"{subject} limited to {humanize.naturalsize(rate)}/s")
+        else:
+            print(f"{subject} are not limited")
+
+    def print_download_stats(self, stats):
+        print(
+            f"{stats['name']}: {humanize.naturalsize(stats['completed'])} of {humanize.naturalsize(stats['size'])}"
+            f" at {humanize.naturalsize(stats['throughput'])}/s"
+        )
+        latency = stats["latency"]
+        print(
+            f"  ranges take {latency['p50']:.2f}s (p50) {latency['p99']:.2f}s (p99),"
+            f" {stats['retries']} retried, {stats['speculation_wins']} of {stats['speculated']} races won"
+        )
+        if stats["reused"]:
+            print(f"  {humanize.naturalsize(stats['reused'])} reused from local chunks")
+        if stats["patched"]:
+            print(
+                f"  {humanize.naturalsize(stats['patched'])} copied from the previous version"
+            )
+        if stats["swarmed"]:
+            print(
+                f"  {humanize.naturalsize(stats['swarmed'])} fetched from other friends"
+            )
+        for path in stats["paths"]:
+            state = "" if path["alive"] else " (dropped)"
+            if path["swarm"]:
+                state += " (swarm)"
+            print(
+                f"  {path['path']}: {humanize.naturalsize(path['throughput'])}/s"
+                f" in ranges of {humanize.naturalsize(path['range_size'])} x {path['concurrency']}{state}"
+            )
 
     async def run_update(self):
         while True:
@@ -418,12 +676,19 @@ class Repl:
 @click.command()
 @click.option("--base", default=expanduser("~/.slick"))
 @click.option("--anonymous/--no-anonymous", default=False)
+@click.option("--writer", type=click.Choice(sorted(writers)), default=default_writer)
+@click.option(
+    "--idle-timeout",
+    type=int,
+    default=idle_timeout,
+    help="seconds without traffic before a friend's connection is let go",
+)
 @click.version_option()
-def run(base, anonymous):
+def run(base, anonymous, writer, idle_timeout):
     if anonymous:
         base = None
     loop = asyncio.get_event_loop()
-    repl = Repl(base=base, loop=loop)
+    repl = Repl(base=base, loop=loop, writer=writer, idle_timeout=idle_timeout)
     loop.run_until_complete(repl.run())
     loop.close()
 
@@ -0,0 +1,74 @@
+from contextlib import asynccontextmanager
+from slick.throttle import TokenBucket, PrioritySemaphore
+from slick.logger import logger
+
+max_downloads = 2
+max_requests = 16
+message_reserve = 4
+
+
+class TransferScheduler:
+    def __init__(
+        self,
+        app,
+        *,
+        downloads=max_downloads,
+        requests=max_requests,
+        reserve=message_reserve,
+        rate=None,
+    ):
+        self.app = app
+        self.download_slots = PrioritySemaphore(downloads)
+        # part of the request budget is always set aside for messages, so
+        # one never waits behind range requests that already hold a slot
+        self.request_slots = PrioritySemaphore(requests - reserve)
+        self.message_slots = PrioritySemaphore(reserve)
+        self.bucket = None
+        self.downloads = []
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.bucket = TokenBucket(rate) if rate else None
+
+    @property
+    def rate(self):
+        return self.bucket.rate if self.bucket else None
+
+    async def run(self, download, priority=0):
+        download.priority = priority
+        self.downloads.append(download)
+        try:
+            await self.download_slots.acquire(priority)
+            try:
+                logger.debug(f"starting {download.name} at priority {priority}")
+                return await download.run()
+            finally:
+                self.download_slots.release()
+        finally:
+            self.downloads.remove(download)
+
+    async def acquire(self, download, size):
+        await self.request_slots.acquire(download.priority)
+        if self.bucket:
+            await self.bucket.consume(size)
+
+    def release(self):
+        self.request_slots.release()
+
+    @asynccontextmanager
+    async def interactive(self):
+        await self.message_slots.acquire()
+        try:
+            yield
+        finally:
+            self.message_slots.release()
+
+    def stats(self):
+        return {
+            "downloads": len(self.downloads),
+            "queued": self.download_slots.waiting(),
+            "requests": self.request_slots.held,
+            "waiting_requests": self.request_slots.waiting(),
+            "messages": self.message_slots.held,
+            "rate": self.rate,
+        }
@@ -1,10 +1,12 @@
 import os
-import ssl
 import aiohttp
-import uuid
 import json
 import hashlib
 import asyncio
+import aiofiles
+import collections
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from aiohttp import web
 from nacl.public import PrivateKey, SealedBox
 from cryptography import x509
@@ -15,7 +17,32 @@ from nacl.public import SealedBox, PublicKey
 from slick.logger import logger
 from slick.util import find_free_port
 from slick.friend import Friend
-from slick.bencode import Request
+from slick.bencode import Request, ChannelFrame
+from slick.offers import OfferRegistry
+from slick import delta
+from slick.throttle import UploadShaper
+from slick.bundle import AsyncBundleReader
+from slick.read_cache import ReadCache, CachedReader
+from slick.channel import Deliveries, channel_path, heartbeat
+from slick.metadata import FileMetadata
+from slick.swarm import ChunkStoreReader
+from slick.compression import (
+    compression_header,
+    codec,
+    compressible,
+    frame_size,
+    worth_trying,
+    encode_frame,
+    is_deflated,
+)
+
+max_request_size = 16 * 1024 ** 2
+upload_piece_size = 65536
+compress_threads = 2
+compress_ahead = 4
+# deltas are computed on a pool of their own, so a few of them cannot hold up
+# everything else that runs on the default executor
+delta_threads = 1
 
 
 class FriendRequest:
@@ -89,46 +116,40 @@ class Message:
         return f"{self.sender.name} {self.sender.onion[0:6]} -> {self.text()}"
 
 
-class OfferedFile:
-    def __init__(self, path):
-        self.path = path
-        self.friends = {}
-        self.uuid = str(uuid.uuid4())
-
-    def add(self, friend):
-        self.friends[friend.digest] = friend
-
-    def has_permission(self, friend):
-        return friend.digest in self.friends
-
-
 class TalkServer(BaseServer):
     def __init__(self, app):
         super().__init__(app)
-        self.files = {}
+        self.offers = OfferRegistry(app)
+        self.shaper = UploadShaper()
+        self.compressor = ThreadPoolExecutor(max_workers=compress_threads)
+        self.delta_pool = ThreadPoolExecutor(max_workers=delta_threads)
+        self.compression = {"bytes": 0, "sent": 0}
+        self.read_cache = ReadCache()
+        self.deliveries = Deliveries()
 
     @property
     def _name(self):
         return "talk"
 
     async def start(self):
+        await self.offers.start()
         await self.app.certificate.public_cert_bytes()
-        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        ssl_context.load_cert_chain(
-            certfile=os.path.join(self.app.base, "server.crt"),
-            keyfile=os.path.join(self.app.base, "server.key"),
+        ssl_context = self.app.certificate.server_context(
+            self.app.friend_list.friends()
         )
-        for f in self.app.friend_list.friends():
-            ssl_context.load_verify_locations(cadata=f.cert)
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
 
-        self.web_app = web.Application()
+        self.web_app = web.Application(client_max_size=max_request_size)
         self.web_app.add_routes(
             [
                 web.head("/", self.handle_head),
                 web.post("/", self.handle_post),
+                web.get(channel_path, self.handle_channel),
                 web.get("/f/{file_id}", self.handle_file),
+                web.get("/f/{file_id}/manifest", self.handle_manifest),
+                web.post("/f/{file_id}/delta", self.handle_delta),
+                web.get("/f/{file_id}/bundle", self.handle_bundle),
+                web.get("/c/{root}", self.handle_content),
+                web.get("/c/{root}/have", self.handle_have),
             ]
         )
 
@@ -142,13 +163,12 @@ class TalkServer(BaseServer):
         )
         await self.site.start()
 
-    def offer_file(self, friend, path):
-        abs_path = os.path.abspath(path)
-        if abs_path not in self.files:
-            offered_file = OfferedFile(abs_path)
-            self.files[offered_file.uuid] = offered_file
-        offered_file.add(friend)
-        return f"/f/{offered_file.uuid}"
+    async def stop(self):
+        await super().stop()
+        await self.offers.stop()
+
+    def offer_file(self, friend, path, metadata):
+        return self.offers.offer(friend, os.path.abspath(path), metadata)
 
     async def restart(self):
         await self.stop()
@@ -157,26 +177,266 @@ class TalkServer(BaseServer):
     async def handle_post(self, request):
         common_name = self.common_name(request)
         sender = self.app.friend_list.get_friend_for_onion(common_name)
+        if not sender:
+            return web.Response(status=404)
         data = await request.read()
         content_type = request.content_type
         message = Message(self.app, sender=sender, content_type=content_type, data=data)
         await self.app.handle_incoming_message(message)
         return web.Response(status=201)
 
+    async def handle_channel(self, request):
+        common_name = self.common_name(request)
+        sender = self.app.friend_list.get_friend_for_onion(common_name)
+        if not sender:
+            return web.Response(status=404)
+        key = (sender.digest, request.query.get("session"))
+        ws = web.WebSocketResponse(heartbeat=heartbeat, max_msg_size=max_request_size)
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.BINARY:
+                continue
+            frame = ChannelFrame.decode(msg.data)
+            delivered = self.deliveries.get(key)
+            for item in frame["messages"]:
+                # messages resent after a broken channel are only
+                # acknowledged again
+                seq = item["seq"]
+                if seq <= delivered:
+                    continue
+                message = Message(
+                    self.app,
+                    sender=sender,
+                    content_type=item["content_type"].decode(),
+                    data=item["data"],
+                )
+                await self.app.handle_incoming_message(message)
+                delivered = seq
+                self.deliveries.set(key, delivered)
+            await ws.send_bytes(ChannelFrame.encode({"ack": delivered, "messages": []}))
+        return ws
+
     async def handle_head(self, request):
         return web.Response(status=200)
 
-    async def handle_file(self, request):
-        file_id = request.match_info["file_id"]
-        if file_id not in self.files:
-            return web.Response(status=404)
+    async def file_metadata(self, file, manifest=False):
+        # an offered file may have been moved or deleted since it was offered
+        try:
+            return await self.app.metadata.get(file.path, manifest=manifest)
+        except OSError as e:
+            logger.debug(f"offered file {file.path} is gone: {e}")
+            return None
+
+    def offered_file(self, request):
+        file = self.offers.get(request.match_info["file_id"])
+        if not file:
+            return None, None
         common_name = self.common_name(request)
         sender = self.app.friend_list.get_friend_for_onion(common_name)
-        file = self.files[file_id]
-        if file.has_permission(sender):
-            return web.FileResponse(self.files[file_id].path)
+        if not sender or not file.has_permission(sender):
+            return None, None
+        return file, sender
+
+    async def handle_file(self, request):
+        file, sender = self.offered_file(request)
+        if not file:
+            return web.Response(status=404)
+        metadata = await self.file_metadata(file)
+        if not metadata:
+            return web.Response(status=404)
+        if not file.matches(metadata.size, metadata.mtime):
+            return web.Response(status=410)
+        # an offer going out to several friends is likely to be read by them
+        # at about the same time, so its reads go through the shared cache
+        if len(file.friends) > 1:
+            reader = CachedReader(self.read_cache, file.path, metadata)
+        elif metadata.bundle:
+            reader = AsyncBundleReader(file.path, metadata.bundle)
+        else:
+            reader = aiofiles.open(file.path, "rb")
+        return await self.stream_file(request, sender, metadata, reader)
+
+    async def handle_content(self, request):
+        friend = self.app.friend_list.get_friend_for_onion(self.common_name(request))
+        if not friend:
+            return web.Response(status=404)
+        try:
+            root = bytes.fromhex(request.match_info["root"])
+        except ValueError:
+            return web.Response(status=404)
+        held = await self.app.swarm.get(root)
+        if not held:
+            return web.Response(status=404)
+        manifest, size = held
+        http_range = request.http_range
+        start = max(0, http_range.start or 0)
+        stop = size if http_range.stop is None else min(http_range.stop, size)
+        # only whole held chunks are served, the asker falls back to other
+        # sources for the rest
+        store = self.app.chunk_store
+        leaves = manifest.leaves[
+            start // manifest.chunk_size : -(-stop // manifest.chunk_size)
+        ]
+        loop = asyncio.get_event_loop()
+        held_all = await loop.run_in_executor(
+            None, lambda: all(store.has(leaf) for leaf in leaves)
+        )
+        if not held_all:
+            return web.Response(status=404)
+        metadata = FileMetadata(size=size, mtime=0, mimetype="application/octet-stream")
+        reader = ChunkStoreReader(store, manifest)
+        return await self.stream_file(request, friend, metadata, reader)
+
+    async def handle_have(self, request):
+        friend = self.app.friend_list.get_friend_for_onion(self.common_name(request))
+        if not friend:
+            return web.Response(status=404)
+        try:
+            root = bytes.fromhex(request.match_info["root"])
+        except ValueError:
+            return web.Response(status=404)
+        have = await self.app.swarm.have(root)
+        if not have:
+            return web.Response(status=404)
+        return web.Response(body=have, content_type="application/octet-stream")
+
+    async def stream_file(self, request, friend, metadata, reader):
+        size = metadata.size
+        http_range = request.http_range
+        start = http_range.start or 0
+        stop = size if http_range.stop is None else min(http_range.stop, size)
+        if start < 0:
+            start = max(0, size + start)
+        if size and start >= stop:
+            return web.Response(
+                status=416, headers={"Content-Range": f"bytes */{size}"}
+            )
+
+        compress = request.headers.get(compression_header) == codec and compressible(
+            metadata.mimetype
+        )
+
+        response = web.StreamResponse(status=206 if "Range" in request.headers else 200)
+        response.content_type = "application/octet-stream"
+        if compress:
+            # the range is still addressed in file bytes, only the body is
+            # framed, so its length is not known up front
+            response.headers[compression_header] = codec
         else:
+            response.content_length = stop - start
+        if response.status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        await response.prepare(request)
+
+        buckets = self.shaper.buckets_for(friend)
+        async with reader as fh:
+            await fh.seek(start)
+            if compress:
+                await self.send_frames(response, fh, stop - start, buckets, friend)
+            else:
+                remaining = stop - start
+                while remaining:
+                    data = await fh.read(min(upload_piece_size, remaining))
+                    if not data:
+                        break
+                    await self.send(response, data, buckets, friend)
+                    remaining -= len(data)
+        await response.write_eof()
+        return response
+
+    async def send_frames(self, response, fh, remaining, buckets, friend):
+        # frames are compressed on the pool a few ahead of the one going out,
+        # so the link does not wait on the compressor
+        loop = asyncio.get_event_loop()
+        frames = collections.deque()
+        raw_run = 0
+        while remaining or frames:
+            while remaining and len(frames) < compress_ahead:
+                offset = fh.position if isinstance(fh, CachedReader) else None
+                data = await fh.read(min(frame_size, remaining))
+                if not data:
+                    remaining = 0
+                    break
+                remaining -= len(data)
+                self.compression["bytes"] += len(data)
+                deflate = worth_trying(raw_run)
+                if offset is not None and deflate:
+                    # friends fetching the same bytes share the compressed frame
+                    key = fh.key + (offset, len(data), codec)
+                    load = partial(encode_frame, data, deflate)
+                    frame = self.read_cache.get(key, load, self.compressor)
+                else:
+                    frame = loop.run_in_executor(
+                        self.compressor, encode_frame, data, deflate
+                    )
+                frames.append(asyncio.ensure_future(frame))
+            if not frames:
+                break
+            frame = memoryview(await frames.popleft())
+            raw_run = 0 if is_deflated(frame) else raw_run + 1
+            self.compression["sent"] += len(frame)
+            for offset in range(0, len(frame), upload_piece_size):
+                piece = frame[offset : offset + upload_piece_size]
+                await self.send(response, piece, buckets, friend)
+
+    async def send(self, response, data, buckets, friend):
+        for bucket in buckets:
+            await bucket.consume(len(data))
+        await response.write(data)
+        self.shaper.record(friend, len(data))
+
+    async def handle_manifest(self, request):
+        file, _ = self.offered_file(request)
+        if not file:
             return web.Response(status=404)
+        metadata = await self.file_metadata(file, manifest=True)
+        if not metadata:
+            return web.Response(status=404)
+        if not file.matches(metadata.size, metadata.mtime):
+            return web.Response(status=410)
+        return web.Response(
+            body=metadata.manifest.encode(), content_type="application/octet-stream"
+        )
+
+    async def handle_delta(self, request):
+        file, _ = self.offered_file(request)
+        if not file:
+            return web.Response(status=404)
+        if file.bundle:
+            return web.Response(status=409)
+        metadata = await self.file_metadata(file)
+        if not metadata:
+            return web.Response(status=404)
+        if not file.matches(metadata.size, metadata.mtime):
+            return web.Response(status=410)
+        signature = await request.read()
+        loop = asyncio.get_event_loop()
+        try:
+            result = await loop.run_in_executor(
+                self.delta_pool, delta.compute_delta, file.path, signature
+            )
+        except ValueError as e:
+            logger.debug(f"rejecting a delta request for {file.path}: {e}")
+            return web.Response(status=400)
+        except OSError as e:
+            logger.debug(f"offered file {file.path} is gone: {e}")
+            return web.Response(status=404)
+        if result is None:
+            return web.Response(status=409)
+        return web.Response(body=result, content_type="application/octet-stream")
+
+    async def handle_bundle(self, request):
+        file, _ = self.offered_file(request)
+        if not file or not file.bundle:
+            return web.Response(status=404)
+        metadata = await self.file_metadata(file)
+        if not metadata:
+            return web.Response(status=404)
+        if not file.matches(metadata.size, metadata.mtime):
+            return web.Response(status=410)
+        return web.Response(
+            body=metadata.bundle.encode(), content_type="application/octet-stream"
+        )
 
     def common_name(self, request):
         san = request.transport._ssl_protocol._extra["peercert"]["subjectAltName"]
@@ -0,0 +1,126 @@
+import os
+import asyncio
+from slick.bencode import HeldContent
+from slick.manifest import Manifest
+from slick.logger import logger
+
+swarm_interval = 30
+
+
+def content_url(root):
+    return f"/c/{root.hex()}"
+
+
+class Swarm:
+    def __init__(self, app):
+        self.app = app
+        self.held = {}
+
+    @property
+    def path(self):
+        return os.path.join(self.app.base, "manifests")
+
+    def content_path(self, root):
+        return os.path.join(self.path, root.hex())
+
+    async def hold(self, manifest, size):
+        # the manifest is all it takes to serve whatever part of the content
+        # the chunk store has, during the download and after it
+        if manifest.root in self.held:
+            return
+        self.held[manifest.root] = (manifest, size)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._save, manifest, size)
+
+    def _save(self, manifest, size):
+        os.makedirs(self.path, exist_ok=True)
+        path = self.content_path(manifest.root)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(
+                HeldContent.encode(
+                    {
+                        "size": size,
+                        "chunk_size": manifest.chunk_size,
+                        "leaves": manifest.encode(),
+                    }
+                )
+            )
+        os.replace(tmp_path, path)
+
+    async def get(self, root):
+        held = self.held.get(root)
+        if held:
+            return held
+        loop = asyncio.get_event_loop()
+        held = await loop.run_in_executor(None, self._load, root)
+        if held:
+            self.held[root] = held
+        return held
+
+    def _load(self, root):
+        try:
+            with open(self.content_path(root), "rb") as fh:
+                data = HeldContent.decode(fh.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"ignoring unreadable manifest for {root.hex()}: {e}")
+            return None
+        manifest = Manifest.decode(data["chunk_size"], data["leaves"])
+        if manifest.root != root:
+            return None
+        return manifest, data["size"]
+
+    async def have(self, root):
+        held = await self.get(root)
+        if not held:
+            return None
+        manifest, _ = held
+        store = self.app.chunk_store
+        loop = asyncio.get_event_loop()
+        have = await loop.run_in_executor(
+            None, lambda: [store.has(leaf) for leaf in manifest.leaves]
+        )
+        if not any(have):
+            return None
+        bitmap = bytearray((len(have) + 7) // 8)
+        for index, held in enumerate(have):
+            if held:
+                bitmap[index // 8] |= 1 << (index % 8)
+        return bytes(bitmap)
+
+
+class ChunkStoreReader:
+    def __init__(self, store, manifest):
+        self.store = store
+        self.manifest = manifest
+        self.position = 0
+        self.index = None
+        self.chunk = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def seek(self, offset):
+        self.position = offset
+
+    async def read(self, count):
+        index = self.position // self.manifest.chunk_size
+        if index >= len(self.manifest.leaves):
+            return b""
+        if index != self.index:
+            loop = asyncio.get_event_loop()
+            self.chunk = await loop.run_in_executor(
+                None, self.store.get, self.manifest.leaves[index]
+            )
+            if self.chunk is None:
+                raise IOError(f"chunk {index} is no longer held")
+            self.index = index
+        start = self.position - index * self.manifest.chunk_size
+        data = memoryview(self.chunk)[start:][:count]
+        self.position += len(data)
+        return data
@@ -0,0 +1,137 @@
+import time
+import heapq
+import asyncio
+import itertools
+import collections
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount):
+        # a request larger than the bucket may overdraw it, later callers
+        # then wait for the debt to be paid back
+        while True:
+            self._refill()
+            needed = min(amount, self.burst)
+            if self.tokens >= needed:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+class PrioritySemaphore:
+    def __init__(self, limit):
+        self._limit = limit
+        self.held = 0
+        self.waiters = []
+        self.counter = itertools.count()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        self._limit = limit
+        self._wake()
+
+    async def acquire(self, priority=0):
+        if self.held < self._limit and not self.waiters:
+            self.held += 1
+            return
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (-priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.held -= 1
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self.held < self._limit:
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue
+            self.held += 1
+            future.set_result(True)
+
+    def waiting(self):
+        return sum(1 for _, _, future in self.waiters if not future.done())
+
+
+class RateMeter:
+    def __init__(self, window=5.0):
+        self.window = window
+        self.samples = collections.deque()
+        self.total = 0
+
+    def record(self, amount):
+        now = time.monotonic()
+        self.samples.append((now, amount))
+        self.total += amount
+        self._trim(now)
+
+    def rate(self):
+        self._trim(time.monotonic())
+        return sum(amount for _, amount in self.samples) / self.window
+
+    def _trim(self, now):
+        while self.samples and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+
+class UploadShaper:
+    def __init__(self):
+        self.bucket = None
+        self.friend_buckets = {}
+        self.meter = RateMeter()
+        self.friend_meters = {}
+
+    def set_rate(self, rate):
+        self.bucket = TokenBucket(rate) if rate else None
+
+    def set_friend_rate(self, friend, rate):
+        if rate:
+            self.friend_buckets[friend.digest] = TokenBucket(rate)
+        else:
+            self.friend_buckets.pop(friend.digest, None)
+
+    def buckets_for(self, friend):
+        buckets = [self.friend_buckets.get(friend.digest), self.bucket]
+        return [bucket for bucket in buckets if bucket]
+
+    def record(self, friend, amount):
+        self.meter.record(amount)
+        if friend.digest not in self.friend_meters:
+            self.friend_meters[friend.digest] = RateMeter()
+        self.friend_meters[friend.digest].record(amount)
+
+    def stats(self):
+        return {
+            "rate": self.meter.rate(),
+            "limit": self.bucket.rate if self.bucket else None,
+            "friends": {
+                digest: {
+                    "rate": meter.rate(),
+                    "limit": self.friend_buckets[digest].rate
+                    if digest in self.friend_buckets
+                    else None,
+                }
+                for digest, meter in self.friend_meters.items()
+            },
+        }
@@ -31,6 +31,9 @@ class Tor:
         return "tor"
 
     async def start(self):
+        # a restarted Tor may listen on another SOCKS port
+        if self.socks_port_result.done():
+            self.socks_port_result = asyncio.Future()
         loop = asyncio.get_running_loop()
         await loop.run_in_executor(None, self._start)
 
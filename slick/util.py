@@ -1,7 +1,17 @@
+import re
 import socket
 
+size_units = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
 
 def find_free_port():
     s = socket.socket()
     s.bind(("", 0))  # Bind to a free port provided by the host.
     return s.getsockname()[1]  # Return the port number assigned.
+
+
+def parse_size(text):
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*", text.lower())
+    if not match:
+        raise ValueError(f"cannot parse {text} as a size")
+    return int(float(match.group(1)) * size_units[match.group(2)])
@@ -0,0 +1,240 @@
+import os
+import sys
+import mmap
+import time
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from aiofile import AIOFile
+
+default_writer = "pwrite"
+write_threads = 4
+coalesce_size = 8 * 1024 ** 2
+max_buffered = 32 * 1024 ** 2
+max_buffers = 512
+
+
+def preallocate(path, size):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # fallocate reserves the blocks up front so parallel out of order
+        # writes do not fragment the target, truncate is the portable fallback
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except OSError:
+                os.ftruncate(fd, size)
+        else:
+            os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+class AIOWriter:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.fh = None
+
+    async def open(self):
+        self.fh = AIOFile(self.path, "r+b")
+        await self.fh.open()
+
+    async def write(self, data, offset, release=None):
+        try:
+            await self.fh.write(bytes(data), offset=offset)
+        finally:
+            if release:
+                release()
+
+    async def flush(self):
+        pass
+
+    async def fsync(self):
+        await self.fh.fsync()
+
+    async def close(self):
+        await self.fsync()
+        await self.fh.close()
+
+
+class PwriteWriter:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.fd = None
+        self.pool = None
+        self.runs = {}
+        self.buffered = 0
+        self.in_flight = set()
+
+    async def open(self):
+        self.fd = os.open(self.path, os.O_RDWR)
+        self.pool = ThreadPoolExecutor(max_workers=write_threads)
+
+    async def write(self, data, offset, release=None):
+        # adjacent ranges are merged into one run and written with a single
+        # pwritev once it is large enough, pooled buffers are handed back
+        # through release once their run is on disk
+        run = self.runs.pop(offset, None)
+        if run:
+            run_offset, buffers, length, releases = run
+        else:
+            run_offset, buffers, length, releases = offset, [], 0, []
+        buffers.append(data)
+        length += len(data)
+        self.buffered += len(data)
+        if release:
+            releases.append(release)
+
+        if length >= coalesce_size or len(buffers) >= max_buffers:
+            self._dispatch(run_offset, buffers, length, releases)
+        else:
+            self.runs[run_offset + length] = (run_offset, buffers, length, releases)
+        if self.buffered >= max_buffered:
+            await self.flush()
+        if self.in_flight:
+            await self._reap()
+
+    def _dispatch(self, offset, buffers, length, releases):
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self.pool, self._pwritev, offset, buffers)
+        self.in_flight.add(future)
+        future.add_done_callback(lambda _: self._written(length, releases))
+
+    def _written(self, length, releases):
+        self.buffered -= length
+        for release in releases:
+            release()
+
+    def _pwritev(self, offset, buffers):
+        if not hasattr(os, "pwritev"):
+            for data in buffers:
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(self.fd, view, offset)
+                    offset += written
+                    view = view[written:]
+            return
+        while buffers:
+            written = os.pwritev(self.fd, buffers, offset)
+            offset += written
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers = buffers[1:]
+            if buffers and written:
+                buffers = [memoryview(buffers[0])[written:]] + buffers[1:]
+
+    async def _reap(self):
+        done = {f for f in self.in_flight if f.done()}
+        self.in_flight -= done
+        for future in done:
+            future.result()
+
+    async def flush(self):
+        runs, self.runs = self.runs, {}
+        for offset, buffers, length, releases in runs.values():
+            self._dispatch(offset, buffers, length, releases)
+        # writes stay in in_flight until they are done, so a flush running
+        # alongside this one waits for them too
+        in_flight = set(self.in_flight)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+            self.in_flight -= in_flight
+
+    async def fsync(self):
+        await self.flush()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.pool, os.fsync, self.fd)
+
+    async def close(self):
+        try:
+            await self.fsync()
+        finally:
+            self.pool.shutdown(wait=True)
+            os.close(self.fd)
+
+
+class MmapWriter:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.fd = None
+        self.map = None
+
+    async def open(self):
+        self.fd = os.open(self.path, os.O_RDWR)
+        if self.size:
+            self.map = mmap.mmap(self.fd, self.size)
+
+    async def write(self, data, offset, release=None):
+        # page faults on a cold mapping block, so copies run off the loop
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._copy, data, offset)
+        finally:
+            if release:
+                release()
+
+    async def flush(self):
+        pass
+
+    def _copy(self, data, offset):
+        self.map[offset : offset + len(data)] = data
+
+    async def fsync(self):
+        if self.map:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self.map.flush)
+
+    async def close(self):
+        try:
+            await self.fsync()
+        finally:
+            if self.map:
+                self.map.close()
+            os.close(self.fd)
+
+
+writers = {"aio": AIOWriter, "pwrite": PwriteWriter, "mmap": MmapWriter}
+
+
+async def open_writer(kind, path, size, create):
+    if create:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, preallocate, path, size)
+    writer = writers[kind](path, size)
+    await writer.open()
+    return writer
+
+
+async def benchmark(size, piece_size=1_048_576, concurrency=16):
+    data = os.urandom(piece_size)
+    offsets = list(range(0, size, piece_size))
+    # interleave the offsets the way striped workers deliver them
+    offsets = offsets[0::2] + offsets[1::2]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in writers:
+            path = os.path.join(directory, kind)
+            start = time.monotonic()
+            writer = await open_writer(kind, path, size, True)
+            queue = list(offsets)
+
+            async def work():
+                while queue:
+                    offset = queue.pop()
+                    await writer.write(data[: min(piece_size, size - offset)], offset)
+
+            await asyncio.gather(*[work() for _ in range(concurrency)])
+            await writer.close()
+            results[kind] = size / (time.monotonic() - start)
+            os.remove(path)
+    return results
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 512 * 1024 ** 2
+    loop = asyncio.get_event_loop()
+    for kind, rate in loop.run_until_complete(benchmark(size)).items():
+        print(f"{kind:8} {rate / 1024 ** 2:10.1f} MiB/s")
@@ -0,0 +1,36 @@
+from slick.metadata import MetadataCache
+from slick.swarm import Swarm
+from slick.chunk_store import ChunkStore
+
+
+class FakeFriend:
+    def __init__(self, onion):
+        self.onion = onion
+        self.digest = onion.encode()
+        self.name = onion
+
+
+class FakeFriendList:
+    def __init__(self, friends):
+        self._friends = friends
+
+    def friends(self):
+        return self._friends
+
+    def get_friend_for_onion(self, onion):
+        for friend in self._friends:
+            if friend.onion == onion:
+                return friend
+
+
+class FakeApp:
+    def __init__(self, base, friends):
+        self.base = base
+        self.metadata = MetadataCache()
+        self.friend_list = FakeFriendList(friends)
+        self.chunk_store = ChunkStore(self)
+        self.swarm = Swarm(self)
+        self.received = []
+
+    async def handle_incoming_message(self, message):
+        self.received.append(message.data)
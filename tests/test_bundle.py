@@ -0,0 +1,90 @@
+import os
+import stat
+import asyncio
+import pytest
+from slick.bencode import BundleListing
+from slick.bundle import Bundle, BundleReader, check_path, open_bundle_writer
+
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, "sub", "empty"))
+    files = {"a.txt": b"alpha", "sub/b.bin": os.urandom(3000), "sub/c": b""}
+    for name, data in files.items():
+        with open(os.path.join(root, *name.split("/")), "wb") as fh:
+            fh.write(data)
+    os.chmod(os.path.join(root, "a.txt"), 0o444)
+    os.symlink("/etc/passwd", os.path.join(root, "link"))
+    return files
+
+
+def listing(entries, directories=()):
+    return BundleListing.encode({"entries": entries, "directories": list(directories)})
+
+
+def test_scan_lists_regular_files_in_order(tmp_path):
+    root = str(tmp_path / "tree")
+    files = make_tree(root)
+    bundle = Bundle.scan(root)
+
+    assert [e.path for e in bundle.entries] == [b"a.txt", b"sub/b.bin", b"sub/c"]
+    assert bundle.directories == [b"sub", b"sub/empty"]
+    assert bundle.size == sum(len(data) for data in files.values())
+    assert Bundle.decode(bundle.encode()).encode() == bundle.encode()
+
+
+@pytest.mark.parametrize(
+    "path", [b"../x", b"/etc/passwd", b"a/../../x", b"..", b".", b"a/../.."]
+)
+def test_paths_leaving_the_bundle_are_rejected(path):
+    with pytest.raises(ValueError):
+        check_path(path)
+
+
+def test_inner_paths_are_normalized():
+    assert check_path(b"a/./b//c") == b"a/b/c"
+    assert check_path(b"a/../b") == b"b"
+
+
+def test_decode_rejects_an_escaping_directory():
+    with pytest.raises(ValueError):
+        Bundle.decode(listing([], [b"../outside"]))
+
+
+def test_decode_keeps_only_permission_bits():
+    data = listing([{"path": b"run", "size": 1, "mode": 0o4755 | 0o2000 | 0o1000}])
+
+    assert Bundle.decode(data).entries[0].mode == 0o755
+
+
+def test_read_only_files_are_written_then_given_their_mode(tmp_path):
+    source = str(tmp_path / "tree")
+    files = make_tree(source)
+    bundle = Bundle.decode(Bundle.scan(source).encode())
+    target = str(tmp_path / "copy")
+    reader = BundleReader(source, bundle)
+
+    async def run():
+        writer = await open_bundle_writer(target, bundle, True)
+        await writer.write(reader.read(bundle.size), 0)
+        await writer.close()
+
+    asyncio.run(run())
+    reader.close()
+    for name, data in files.items():
+        path = os.path.join(target, *name.split("/"))
+        assert open(path, "rb").read() == data
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+    bundle.apply_modes(target)
+    assert stat.S_IMODE(os.stat(os.path.join(target, "a.txt")).st_mode) == 0o444
+    assert os.path.isdir(os.path.join(target, "sub", "empty"))
+    assert not os.path.lexists(os.path.join(target, "link"))
+
+
+def test_spans_split_a_range_over_files(tmp_path):
+    root = str(tmp_path / "tree")
+    make_tree(root)
+    bundle = Bundle.scan(root)
+    spans = [(e.path, offset, length) for e, offset, length in bundle.spans(3, 10)]
+
+    assert spans == [(b"a.txt", 3, 2), (b"sub/b.bin", 0, 5)]
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import pytest
+from slick.certificate import Certificate
+
+
+class FakeIdentity:
+    def __init__(self, name):
+        self._name = name
+
+    async def name(self):
+        return self._name
+
+    async def service_host(self):
+        return f"{self._name}.onion"
+
+
+class FakeApp:
+    def __init__(self, base, name):
+        self.base = base
+        self.identity = FakeIdentity(name)
+
+
+class FakeFriend:
+    def __init__(self, cert):
+        self.cert = cert
+        self.digest = hashlib.sha256(cert.encode()).digest()
+
+
+def new_certificate(tmp_path, name):
+    base = tmp_path / name
+    base.mkdir()
+
+    async def run():
+        certificate = Certificate(FakeApp(str(base), name))
+        await certificate.start()
+        return certificate, FakeFriend((await certificate.public_cert_bytes()).decode())
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(scope="module")
+def peers(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("certificates")
+    return new_certificate(tmp_path, "alice"), new_certificate(tmp_path, "bob")
+
+
+def test_client_contexts_are_cached_per_friend(peers):
+    (alice, _), (_, bob) = peers
+    context = alice.client_context(bob)
+
+    assert alice.client_context(bob) is context
+    alice.forget(bob)
+    assert alice.client_context(bob) is not context
+
+
+def test_server_context_is_rebuilt_only_when_a_friend_goes(peers):
+    (alice, _), (_, bob) = peers
+    context = alice.server_context([bob])
+
+    assert alice.server_context([bob]) is context
+    assert bob.digest in alice.trusted
+    alice.forget(bob)
+    assert alice.server_context([bob]) is not context
+
+
+def connect_twice(server, client):
+    async def run():
+        async def echo(reader, writer):
+            writer.write(await reader.read(1))
+            await writer.drain()
+            writer.close()
+
+        listener = await asyncio.start_server(echo, "127.0.0.1", 0, ssl=server)
+        port = listener.sockets[0].getsockname()[1]
+        protocols = []
+        for _ in range(2):
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", port, ssl=client
+            )
+            writer.write(b"x")
+            assert await reader.read(1) == b"x"
+            protocols.append(
+                writer.get_extra_info("ssl_object").selected_alpn_protocol()
+            )
+            writer.close()
+        listener.close()
+        await listener.wait_closed()
+        return protocols
+
+    return asyncio.run(run())
+
+
+def test_reconnect_resumes_the_tls_session(peers):
+    (alice, alice_friend), (bob, bob_friend) = peers
+    server = alice.server_context([bob_friend])
+    client = bob.client_context(alice_friend)
+    connect_twice(server, client)
+
+    assert client.handshakes == 2
+    assert client.resumed == 1
+    assert bob.session_stats()["client"]["resumed"] == 1
+
+
+def test_both_ends_negotiate_http_1_1(peers):
+    (alice, alice_friend), (bob, bob_friend) = peers
+    server = alice.server_context([bob_friend])
+    client = bob.client_context(alice_friend)
+
+    assert connect_twice(server, client) == ["http/1.1", "http/1.1"]
@@ -0,0 +1,147 @@
+import asyncio
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from slick import channel as channel_module
+from slick.bencode import ChannelFrame
+from slick.channel import Channel, channel_path
+from slick.server import TalkServer
+from fakes import FakeApp, FakeFriend
+
+
+class HeaderTalkServer(TalkServer):
+    def common_name(self, request):
+        return request.headers["X-Onion"]
+
+
+async def serve(friend):
+    app = FakeApp(None, [friend])
+    talk = HeaderTalkServer(app)
+    web_app = web.Application()
+    web_app.add_routes([web.get(channel_path, talk.handle_channel)])
+    server = TestServer(web_app)
+    await server.start_server()
+    return app, talk, server
+
+
+def frame(*seqs):
+    return ChannelFrame.encode(
+        {
+            "ack": 0,
+            "messages": [
+                {"seq": seq, "content_type": b"text/plain", "data": str(seq).encode()}
+                for seq in seqs
+            ],
+        }
+    )
+
+
+async def exchange(server, onion, frames, session="s"):
+    acks = []
+    async with aiohttp.ClientSession(headers={"X-Onion": onion}) as client:
+        ws = await client.ws_connect(
+            server.make_url(f"{channel_path}?session={session}")
+        )
+        for data in frames:
+            await ws.send_bytes(data)
+            msg = await ws.receive()
+            acks.append(ChannelFrame.decode(msg.data)["ack"])
+        await ws.close()
+    return acks
+
+
+def test_resent_messages_are_delivered_once():
+    async def run():
+        app, _, server = await serve(FakeFriend("friend"))
+        try:
+            first = await exchange(server, "friend", [frame(1, 2)])
+            # the channel broke before the ack arrived, so both go out again
+            second = await exchange(server, "friend", [frame(1, 2, 3)])
+        finally:
+            await server.close()
+        return first, second, app.received
+
+    assert asyncio.run(run()) == ([2], [3], [b"1", b"2", b"3"])
+
+
+def test_a_gap_in_the_numbering_does_not_drop_the_next_message():
+    async def run():
+        app, _, server = await serve(FakeFriend("friend"))
+        try:
+            acks = await exchange(server, "friend", [frame(1), frame(3), frame(3)])
+        finally:
+            await server.close()
+        return acks, app.received
+
+    assert asyncio.run(run()) == ([1, 3, 3], [b"1", b"3"])
+
+
+def test_sessions_are_numbered_apart():
+    async def run():
+        app, _, server = await serve(FakeFriend("friend"))
+        try:
+            await exchange(server, "friend", [frame(1)], session="old")
+            acks = await exchange(server, "friend", [frame(1)], session="new")
+        finally:
+            await server.close()
+        return acks, app.received
+
+    assert asyncio.run(run()) == ([1], [b"1", b"1"])
+
+
+def test_unknown_peer_cannot_open_a_channel():
+    async def run():
+        app, _, server = await serve(FakeFriend("friend"))
+        try:
+            await exchange(server, "stranger", [frame(1)])
+        except aiohttp.WSServerHandshakeError as e:
+            return e.status, app.received
+        finally:
+            await server.close()
+
+    assert asyncio.run(run()) == (404, [])
+
+
+class Unreachable:
+    active = False
+
+
+class FakeChannelFriend(FakeFriend):
+    def connection(self):
+        return Unreachable()
+
+
+def test_a_message_that_never_went_out_keeps_its_number(monkeypatch):
+    monkeypatch.setattr(channel_module, "ack_timeout", 0.01)
+
+    async def run():
+        channel = Channel(FakeChannelFriend("friend"))
+        sent = await channel.send("text/plain", b"lost")
+        channel.task.cancel()
+        asyncio.ensure_future(channel.send("text/plain", b"kept"))
+        await asyncio.sleep(0)
+        channel.task.cancel()
+        return sent, ChannelFrame.decode(channel.frame())["messages"]
+
+    sent, messages = asyncio.run(run())
+    assert sent is False
+    assert [(m["seq"], m["data"]) for m in messages] == [(2, b"kept")]
+
+
+def test_acks_are_cumulative():
+    async def run():
+        channel = Channel(FakeChannelFriend("friend"))
+        sends = [
+            asyncio.ensure_future(channel.send("text/plain", data))
+            for data in (b"1", b"2", b"3")
+        ]
+        await asyncio.sleep(0)
+        channel.task.cancel()
+        channel.frame()
+        channel.acked(2)
+        results = await asyncio.gather(*sends[:2])
+        pending = list(channel.unacked)
+        sends[2].cancel()
+        return results, pending
+
+    assert asyncio.run(run()) == ([True, True], [3])
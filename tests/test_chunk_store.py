@@ -0,0 +1,79 @@
+import os
+import asyncio
+from slick.chunk_store import ChunkStore
+from slick.manifest import hash_chunk
+
+
+class FakeApp:
+    def __init__(self, base):
+        self.base = base
+
+
+def new_store(tmp_path, max_size=1024 ** 2):
+    store = ChunkStore(FakeApp(str(tmp_path)), max_size=max_size)
+    asyncio.run(store.start())
+    return store
+
+
+def put(store, data):
+    digest = hash_chunk(data)
+    store.put(digest, data)
+    return digest
+
+
+def test_put_and_get(tmp_path):
+    store = new_store(tmp_path)
+    digest = put(store, b"hello")
+
+    assert store.has(digest)
+    assert store.get(digest) == b"hello"
+    assert store.size == 5
+    assert store.get(hash_chunk(b"other")) is None
+
+
+def test_same_chunk_is_counted_once(tmp_path):
+    store = new_store(tmp_path)
+    digest = hash_chunk(b"hello")
+    # two downloads fetching the same chunk both start writing it
+    first, second = store.open(digest), store.open(digest)
+    for chunk in (first, second):
+        chunk.write(b"hello")
+        chunk.commit()
+
+    assert store.size == 5
+    assert os.listdir(os.path.dirname(first.path)) == [os.path.basename(first.path)]
+
+
+def test_least_recently_used_chunks_are_evicted(tmp_path):
+    store = new_store(tmp_path, max_size=3500)
+    first = put(store, b"a" * 1000)
+    second = put(store, b"b" * 1000)
+    third = put(store, b"c" * 1000)
+    store.get(first)
+    put(store, b"d" * 1000)
+
+    assert store.has(first)
+    assert not store.has(second)
+    assert not os.path.exists(store.chunk_path(second))
+    assert store.has(third)
+    assert store.size == 3000
+
+
+def test_index_is_rebuilt_on_start(tmp_path):
+    store = new_store(tmp_path)
+    digest = put(store, b"hello")
+    restarted = new_store(tmp_path)
+
+    assert restarted.has(digest)
+    assert restarted.size == 5
+
+
+def test_corrupt_chunk_is_dropped(tmp_path):
+    store = new_store(tmp_path)
+    digest = put(store, b"hello")
+    with open(store.chunk_path(digest), "wb") as fh:
+        fh.write(b"jello")
+
+    assert store.get(digest) is None
+    assert not store.has(digest)
+    assert store.size == 0
@@ -0,0 +1,106 @@
+import asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from slick.client_pool import ClientPool, direct_transport, occupancy, tor_transport
+
+
+class FakeTor:
+    def __init__(self, port):
+        self.port = port
+
+    async def socks_port(self):
+        return self.port
+
+
+class FakeApp:
+    def __init__(self, port=9050):
+        self.tor = FakeTor(port)
+
+
+def test_sessions_are_shared_per_transport_and_kind():
+    async def run():
+        pool = ClientPool(FakeApp())
+        try:
+            bulk = await pool.session(direct_transport)
+            again = await pool.session(direct_transport)
+            interactive = await pool.session(direct_transport, interactive=True)
+            return bulk is again, bulk is interactive, interactive.connector
+        finally:
+            await pool.stop()
+
+    shared, mixed, connector = asyncio.run(run())
+    assert shared and not mixed
+    assert connector.limit_per_host == 2
+
+
+def test_tor_session_follows_the_socks_port():
+    async def run():
+        app = FakeApp(9050)
+        pool = ClientPool(app)
+        try:
+            first = await pool.session(tor_transport)
+            same = await pool.session(tor_transport)
+            app.tor.port = 9100
+            moved = await pool.session(tor_transport)
+            return first, same, moved
+        finally:
+            await pool.stop()
+
+    first, same, moved = asyncio.run(run())
+    assert first is same
+    assert moved is not first
+    assert first.closed
+
+
+def test_stats_report_occupancy():
+    async def run():
+        pool = ClientPool(FakeApp(), limit=10, limit_per_host=3)
+        try:
+            await pool.session(direct_transport)
+            return pool.stats()
+        finally:
+            await pool.stop()
+
+    stats = asyncio.run(run())
+    assert stats[direct_transport] == {
+        "active": 0,
+        "idle": 0,
+        "limit": 10,
+        "limit_per_host": 3,
+    }
+
+
+def test_occupancy_survives_a_connector_without_the_private_fields():
+    assert occupancy(object()) == {"active": None, "idle": None}
+
+
+async def ok(request):
+    return web.Response()
+
+
+def test_requests_hear_when_they_have_a_socket():
+    async def run():
+        web_app = web.Application()
+        web_app.add_routes([web.get("/", ok)])
+        server = TestServer(web_app)
+        await server.start_server()
+        pool = ClientPool(FakeApp())
+        connected = []
+        try:
+            session = await pool.session(direct_transport)
+            for _ in range(2):
+                async with session.get(
+                    server.make_url("/"),
+                    trace_request_ctx=lambda: connected.append(True),
+                ) as resp:
+                    await resp.read()
+            # requests without a callback are left alone
+            async with session.get(server.make_url("/")) as resp:
+                await resp.read()
+        finally:
+            await pool.stop()
+            await server.close()
+        return len(connected)
+
+    # the first request opens a socket, the second reuses it
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,82 @@
+import os
+import asyncio
+import pytest
+from slick.compression import (
+    FrameReader,
+    compressible,
+    encode_frame,
+    frame_header,
+    is_deflated,
+    raw_frame,
+    worth_trying,
+)
+
+
+class Stream:
+    def __init__(self, data, piece=7):
+        self.data = data
+        self.piece = piece
+
+    async def read(self, n):
+        out = self.data[: min(n, self.piece)]
+        self.data = self.data[len(out) :]
+        return out
+
+
+def read_all(data, n=1000, piece=7):
+    async def run():
+        reader = FrameReader(Stream(data, piece))
+        parts = []
+        while True:
+            part = await reader.read(n)
+            if not part:
+                return b"".join(parts)
+            assert len(part) <= n
+            parts.append(part)
+
+    return asyncio.run(run())
+
+
+def test_mixed_frames_decode_in_order():
+    text = b"hello world " * 5000
+    noise = os.urandom(10000)
+    frames = [encode_frame(text), encode_frame(noise), encode_frame(text, False)]
+
+    assert is_deflated(frames[0])
+    assert not is_deflated(frames[1])
+    assert read_all(b"".join(frames)) == text + noise + text
+
+
+def test_stream_cut_inside_a_frame_is_an_error():
+    frame = encode_frame(os.urandom(1000))
+    with pytest.raises(IOError):
+        read_all(frame[:-10])
+
+
+def test_stream_cut_inside_a_deflated_frame_is_an_error():
+    frame = encode_frame(b"a" * 100_000)
+    with pytest.raises(IOError):
+        read_all(frame[:-3])
+
+
+def test_stream_cut_inside_a_header_is_an_error():
+    with pytest.raises(IOError):
+        read_all(encode_frame(b"abc") + frame_header.pack(raw_frame, 5)[:2])
+
+
+def test_unknown_frame_kind_is_an_error():
+    with pytest.raises(IOError):
+        read_all(frame_header.pack(7, 1) + b"x")
+
+
+def test_only_plausibly_compressible_types_are_deflated():
+    assert compressible("text/plain")
+    assert compressible("image/bmp")
+    assert not compressible("image/png")
+    assert not compressible("application/zip")
+
+
+def test_incompressible_runs_are_only_probed():
+    assert worth_trying(0)
+    assert not worth_trying(5)
+    assert worth_trying(16)
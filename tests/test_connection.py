@@ -0,0 +1,104 @@
+import os
+import asyncio
+import pytest
+import typed_bencode
+from slick.bencode import File, file_version
+from slick.connection import BaseConnection, inline_content, inline_size, read_offer
+from slick.manifest import Manifest
+from slick.metadata import MetadataCache
+
+
+class FakeOffer:
+    url = "/f/abc"
+
+
+class FakeApp:
+    def __init__(self):
+        self.metadata = MetadataCache()
+
+    def offer_file(self, friend, path, metadata):
+        return FakeOffer()
+
+
+def offer(tmp_path, size):
+    path = str(tmp_path / "file")
+    with open(path, "wb") as fh:
+        fh.write(os.urandom(size))
+    connection = BaseConnection(FakeApp(), None)
+    return read_offer(asyncio.run(connection.offer_data(path))), path
+
+
+@pytest.mark.parametrize("size", [0, 1, inline_size])
+def test_small_files_are_carried_inline(tmp_path, size):
+    file, path = offer(tmp_path, size)
+
+    assert file["inline"]
+    assert file["content"] == open(path, "rb").read()
+    assert inline_content(file) == file["content"]
+
+
+def test_larger_files_are_not_carried_inline(tmp_path):
+    file, _ = offer(tmp_path, inline_size + 1)
+
+    assert not file["inline"]
+    assert file["content"] == b""
+
+
+def inline_file(data, **overrides):
+    manifest = Manifest.for_content(data)
+    file = {
+        "size": len(data),
+        "root": manifest.root,
+        "chunk_size": manifest.chunk_size,
+        "content": data,
+    }
+    file.update(overrides)
+    return file
+
+
+def test_inline_content_of_the_wrong_size_is_rejected():
+    content = os.urandom(1024)
+
+    assert inline_content(inline_file(content, size=1000)) is None
+
+
+def test_inline_content_with_the_wrong_hash_is_rejected():
+    content = os.urandom(1024)
+    file = inline_file(content, content=bytes(1024))
+
+    assert inline_content(file) is None
+    assert inline_content(inline_file(content)) == content
+
+
+def test_offers_carry_the_protocol_version(tmp_path):
+    file, _ = offer(tmp_path, 1)
+
+    assert file["version"] == file_version
+
+
+def test_version_1_offers_are_still_read():
+    version_1 = typed_bencode.for_dict(url=str, size=int, type=str, name=str)
+    data = version_1.encode(
+        {"url": "/f/abc", "size": 3, "type": "text/plain", "name": "a"}
+    )
+
+    assert read_offer(data)["url"] == "/f/abc"
+
+
+def test_offers_from_a_newer_version_are_refused():
+    newer = File.encode(
+        {
+            "version": file_version + 1,
+            "url": "/f/abc",
+            "size": 3,
+            "type": "text/plain",
+            "name": "a",
+        }
+    )
+    unknown_key = typed_bencode.for_dict(url=str, extra=int).encode(
+        {"url": "/f/abc", "extra": 1}
+    )
+
+    for data in (newer, unknown_key, b"garbage"):
+        with pytest.raises(ValueError):
+            read_offer(data)
@@ -0,0 +1,42 @@
+from slick.controller import TransferController
+
+
+def fast_round(controller, elapsed=0.1):
+    for _ in range(controller.concurrency):
+        controller.record(controller.range_size, elapsed)
+
+
+def test_grows_while_latency_holds():
+    controller = TransferController(1024)
+    fast_round(controller)
+
+    assert controller.concurrency == 5
+    assert controller.blocks == 5
+
+
+def test_range_stops_growing_past_the_target_time():
+    controller = TransferController(1024, target_time=1.0)
+    fast_round(controller, elapsed=1.5)
+
+    assert controller.concurrency == 5
+    assert controller.blocks == 4
+
+
+def test_backs_off_when_latency_climbs():
+    controller = TransferController(1024)
+    fast_round(controller)
+    for _ in range(controller.concurrency):
+        controller.record(1024, 1.0)
+
+    assert controller.concurrency == 2
+    assert controller.blocks == 2
+
+
+def test_failure_halves_down_to_one():
+    controller = TransferController(1024, blocks=2, concurrency=2)
+    for _ in range(3):
+        controller.record_failure()
+
+    assert controller.concurrency == 1
+    assert controller.blocks == 1
+    assert controller.failures == 3
@@ -0,0 +1,97 @@
+import os
+import random
+import pytest
+from slick import delta
+from slick.bencode import DeltaSignature
+
+
+def write(path, data):
+    with open(path, "wb") as fh:
+        fh.write(data)
+    return str(path)
+
+
+def apply(basis, delta_data, new_size, chunk_size):
+    copies = delta.copies(delta_data)
+    blocks = delta.covered_blocks(copies, chunk_size, new_size)
+    patch = delta.Patch(basis, copies)
+    try:
+        return {
+            index: patch.read(
+                index * chunk_size, min(new_size, (index + 1) * chunk_size)
+            )
+            for index in blocks
+        }
+    finally:
+        patch.close()
+
+
+def test_insert_reuses_the_shifted_blocks(tmp_path):
+    rng = random.Random(1)
+    old = bytes(rng.getrandbits(8) for _ in range(512 * 1024))
+    new = old[:100_000] + b"inserted" + old[100_000:]
+    basis = write(tmp_path / "old", old)
+    target = write(tmp_path / "new", new)
+
+    signature = delta.signature(basis, len(old))
+    result = delta.compute_delta(target, signature)
+    chunk_size = 16 * 1024
+    blocks = apply(basis, result, len(new), chunk_size)
+
+    assert len(blocks) >= len(new) // chunk_size - 3
+    for index, data in blocks.items():
+        assert data == new[index * chunk_size : (index + 1) * chunk_size]
+
+
+def test_unrelated_file_gives_no_delta(tmp_path):
+    basis = write(tmp_path / "old", os.urandom(256 * 1024))
+    target = write(tmp_path / "new", os.urandom(256 * 1024))
+    signature = delta.signature(basis, 256 * 1024)
+
+    assert delta.compute_delta(target, signature) is None
+
+
+@pytest.mark.parametrize("prefix, found", [(64 * 1024, True), (320 * 1024, False)])
+def test_scan_gives_up_once_the_unmatched_budget_is_spent(tmp_path, prefix, found):
+    old = os.urandom(2 * 1024 ** 2)
+    # well short of half the file, but the prefix alone may exhaust the budget
+    new = os.urandom(prefix) + old
+    basis = write(tmp_path / "old", old)
+    target = write(tmp_path / "new", new)
+    signature = delta.signature(basis, len(old))
+
+    assert prefix < len(new) // 2
+    assert (delta.compute_delta(target, signature) is not None) == found
+
+
+def test_rolling_checksum_matches_a_fresh_one():
+    data = os.urandom(8192)
+    block_size = 4096
+    weak = delta.zlib.adler32(data[:block_size])
+    for pos in range(1, 100):
+        weak = delta.roll(weak, data[pos - 1], data[pos - 1 + block_size], block_size)
+        assert weak == delta.zlib.adler32(data[pos : pos + block_size])
+
+
+@pytest.mark.parametrize(
+    "block_size", [0, -1, delta.min_block_size - 1, delta.max_block_size * 2]
+)
+def test_out_of_range_block_size_is_rejected(tmp_path, block_size):
+    target = write(tmp_path / "new", os.urandom(64 * 1024))
+    record = delta.checksum_format.pack(1, bytes(16))
+    signature = DeltaSignature.encode({"block_size": block_size, "checksums": record})
+    with pytest.raises(ValueError):
+        delta.compute_delta(target, signature)
+
+
+def test_partial_checksum_record_is_rejected(tmp_path):
+    target = write(tmp_path / "new", os.urandom(64 * 1024))
+    signature = DeltaSignature.encode({"block_size": 4096, "checksums": b"\0" * 21})
+    with pytest.raises(ValueError):
+        delta.compute_delta(target, signature)
+
+
+def test_garbage_signature_is_rejected(tmp_path):
+    target = write(tmp_path / "new", os.urandom(64 * 1024))
+    with pytest.raises(ValueError):
+        delta.compute_delta(target, b"not bencode")
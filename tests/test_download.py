@@ -0,0 +1,382 @@
+import os
+import time
+import asyncio
+from functools import partial
+from contextlib import asynccontextmanager
+import pytest
+from slick.journal import Journal
+from slick.controller import TransferController
+from slick import download as download_module
+from slick.download import BlockCheck, Download, Path, max_failures
+from slick.manifest import Manifest
+from slick.chunk_store import ChunkStore
+from slick.scheduler import TransferScheduler
+from slick.swarm import Swarm
+from slick.client_pool import ClientPool
+from slick.bundle import Bundle, BundleReader, bundle_type
+
+
+class Body:
+    def __init__(self, data):
+        self.data = data
+
+    async def read(self, n):
+        await asyncio.sleep(0)
+        out, self.data = self.data[:n], self.data[n:]
+        return out
+
+
+class FakeApp:
+    def __init__(self, base):
+        self.base = base
+        self.writer = "pwrite"
+        self.chunk_store = ChunkStore(self)
+        self.scheduler = TransferScheduler(self)
+        self.swarm = Swarm(self)
+        self.client_pool = ClientPool(self)
+        self.friend_list = self
+
+    def friends(self):
+        return []
+
+
+class FakeConnection:
+    def __init__(
+        self, data, manifest=None, fail_after=None, corrupt=0, stall_after=None
+    ):
+        self.data = data
+        self.manifest = manifest
+        self.fail_after = fail_after
+        self.stall_after = stall_after
+        self.corrupt = corrupt
+        self.active = True
+        self.last_seen = 0
+        self.ranges = 0
+
+    def __str__(self):
+        return "fake"
+
+    async def get_manifest(self, url):
+        return self.manifest.encode()
+
+    async def get_bundle(self, url):
+        return self.bundle.encode()
+
+    @asynccontextmanager
+    async def open_file(self, url, range=None, connected=None):
+        await asyncio.sleep(0)
+        if self.fail_after is not None and self.ranges >= self.fail_after:
+            self.active = False
+            raise IOError("connection lost")
+        if self.stall_after is not None and self.ranges >= self.stall_after:
+            await asyncio.sleep(3600)
+        self.ranges += 1
+        if connected:
+            connected()
+        data = self.data[range[0] : range[1]]
+        if self.corrupt:
+            self.corrupt -= 1
+            data = bytes(len(data))
+        yield Body(data)
+
+
+class FakeFriend:
+    def __init__(self, app, connections):
+        self.app = app
+        self.connections = connections
+
+    def active_connections(self):
+        return [c for c in self.connections if c.active]
+
+
+def new_download(tmp_path, data, chunk_size=64 * 1024, manifest=None, **kwargs):
+    app = FakeApp(str(tmp_path / "base"))
+    connection = FakeConnection(data, manifest, **kwargs)
+    journal = Journal(
+        str(tmp_path / "target"),
+        url="/f/abc",
+        size=len(data),
+        type="file",
+        name="target",
+        friend=b"\x01" * 32,
+        chunk_size=manifest.chunk_size if manifest else chunk_size,
+        root=manifest.root if manifest else b"",
+    )
+    return app, connection, Download(FakeFriend(app, [connection]), journal)
+
+
+async def run(app, download):
+    await app.chunk_store.start()
+    return await download.run()
+
+
+def test_download_batches_journal_flushes(tmp_path):
+    data = os.urandom(4 * 1024 ** 2)
+    app, connection, download = new_download(tmp_path, data)
+    flushes = []
+    original = download.journal.flush
+
+    async def flush(fh=None):
+        flushes.append(fh)
+        await original(fh)
+
+    download.journal.flush = flush
+    assert asyncio.run(run(app, download))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert not os.path.exists(download.journal.path)
+    # one flush up front, none of the ranges needed a sync of their own
+    assert connection.ranges > 1
+    assert flushes == [None]
+
+
+def test_interrupted_download_records_what_is_on_disk(tmp_path):
+    data = os.urandom(4 * 1024 ** 2)
+    app, connection, download = new_download(tmp_path, data, fail_after=3)
+    with pytest.raises(IOError):
+        asyncio.run(run(app, download))
+
+    journal = Journal.load(download.journal.target)
+    done = [i for i in range(journal.chunk_count) if journal.is_complete(i)]
+    assert done and len(done) < journal.chunk_count
+    with open(journal.target, "rb") as fh:
+        for index in done:
+            start, end = journal.byte_range(index)
+            fh.seek(start)
+            assert fh.read(end - start) == data[start:end]
+
+
+def test_corrupt_ranges_are_rejected_and_fetched_again(tmp_path):
+    data = os.urandom(2 * 1024 ** 2)
+    manifest = Manifest.for_content(data)
+    app, connection, download = new_download(
+        tmp_path, data, manifest=manifest, corrupt=1
+    )
+    assert asyncio.run(run(app, download))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert download.corrupt > 0
+
+
+def test_manifest_must_match_the_offered_root(tmp_path):
+    data = os.urandom(1024 ** 2)
+    app, connection, download = new_download(
+        tmp_path, data, manifest=Manifest.for_content(data)
+    )
+    connection.manifest = Manifest.for_content(os.urandom(1024 ** 2))
+    with pytest.raises(IOError):
+        asyncio.run(run(app, download))
+
+
+def test_pieces_are_read_while_earlier_ones_hash(tmp_path, monkeypatch):
+    data = os.urandom(2 * 1024 ** 2)
+    manifest = Manifest.for_content(data)
+    app, connection, download = new_download(tmp_path, data, manifest=manifest)
+    hashing = []
+    overlapped = []
+    update = BlockCheck.update
+
+    def slow_update(check, piece):
+        hashing.append(piece)
+        time.sleep(0.002)
+        update(check, piece)
+        hashing.remove(piece)
+
+    read = Body.read
+
+    async def watched_read(body, n):
+        overlapped.append(bool(hashing))
+        return await read(body, n)
+
+    # a single worker, so any overlap is within one range
+    monkeypatch.setattr(
+        download_module,
+        "TransferController",
+        partial(TransferController, concurrency=1, max_concurrency=1),
+    )
+    monkeypatch.setattr(BlockCheck, "update", slow_update)
+    monkeypatch.setattr(Body, "read", watched_read)
+    assert asyncio.run(run(app, download))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert any(overlapped)
+
+
+def dropped_path(download, connection, dropped_at):
+    path = Path(connection, download.journal.chunk_size, download.journal.url)
+    path.alive = False
+    path.consecutive_failures = max_failures
+    path.dropped_at = dropped_at
+    download.paths[connection] = path
+    return path
+
+
+def test_failed_path_stays_dropped_while_cooling_down(tmp_path):
+    _, connection, download = new_download(tmp_path, b"x" * 1024)
+    now = time.monotonic()
+    path = dropped_path(download, connection, now)
+    connection.last_seen = now + 1
+    download.refresh_paths()
+
+    assert not path.alive
+
+
+def test_failed_path_needs_its_connection_heard_from(tmp_path):
+    _, connection, download = new_download(tmp_path, b"x" * 1024)
+    dropped_at = time.monotonic() - download_module.revive_delay - 1
+    path = dropped_path(download, connection, dropped_at)
+    connection.last_seen = dropped_at - 1
+    download.refresh_paths()
+
+    assert not path.alive
+
+
+def test_failed_path_is_revived_after_cooling_down(tmp_path):
+    _, connection, download = new_download(tmp_path, b"x" * 1024)
+    dropped_at = time.monotonic() - download_module.revive_delay - 1
+    path = dropped_path(download, connection, dropped_at)
+    connection.last_seen = dropped_at + 1
+    download.refresh_paths()
+
+    assert path.alive
+    assert path.consecutive_failures == 0
+
+
+def test_download_stripes_over_every_connection(tmp_path):
+    data = os.urandom(8 * 1024 ** 2)
+    app, first, download = new_download(tmp_path, data)
+    second = FakeConnection(data)
+    download.friend.connections.append(second)
+    assert asyncio.run(run(app, download))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert first.ranges and second.ranges
+
+
+def test_download_survives_losing_one_connection(tmp_path):
+    data = os.urandom(8 * 1024 ** 2)
+    app, first, download = new_download(tmp_path, data, fail_after=2)
+    download.friend.connections.append(FakeConnection(data))
+    assert asyncio.run(run(app, download))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert download.retries
+
+
+def test_downloaded_chunks_are_stored_and_reused(tmp_path):
+    data = os.urandom(1024 ** 2)
+    manifest = Manifest.for_content(data)
+    app, connection, download = new_download(tmp_path, data, manifest=manifest)
+    assert asyncio.run(run(app, download))
+    assert app.chunk_store.size == len(data)
+
+    os.remove(download.journal.target)
+    again = Download(download.friend, download.journal)
+    download.journal.reset()
+    ranges = connection.ranges
+    assert asyncio.run(run(app, again))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert again.reused == len(data)
+    assert connection.ranges == ranges
+
+
+def test_stored_chunks_stay_within_the_store_budget(tmp_path):
+    data = os.urandom(1024 ** 2)
+    manifest = Manifest.for_content(data, 64 * 1024)
+    app, _, download = new_download(tmp_path, data, manifest=manifest)
+    app.chunk_store.max_size = 256 * 1024
+    assert asyncio.run(run(app, download))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert 0 < app.chunk_store.size <= 256 * 1024
+
+
+def test_stalled_range_is_raced_on_another_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_module, "min_speculate_age", 0.1)
+    data = os.urandom(4 * 1024 ** 2)
+    manifest = Manifest.for_content(data)
+    app, stalled, download = new_download(
+        tmp_path, data, manifest=manifest, stall_after=1
+    )
+    download.friend.connections.append(FakeConnection(data, manifest))
+    # well inside the stalled ranges' deadline
+    assert asyncio.run(asyncio.wait_for(run(app, download), 5))
+
+    assert open(download.journal.target, "rb").read() == data
+    assert download.speculation_wins
+
+
+def test_bundle_modes_are_applied_once_it_is_complete(tmp_path):
+    source = tmp_path / "tree"
+    os.makedirs(source / "sub")
+    (source / "sub" / "locked").write_bytes(os.urandom(300 * 1024))
+    (source / "run").write_bytes(b"#!/bin/sh\n")
+    os.chmod(source / "sub" / "locked", 0o444)
+    os.chmod(source / "run", 0o755)
+    bundle = Bundle.scan(str(source))
+    reader = BundleReader(str(source), bundle)
+    data = reader.read(bundle.size)
+    reader.close()
+
+    app, connection, download = new_download(tmp_path, data)
+    connection.bundle = bundle
+    download.journal.type = bundle_type
+    assert asyncio.run(run(app, download))
+
+    target = download.journal.target
+    assert (source / "sub" / "locked").read_bytes() == open(
+        os.path.join(target, "sub", "locked"), "rb"
+    ).read()
+    assert os.stat(os.path.join(target, "sub", "locked")).st_mode & 0o777 == 0o444
+    assert os.stat(os.path.join(target, "run")).st_mode & 0o777 == 0o755
+
+
+def test_failing_to_record_a_range_ends_the_download(tmp_path):
+    data = os.urandom(4 * 1024 ** 2)
+    app, _, download = new_download(tmp_path, data)
+
+    async def checkpoint(fh=None):
+        raise OSError(28, "No space left on device")
+
+    download.journal.checkpoint = checkpoint
+    with pytest.raises(OSError):
+        asyncio.run(asyncio.wait_for(run(app, download), 5))
+    assert download.active_workers() == 0
+
+
+def test_a_worker_that_raises_is_replaced(tmp_path):
+    data = os.urandom(4 * 1024 ** 2)
+    app, _, download = new_download(tmp_path, data)
+    original = download.take_fetch
+    raised = []
+
+    def take_fetch(worker):
+        if not raised:
+            raised.append(worker)
+            raise RuntimeError("worker bug")
+        return original(worker)
+
+    download.take_fetch = take_fetch
+    assert asyncio.run(asyncio.wait_for(run(app, download), 5))
+    assert open(download.journal.target, "rb").read() == data
+
+
+def test_concurrency_is_capped_at_the_sockets_per_host(tmp_path):
+    data = os.urandom(8 * 1024 ** 2)
+    app, _, download = new_download(tmp_path, data)
+    app.client_pool.limit_per_host = 3
+    assert asyncio.run(run(app, download))
+
+    (path,) = download.paths.values()
+    assert path.controller.max_concurrency == 3
+    assert path.controller.concurrency <= 3
+
+
+def test_range_latency_is_timed_from_getting_a_socket():
+    fetch = download_module.Fetch(None, [0])
+    # queued behind other requests for a socket
+    fetch.start_time -= 10
+    assert fetch.elapsed() >= 10
+    fetch.connected()
+    assert fetch.elapsed() < 1
@@ -0,0 +1,27 @@
+import asyncio
+from slick.friend_list import FriendList
+
+
+class FakeApp:
+    def __init__(self, base):
+        self.base = base
+
+
+class FakeFriend:
+    def __init__(self, onion, digest):
+        self.onion = onion
+        self.digest = digest
+
+
+def test_lookups_return_none_for_strangers(tmp_path):
+    async def run():
+        friend_list = FriendList(FakeApp(str(tmp_path)))
+        friend = FakeFriend("known.onion", b"\x01")
+        friend_list._friends.append(friend)
+        return friend, friend_list
+
+    friend, friend_list = asyncio.run(run())
+    assert friend_list.get_friend_for_onion("known.onion") is friend
+    assert friend_list.get_friend_for_onion("stranger.onion") is None
+    assert friend_list.get_friend_for_digest(b"\x01") is friend
+    assert friend_list.get_friend_for_digest(b"\x02") is None
@@ -0,0 +1,158 @@
+import time
+import asyncio
+from slick import health as health_module
+from slick.health import HealthChecker, max_backoff, max_delay, presence_interval
+
+
+class FakeConnection:
+    def __init__(self, up=True, interval=5):
+        self.up = up
+        self.interval = interval
+        self.active = False
+        self.running = True
+        self.in_use = False
+        self.last_used = 0
+        self.last_seen = 0
+        self.failures = 0
+        self.probes = 0
+
+    async def probe(self, timeout):
+        self.probes += 1
+        await asyncio.sleep(0)
+        self.active = self.up
+        if self.up:
+            self.last_seen = time.monotonic()
+        return self.up
+
+
+def no_jitter(monkeypatch):
+    monkeypatch.setattr(health_module, "jitter", 0)
+
+
+def test_failing_connection_backs_off_up_to_the_cap(monkeypatch):
+    no_jitter(monkeypatch)
+    checker = HealthChecker(None)
+    connection = FakeConnection(interval=60)
+    connection.in_use = True
+    delays = []
+    for failures in range(8):
+        connection.failures = failures
+        delays.append(checker.next_delay(connection))
+
+    assert delays[:5] == [60, 120, 240, 480, 960]
+    assert max(delays) == min(60 * max_backoff, max_delay)
+
+
+def test_idle_connections_are_only_probed_for_presence(monkeypatch):
+    no_jitter(monkeypatch)
+    checker = HealthChecker(None)
+    connection = FakeConnection(interval=5)
+
+    assert checker.next_delay(connection) == presence_interval
+    connection.in_use = True
+    assert checker.next_delay(connection) == 5
+
+
+def test_failures_are_counted_and_reset_by_a_good_probe():
+    async def run():
+        checker = HealthChecker(None)
+        connection = FakeConnection(up=False)
+        checker.watch(connection)
+        await checker.check(connection)
+        await checker.check(connection)
+        failures = connection.failures
+        connection.up = True
+        await checker.check(connection)
+        return failures, connection.failures, checker.stats()
+
+    failures, after, stats = asyncio.run(run())
+    assert (failures, after) == (2, 0)
+    assert stats["probes"] == 3
+    assert stats["failures"] == 2
+
+
+def test_recent_traffic_stands_in_for_a_probe():
+    async def run():
+        checker = HealthChecker(None)
+        connection = FakeConnection()
+        checker.watch(connection)
+        await checker.check(connection)
+        # a transfer was heard from since the probe
+        connection.last_seen = time.monotonic() + 0.001
+        await checker.check(connection)
+        return connection.probes, checker.stats()["skipped"]
+
+    assert asyncio.run(run()) == (1, 1)
+
+
+def test_probes_run_at_most_probes_at_a_time():
+    async def run():
+        checker = HealthChecker(None, probes=2)
+        running = []
+        peak = []
+
+        class Slow(FakeConnection):
+            async def probe(self, timeout):
+                running.append(self)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.remove(self)
+                return True
+
+        connections = [Slow() for _ in range(6)]
+        await asyncio.gather(*[checker.check(c) for c in connections])
+        return max(peak)
+
+    assert asyncio.run(run()) == 2
+
+
+def test_stopped_connection_is_forgotten():
+    async def run():
+        checker = HealthChecker(None)
+        connection = FakeConnection()
+        checker.watch(connection)
+        connection.running = False
+        await checker.check(connection)
+        return connection.probes, checker.stats()["watched"]
+
+    assert asyncio.run(run()) == (0, 0)
+
+
+def test_open_returns_at_once_when_the_checker_is_stopped():
+    async def run():
+        checker = HealthChecker(None)
+        return await asyncio.wait_for(checker.open(FakeConnection()), 1)
+
+    assert asyncio.run(run()) is False
+
+
+def test_open_gives_up_after_open_timeout(monkeypatch):
+    monkeypatch.setattr(health_module, "open_timeout", 0.05)
+
+    async def run():
+        checker = HealthChecker(None)
+        checker.task = asyncio.get_event_loop().create_future()
+        connection = FakeConnection()
+        result = await asyncio.wait_for(checker.open(connection), 1)
+        return result, checker.waiters.get(connection)
+
+    assert asyncio.run(run()) == (False, [])
+
+
+def test_stop_and_forget_release_waiting_openers(monkeypatch):
+    monkeypatch.setattr(health_module, "open_timeout", 10)
+
+    async def run():
+        checker = HealthChecker(None)
+        # a run loop that never gets round to probing
+        checker.task = asyncio.get_event_loop().create_future()
+        forgotten, stopped = FakeConnection(), FakeConnection()
+        openers = [asyncio.ensure_future(checker.open(c)) for c in (forgotten, stopped)]
+        await asyncio.sleep(0)
+        checker.forget(forgotten)
+        first = await asyncio.wait_for(openers[0], 1)
+        await checker.stop()
+        second = await asyncio.wait_for(openers[1], 1)
+        return first, second, checker.waiters
+
+    assert asyncio.run(run()) == (False, False, {})
@@ -0,0 +1,127 @@
+import os
+import asyncio
+import pytest
+from slick import journal as journal_module
+from slick.journal import Journal
+
+
+def new_journal(tmp_path, size=10 * 1024, chunk_size=1024):
+    return Journal(
+        str(tmp_path / "target"),
+        url="/f/abc",
+        size=size,
+        type="file",
+        name="target",
+        friend=b"\x01" * 32,
+        chunk_size=chunk_size,
+    )
+
+
+class RecordingFile:
+    def __init__(self, journal, fail=False):
+        self.journal = journal
+        self.fail = fail
+        self.on_disk_at_fsync = []
+
+    async def fsync(self):
+        loaded = Journal.load(self.journal.target)
+        self.on_disk_at_fsync.append(loaded and bytes(loaded.completed))
+        if self.fail:
+            raise OSError("disk full")
+
+
+def test_flush_round_trips(tmp_path):
+    journal = new_journal(tmp_path)
+    journal.complete(0)
+    journal.complete(9)
+    asyncio.run(journal.flush())
+
+    loaded = Journal.load(journal.target)
+    assert loaded.matches(url="/f/abc", size=10 * 1024, type="file")
+    assert loaded.missing() == list(range(1, 9))
+
+
+def test_data_is_synced_before_the_journal_records_it(tmp_path):
+    journal = new_journal(tmp_path)
+    asyncio.run(journal.flush())
+    journal.complete(3)
+    fh = RecordingFile(journal)
+    asyncio.run(journal.flush(fh))
+
+    assert fh.on_disk_at_fsync == [bytes(2)]
+    assert Journal.load(journal.target).is_complete(3)
+
+
+def test_failed_sync_leaves_the_journal_behind(tmp_path):
+    journal = new_journal(tmp_path)
+    asyncio.run(journal.flush())
+    journal.complete(3)
+    with pytest.raises(OSError):
+        asyncio.run(journal.flush(RecordingFile(journal, fail=True)))
+
+    assert not Journal.load(journal.target).is_complete(3)
+    assert not os.path.exists(f"{journal.path}.tmp")
+
+
+def test_checkpoint_batches_flushes(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, "flush_interval", 3600)
+    monkeypatch.setattr(journal_module, "flush_bytes", 4 * 1024)
+    journal = new_journal(tmp_path)
+    fh = RecordingFile(journal)
+
+    async def run():
+        await journal.flush()
+        for index in range(10):
+            journal.complete(index)
+            await journal.checkpoint(fh)
+
+    asyncio.run(run())
+    # one flush up front, then one per four chunks
+    assert journal.flushes == 3
+    assert len(fh.on_disk_at_fsync) == 2
+    assert Journal.load(journal.target).missing() == [8, 9]
+
+
+def test_checkpoint_flushes_once_the_interval_passes(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, "flush_interval", 0)
+    journal = new_journal(tmp_path)
+    journal.complete(0)
+    asyncio.run(journal.checkpoint())
+
+    assert Journal.load(journal.target).is_complete(0)
+
+
+def test_checkpoint_does_not_wait_behind_a_running_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal_module, "flush_interval", 0)
+    journal = new_journal(tmp_path)
+
+    async def run():
+        journal.complete(0)
+        async with journal.lock:
+            await journal.checkpoint()
+
+    asyncio.run(run())
+    assert journal.flushes == 0
+
+
+def test_pick_target_skips_directories_and_leftover_journals(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("file")
+    open(Journal.path_for("file.1"), "w").close()
+
+    assert Journal.pick_target("some/where/file") == ("file.2", None)
+
+
+def test_pick_target_resumes_a_matching_journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = new_journal(tmp_path)
+    asyncio.run(journal.flush())
+    open(journal.target, "wb").close()
+
+    def resumes(existing):
+        return existing.matches(url="/f/abc", size=10 * 1024, type="file")
+
+    target, resumed = Journal.pick_target("target", resumes)
+    assert target == "target"
+    assert resumed.url == "/f/abc"
+    assert Journal.pick_target("target") == ("target.1", None)
@@ -0,0 +1,71 @@
+import io
+import os
+import pytest
+from slick.manifest import Manifest, chunk_hasher, hash_chunk, merkle_root
+
+
+def test_read_from_matches_for_content():
+    data = os.urandom(3 * 1024 + 17)
+    streamed = Manifest.read_from(io.BytesIO(data), chunk_size=1024)
+    whole = Manifest.for_content(data, chunk_size=1024)
+
+    assert len(streamed.leaves) == 4
+    assert streamed.leaves == whole.leaves
+    assert streamed.root == whole.root
+
+
+def test_encode_decode_round_trip():
+    manifest = Manifest.for_content(os.urandom(5000), chunk_size=1024)
+    decoded = Manifest.decode(1024, manifest.encode())
+
+    assert decoded.leaves == manifest.leaves
+    assert decoded.root == manifest.root
+
+
+def test_decode_rejects_a_truncated_manifest():
+    manifest = Manifest.for_content(os.urandom(5000), chunk_size=1024)
+    with pytest.raises(ValueError):
+        Manifest.decode(1024, manifest.encode()[:-1])
+
+
+def test_verify_checks_each_chunk():
+    data = os.urandom(3000)
+    manifest = Manifest.for_content(data, chunk_size=1024)
+
+    assert manifest.verify(1, data[1024:2048])
+    assert not manifest.verify(1, data[:1024])
+    assert not manifest.verify(3, b"")
+
+
+def test_root_changes_with_any_leaf_or_their_order():
+    leaves = [hash_chunk(bytes([i])) for i in range(5)]
+    root = merkle_root(leaves)
+
+    assert merkle_root(leaves[:4] + [hash_chunk(b"x")]) != root
+    assert merkle_root([leaves[1], leaves[0]] + leaves[2:]) != root
+
+
+def test_a_leaf_cannot_pose_as_a_subtree():
+    left, right = hash_chunk(b"left"), hash_chunk(b"right")
+    # a chunk holding exactly what an interior node hashes
+    forged = hash_chunk(b"\x01" + left + right)
+
+    assert merkle_root([left, right]) != forged
+    assert merkle_root([left, right, hash_chunk(b"x")]) != merkle_root(
+        [forged, hash_chunk(b"x")]
+    )
+
+
+def test_incremental_hasher_matches_hash_chunk():
+    hasher = chunk_hasher()
+    hasher.update(b"hello ")
+    hasher.update(b"world")
+
+    assert hasher.digest() == hash_chunk(b"hello world")
+
+
+def test_empty_content_has_a_root():
+    manifest = Manifest.for_content(b"")
+
+    assert manifest.leaves == []
+    assert manifest.root == hash_chunk(b"")
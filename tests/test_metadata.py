@@ -0,0 +1,65 @@
+import os
+import asyncio
+from slick.metadata import MetadataCache
+from slick.manifest import Manifest
+
+
+def write(path, data):
+    with open(path, "wb") as fh:
+        fh.write(data)
+    return str(path)
+
+
+def test_unchanged_file_is_served_from_the_cache(tmp_path):
+    path = write(tmp_path / "file", b"\x89PNG\r\n\x1a\n" + bytes(100))
+    cache = MetadataCache()
+
+    async def run():
+        first = await cache.get(path)
+        second = await cache.get(path)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first is second
+    assert first.mimetype == "image/png"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_rewritten_file_is_looked_at_again(tmp_path):
+    path = write(tmp_path / "file", b"one")
+    cache = MetadataCache()
+
+    async def run():
+        first = await cache.get(path)
+        write(path, b"three")
+        return first, await cache.get(path)
+
+    first, second = asyncio.run(run())
+    assert second is not first
+    assert second.size == 5
+
+
+def test_concurrent_manifest_requests_share_one_pass(tmp_path):
+    data = os.urandom(600 * 1024)
+    path = write(tmp_path / "file", data)
+    cache = MetadataCache()
+
+    async def run():
+        return await asyncio.gather(
+            cache.get(path, manifest=True), cache.get(path, manifest=True)
+        )
+
+    first, second = asyncio.run(run())
+    assert first.manifest is second.manifest
+    assert first.manifest.root == Manifest.for_content(data).root
+
+
+def test_cache_is_bounded(tmp_path):
+    cache = MetadataCache(max_entries=2)
+
+    async def run():
+        for index in range(4):
+            await cache.get(write(tmp_path / f"file{index}", b"x"))
+
+    asyncio.run(run())
+    assert len(cache.entries) == 2
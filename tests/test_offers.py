@@ -0,0 +1,113 @@
+import os
+import time
+import asyncio
+from slick import offers as offers_module
+from slick.offers import OfferRegistry
+from slick.metadata import FileMetadata
+
+
+class FakeApp:
+    def __init__(self, base):
+        self.base = base
+
+
+class FakeFriend:
+    def __init__(self, digest):
+        self.digest = digest
+
+
+def new_file(tmp_path, name, data=b"hello"):
+    path = str(tmp_path / name)
+    with open(path, "wb") as fh:
+        fh.write(data)
+    stat = os.stat(path)
+    return path, FileMetadata(size=stat.st_size, mtime=stat.st_mtime, mimetype="")
+
+
+def test_offers_are_saved_once_they_settle(tmp_path, monkeypatch):
+    monkeypatch.setattr(offers_module, "save_delay", 0.05)
+    registry = OfferRegistry(FakeApp(str(tmp_path)))
+    saves = []
+    original = registry._save
+    monkeypatch.setattr(registry, "_save", lambda data: saves.append(original(data)))
+
+    async def run():
+        offered = []
+        for index in range(20):
+            path, metadata = new_file(tmp_path, f"file{index}")
+            offered.append(registry.offer(FakeFriend(b"a"), path, metadata))
+        written_at_once = os.path.exists(registry.path)
+        await asyncio.sleep(0.2)
+        return offered, written_at_once
+
+    offered, written_at_once = asyncio.run(run())
+    assert not written_at_once
+    assert len(saves) == 1
+
+    reloaded = OfferRegistry(FakeApp(str(tmp_path)))
+    for offered_file in offered:
+        assert reloaded.get(offered_file.uuid).path == offered_file.path
+
+
+def test_stop_saves_pending_offers(tmp_path):
+    registry = OfferRegistry(FakeApp(str(tmp_path)))
+    path, metadata = new_file(tmp_path, "file")
+
+    async def run():
+        await registry.start()
+        offered_file = registry.offer(FakeFriend(b"a"), path, metadata)
+        await registry.stop()
+        return offered_file
+
+    offered_file = asyncio.run(run())
+    reloaded = OfferRegistry(FakeApp(str(tmp_path)))
+    assert reloaded.get(offered_file.uuid).has_permission(FakeFriend(b"a"))
+
+
+def test_get_leaves_stale_offers_to_the_sweep(tmp_path):
+    registry = OfferRegistry(FakeApp(str(tmp_path)))
+    path, metadata = new_file(tmp_path, "file")
+    kept_path, kept_metadata = new_file(tmp_path, "kept")
+
+    async def run():
+        offered_file = registry.offer(FakeFriend(b"a"), path, metadata)
+        kept = registry.offer(FakeFriend(b"a"), kept_path, kept_metadata)
+        os.remove(path)
+        before = registry.get(offered_file.uuid)
+        await registry.evict()
+        await registry.flush()
+        return offered_file, kept, before
+
+    offered_file, kept, before = asyncio.run(run())
+    assert before is offered_file
+    assert registry.get(offered_file.uuid) is None
+    assert registry.get(kept.uuid) is kept
+
+
+def test_expired_offers_are_not_served(tmp_path):
+    registry = OfferRegistry(FakeApp(str(tmp_path)), lifetime=-1)
+    path, metadata = new_file(tmp_path, "file")
+
+    async def run():
+        offered_file = registry.offer(FakeFriend(b"a"), path, metadata)
+        await registry.flush()
+        return offered_file
+
+    assert registry.get(asyncio.run(run()).uuid) is None
+
+
+def test_changed_file_gets_a_new_offer(tmp_path):
+    registry = OfferRegistry(FakeApp(str(tmp_path)))
+    path, metadata = new_file(tmp_path, "file")
+
+    async def run():
+        first = registry.offer(FakeFriend(b"a"), path, metadata)
+        time.sleep(0.01)
+        _, changed = new_file(tmp_path, "file", b"changed")
+        second = registry.offer(FakeFriend(b"a"), path, changed)
+        await registry.flush()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.uuid != second.uuid
+    assert registry.get(first.uuid) is None
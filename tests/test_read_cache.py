@@ -0,0 +1,62 @@
+import os
+import time
+import asyncio
+from slick.read_cache import ReadCache, CachedReader
+from slick.metadata import FileMetadata
+
+
+def test_concurrent_misses_share_one_read():
+    cache = ReadCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.01)
+        return b"data"
+
+    async def run():
+        return await asyncio.gather(*[cache.get("key", load) for _ in range(5)])
+
+    assert asyncio.run(run()) == [b"data"] * 5
+    assert len(loads) == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entries_are_dropped():
+    cache = ReadCache(max_size=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.put("c", b"12345")
+    cache.put("huge", b"x" * 11)
+
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.size == 10
+
+
+def test_reader_returns_the_requested_bytes(tmp_path):
+    data = os.urandom(10000)
+    path = str(tmp_path / "file")
+    with open(path, "wb") as fh:
+        fh.write(data)
+    metadata = FileMetadata(size=len(data), mtime=0, mimetype="")
+    cache = ReadCache()
+
+    async def read(start, stop):
+        reader = CachedReader(cache, path, metadata, chunk_size=4096)
+        await reader.seek(start)
+        parts = []
+        while start < stop:
+            part = await reader.read(stop - start)
+            if not part:
+                break
+            parts.append(bytes(part))
+            start += len(part)
+        return b"".join(parts)
+
+    async def run():
+        return await read(100, 9000), await read(4000, 10000)
+
+    first, second = asyncio.run(run())
+    assert first == data[100:9000]
+    assert second == data[4000:]
+    assert cache.stats()["misses"] == 3
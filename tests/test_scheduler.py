@@ -0,0 +1,96 @@
+import asyncio
+from slick.scheduler import TransferScheduler
+from slick.throttle import PrioritySemaphore
+
+
+class FakeDownload:
+    def __init__(self, name, started, gate):
+        self.name = name
+        self.started = started
+        self.gate = gate
+        self.priority = 0
+
+    async def run(self):
+        self.started.append(self.name)
+        await self.gate.wait()
+        return self.name
+
+
+def test_semaphore_wakes_the_highest_priority_first():
+    async def run():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        order = []
+
+        async def take(name, priority):
+            await semaphore.acquire(priority)
+            order.append(name)
+            semaphore.release()
+
+        tasks = [
+            asyncio.ensure_future(take("low", 0)),
+            asyncio.ensure_future(take("high", 5)),
+            asyncio.ensure_future(take("mid", 1)),
+        ]
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["high", "mid", "low"]
+
+
+def test_cancelled_waiter_does_not_leak_its_slot():
+    async def run():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+        waiter = asyncio.ensure_future(semaphore.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        semaphore.release()
+        await asyncio.sleep(0)
+        return semaphore.held, semaphore.waiting()
+
+    assert asyncio.run(run()) == (0, 0)
+
+
+def test_downloads_beyond_the_limit_queue_by_priority():
+    async def run():
+        scheduler = TransferScheduler(None, downloads=1)
+        started = []
+        gate = asyncio.Event()
+        downloads = [FakeDownload(name, started, gate) for name in "abc"]
+        tasks = [
+            asyncio.ensure_future(scheduler.run(download, priority))
+            for download, priority in zip(downloads, [0, 0, 3])
+        ]
+        await asyncio.sleep(0)
+        queued = scheduler.stats()["queued"]
+        gate.set()
+        await asyncio.gather(*tasks)
+        return started, queued
+
+    started, queued = asyncio.run(run())
+    assert queued == 2
+    assert started == ["a", "c", "b"]
+
+
+class FakeRequester:
+    priority = 0
+
+
+def test_messages_are_admitted_while_ranges_hold_every_bulk_slot():
+    async def run():
+        scheduler = TransferScheduler(None, requests=8, reserve=2)
+        for _ in range(6):
+            await scheduler.acquire(FakeRequester(), 0)
+        queued = asyncio.ensure_future(scheduler.acquire(FakeRequester(), 0))
+        await asyncio.sleep(0)
+        async with scheduler.interactive():
+            # admitted straight away, without any range giving its slot up
+            admitted = scheduler.stats()
+        blocked = not queued.done()
+        queued.cancel()
+        return blocked, admitted["requests"], admitted["messages"]
+
+    assert asyncio.run(run()) == (True, 6, 1)
@@ -0,0 +1,151 @@
+import os
+import asyncio
+from slick import delta
+from slick.server import TalkServer
+from slick.manifest import Manifest
+from fakes import FakeApp, FakeFriend
+
+
+class FakeRequest:
+    def __init__(self, onion, match_info, body=b""):
+        self.onion = onion
+        self.match_info = match_info
+        self.body = body
+
+    async def read(self):
+        return self.body
+
+
+class PlainTalkServer(TalkServer):
+    def common_name(self, request):
+        return request.onion
+
+
+def new_server(tmp_path):
+    friend = FakeFriend("friend")
+    app = FakeApp(str(tmp_path), [friend])
+    return PlainTalkServer(app), friend
+
+
+def offer(server, friend, path):
+    async def run():
+        metadata = await server.app.metadata.get(path)
+        return server.offer_file(friend, path, metadata)
+
+    return asyncio.run(run())
+
+
+def request_delta(server, offered_file, signature):
+    request = FakeRequest("friend", {"file_id": offered_file.uuid}, signature)
+    return asyncio.run(server.handle_delta(request))
+
+
+def test_delta_is_served_for_an_offer(tmp_path):
+    server, friend = new_server(tmp_path)
+    data = os.urandom(256 * 1024)
+    path = str(tmp_path / "file")
+    with open(path, "wb") as fh:
+        fh.write(data)
+    offered_file = offer(server, friend, path)
+    signature = delta.signature(path, len(data))
+
+    response = request_delta(server, offered_file, signature)
+    assert response.status == 200
+    assert delta.copies(response.body) == [(0, 0, len(data))]
+
+
+def test_delta_refuses_an_offer_that_changed(tmp_path):
+    server, friend = new_server(tmp_path)
+    path = str(tmp_path / "file")
+    with open(path, "wb") as fh:
+        fh.write(os.urandom(256 * 1024))
+    offered_file = offer(server, friend, path)
+    signature = delta.signature(path, 256 * 1024)
+    with open(path, "ab") as fh:
+        fh.write(b"more")
+
+    assert request_delta(server, offered_file, signature).status == 410
+
+
+def test_delta_rejects_a_bad_signature(tmp_path):
+    server, friend = new_server(tmp_path)
+    path = str(tmp_path / "file")
+    with open(path, "wb") as fh:
+        fh.write(os.urandom(256 * 1024))
+    offered_file = offer(server, friend, path)
+
+    assert request_delta(server, offered_file, b"garbage").status == 400
+
+
+def hold(server, data):
+    app = server.app
+    manifest = Manifest.for_content(data)
+
+    async def run():
+        await app.chunk_store.start()
+        await app.swarm.hold(manifest, len(data))
+
+    asyncio.run(run())
+    for index, leaf in enumerate(manifest.leaves):
+        if index % 2 == 0:
+            chunk = data[
+                index * manifest.chunk_size : (index + 1) * manifest.chunk_size
+            ]
+            app.chunk_store.put(leaf, chunk)
+    return manifest
+
+
+def test_have_lists_the_held_chunks(tmp_path):
+    server, _ = new_server(tmp_path)
+    manifest = hold(server, os.urandom(5 * 262_144))
+    request = FakeRequest("friend", {"root": manifest.root.hex()})
+    response = asyncio.run(server.handle_have(request))
+
+    assert response.status == 200
+    assert response.body == bytes([0b10101])
+
+
+def test_unknown_peer_gets_a_404(tmp_path):
+    server, _ = new_server(tmp_path)
+    manifest = hold(server, os.urandom(262_144))
+    match_info = {"root": manifest.root.hex()}
+
+    async def run():
+        return [
+            await server.handle_have(FakeRequest("stranger", match_info)),
+            await server.handle_content(FakeRequest("stranger", match_info)),
+            await server.handle_post(FakeRequest("stranger", {}, b"hi")),
+        ]
+
+    assert [response.status for response in asyncio.run(run())] == [404] * 3
+
+
+def test_unknown_root_gets_a_404(tmp_path):
+    server, _ = new_server(tmp_path)
+    request = FakeRequest("friend", {"root": bytes(32).hex()})
+
+    assert asyncio.run(server.handle_have(request)).status == 404
+    request = FakeRequest("friend", {"root": "not hex"})
+    assert asyncio.run(server.handle_have(request)).status == 404
+
+
+def test_deleted_offer_gets_a_404(tmp_path):
+    server, friend = new_server(tmp_path)
+    path = str(tmp_path / "file")
+    with open(path, "wb") as fh:
+        fh.write(os.urandom(1024))
+    offered_file = offer(server, friend, path)
+    os.remove(path)
+    request = FakeRequest("friend", {"file_id": offered_file.uuid})
+
+    async def run():
+        return [
+            (await handler(request)).status
+            for handler in (
+                server.handle_file,
+                server.handle_manifest,
+                server.handle_delta,
+            )
+        ]
+
+    assert asyncio.run(run()) == [404, 404, 404]
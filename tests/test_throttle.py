@@ -0,0 +1,45 @@
+import time
+import asyncio
+from slick.throttle import TokenBucket, UploadShaper
+
+
+class FakeFriend:
+    def __init__(self, digest):
+        self.digest = digest
+
+
+def test_bucket_allows_a_burst_then_paces():
+    async def run():
+        bucket = TokenBucket(100_000)
+        start = time.monotonic()
+        await bucket.consume(100_000)
+        burst = time.monotonic() - start
+        await bucket.consume(20000)
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(run())
+    assert burst < 0.05
+    assert 0.15 < total < 0.5
+
+
+def test_oversized_request_overdraws_the_bucket():
+    async def run():
+        bucket = TokenBucket(100_000, burst=10000)
+        await bucket.consume(50000)
+        return bucket.tokens
+
+    assert asyncio.run(run()) < 0
+
+
+def test_shaper_applies_friend_and_global_limits():
+    shaper = UploadShaper()
+    friend, other = FakeFriend(b"a"), FakeFriend(b"b")
+    shaper.set_rate(1000)
+    shaper.set_friend_rate(friend, 100)
+
+    assert [b.rate for b in shaper.buckets_for(friend)] == [100, 1000]
+    assert [b.rate for b in shaper.buckets_for(other)] == [1000]
+
+    shaper.set_friend_rate(friend, None)
+    shaper.set_rate(None)
+    assert shaper.buckets_for(friend) == []
@@ -0,0 +1,77 @@
+import os
+import time
+import random
+import asyncio
+import pytest
+from slick.writer import open_writer, writers
+
+
+@pytest.mark.parametrize("kind", sorted(writers))
+def test_out_of_order_pieces_land_in_place(tmp_path, kind):
+    size = 3 * 1024 ** 2 + 123
+    data = os.urandom(size)
+    piece = 64 * 1024
+    offsets = list(range(0, size, piece))
+    random.Random(1).shuffle(offsets)
+    path = str(tmp_path / "target")
+    released = []
+
+    async def run():
+        writer = await open_writer(kind, path, size, True)
+        for offset in offsets:
+            await writer.write(
+                memoryview(data)[offset : offset + piece],
+                offset,
+                release=lambda: released.append(1),
+            )
+        await writer.close()
+
+    asyncio.run(run())
+    assert open(path, "rb").read() == data
+    assert len(released) == len(offsets)
+
+
+def test_adjacent_pieces_are_coalesced(tmp_path):
+    size = 1024 ** 2
+    path = str(tmp_path / "target")
+    writes = []
+
+    async def run():
+        writer = await open_writer("pwrite", path, size, True)
+        original = writer._pwritev
+        writer._pwritev = lambda offset, buffers: (
+            writes.append(len(buffers)),
+            original(offset, buffers),
+        )
+        for offset in range(0, size, 4096):
+            await writer.write(bytes(4096), offset)
+        await writer.close()
+
+    asyncio.run(run())
+    assert writes == [size // 4096]
+
+
+def test_concurrent_flushes_both_wait_for_the_writes(tmp_path):
+    size = 1024 ** 2
+    path = str(tmp_path / "target")
+
+    async def run():
+        writer = await open_writer("pwrite", path, size, True)
+        original = writer._pwritev
+
+        def slow_pwritev(offset, buffers):
+            time.sleep(0.05)
+            original(offset, buffers)
+
+        writer._pwritev = slow_pwritev
+        await writer.write(b"x" * size, 0)
+        first = asyncio.ensure_future(writer.flush())
+        await asyncio.sleep(0)
+        await writer.flush()
+        with open(path, "rb") as fh:
+            on_disk = fh.read()
+        await first
+        await writer.close()
+        return on_disk
+
+    assert asyncio.run(run()) == b"x" * size